@@ -0,0 +1,88 @@
+"""
+Benchmark push and pull of synthetic ledgers against the in-process fake of the Sheets API
+
+    python -m benchmarks.bench_gsheet --items=5000 --months=12 --latency=0.05
+"""
+import datetime
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable
+
+import fire
+from googleapiclient.errors import HttpError
+
+from benchmarks import synthetic
+from src import application
+from src.ledger_repos import gsheet, sqlite
+from tests.fakes.gsheet import FakeSheetsService
+
+
+def _run(name: str, service: FakeSheetsService, fun: Callable[[gsheet.SheetConnection], None]):
+    service.reset_stats()
+    sheet = gsheet.SheetConnection("benchmark", service=service)
+    # the fake service simulates latency by itself, the client side throttling would hide it
+    sheet.min_flush_interval = datetime.timedelta(0)
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        fun(sheet)
+        sheet.flush()
+    except HttpError as err:
+        status = f"failed ({err.resp.status})"
+    elapsed = time.perf_counter() - start
+    stats = service.stats
+    print(
+        f"{name:<16} {status:<14} {stats.total_calls:>6} {stats.bytes_sent:>12} "
+        f"{stats.bytes_received:>12} {elapsed:>9.3f}s  {dict(stats.calls)}"
+    )
+
+
+def main(
+    items: int = 2000,
+    months: int = 12,
+    changed: float = 0.05,
+    latency: float = 0.0,
+    error_rate: float = 0.0,
+    seed: int = 42,
+):
+    """
+    Push all the months, pull them back, then push only the changed items
+    """
+    month_list = synthetic.months_back(months)
+    service = FakeSheetsService(latency=latency, error_rate=error_rate, seed=seed)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        with sqlite.db_context(Path(tmp_dir) / "benchmark.db") as db:
+            repo = sqlite.LedgerItemRepo(db)
+            ledger_items = list(synthetic.generate_ledger(items, month_list, seed=seed))
+            repo.insert(application._set_amount_eur(ledger_items))
+
+            print(f"{items} items over {months} months, latency {latency}s per request")
+            print(
+                f"{'scenario':<16} {'status':<14} {'calls':>6} {'bytes sent':>12} "
+                f"{'bytes recv':>12} {'wall time':>10}"
+            )
+            _run(
+                "push months",
+                service,
+                lambda sheet: application.push_to_gsheet(db=db, sheet=sheet, months=month_list),
+            )
+            _run(
+                "pull months",
+                service,
+                lambda sheet: application.pull_from_gsheet(db=db, sheet=sheet, months=month_list),
+            )
+
+            for ledger_item in ledger_items[: int(items * changed)]:
+                ledger_item.category = "Changed"
+                repo.update(ledger_item)
+            _run(
+                "push changed",
+                service,
+                lambda sheet: application.push_to_gsheet(db=db, sheet=sheet, months=[]),
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
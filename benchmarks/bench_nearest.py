@@ -0,0 +1,70 @@
+"""
+Build time and lookup latency of NearestTransactionClassifier on many distinct merchants
+
+    python -m benchmarks.bench_nearest --rows=1000000
+"""
+import random
+import string
+import time
+
+import fire
+import numpy as np
+import pandas as pd
+
+from benchmarks import synthetic
+from src import classifiers
+
+
+def _merchant(rng: random.Random) -> str:
+    return " ".join(
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+        for _ in range(rng.randint(1, 3))
+    )
+
+
+def main(rows: int = 100000, merchants: int | None = None, lookups: int = 2000, seed: int = 42):
+    rng = random.Random(seed)
+    names = [_merchant(rng) for _ in range(merchants or rows // 2)]
+    categories = sorted({category for _, category, _ in synthetic.MERCHANTS})
+    merchant_categories = [rng.choice(categories) for _ in names]
+    prefixes = [template.split("{")[0] for template in synthetic.DESCRIPTION_TEMPLATES]
+    data = pd.DataFrame(
+        {
+            "tx_id": [str(i) for i in range(rows)],
+            "description": [
+                f"{prefixes[i % len(prefixes)]}{names[i % len(names)]}" for i in range(rows)
+            ],
+            "counterparty": [names[i % len(names)] for i in range(rows)],
+            "category": [merchant_categories[i % len(names)] for i in range(rows)],
+            "labels": "",
+        }
+    )
+
+    classifier = classifiers.NearestTransactionClassifier()
+    start = time.perf_counter()
+    classifier.fit(classifiers.TrainingData(data, watermark=0))
+    build_time = time.perf_counter() - start
+
+    latencies = []
+    correct = 0
+    for _ in range(lookups):
+        row = rng.randrange(rows)
+        index = row % len(names)
+        # a new transaction of a known merchant, with a different reference and no counterparty
+        description = f"{prefixes[row % len(prefixes)]}{names[index]} rif. {rng.randint(1, 9999)}"
+        item = {"description": description, "counterparty": ""}
+        start = time.perf_counter()
+        prediction, _, _ = classifier.predict_with_meta(item)
+        latencies.append(time.perf_counter() - start)
+        correct += prediction["category"] == merchant_categories[index]
+
+    latencies = np.array(latencies) * 1000
+    print(f"{rows} rows, {len(classifier.texts)} distinct texts, built in {build_time:.1f}s")
+    print(
+        f"lookup p50 {np.percentile(latencies, 50):.3f}ms, p99 {np.percentile(latencies, 99):.3f}ms"
+        f", accuracy {correct / lookups:.3f}"
+    )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
@@ -0,0 +1,56 @@
+"""
+Import time of the CLI, measured with `python -X importtime`, against a budget
+
+    python -m benchmarks.bench_startup
+    python -m benchmarks.bench_startup --module=src.application --budget_ms=3000
+
+The process exits with an error if the import takes longer than the budget
+"""
+import subprocess
+import sys
+
+import fire
+
+# run.py imports src.commands, which must not import the heavy subsystems
+BUDGET_MS = 300
+
+
+def import_times(module: str) -> list[tuple[str, int]]:
+    """
+    Return the imported modules with their cumulative import time in microseconds
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times.append((name.rstrip(), int(cumulative)))
+    return times
+
+
+def main(module: str = "src.commands", budget_ms: int = BUDGET_MS, top: int = 10, runs: int = 3):
+    # the best of a few runs, the first one can include reading the files from disk
+    runs_times = [import_times(module) for _ in range(runs)]
+    times = min(runs_times, key=lambda times: times[-1][1])
+    total_ms = times[-1][1] / 1000
+    print(f"import {module}: {total_ms:.0f}ms (budget {budget_ms}ms)")
+    # the modules imported directly by the measured one are indented by one level
+    direct = [
+        (name.strip(), cumulative)
+        for name, cumulative in times
+        if len(name) - len(name.lstrip()) == 3
+    ]
+    for name, cumulative in sorted(direct, key=lambda x: x[1], reverse=True)[:top]:
+        print(f"{cumulative / 1000:>9.1f}ms  {name}")
+    if total_ms > budget_ms:
+        sys.exit(f"{module} import time over budget: {total_ms:.0f}ms > {budget_ms}ms")
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
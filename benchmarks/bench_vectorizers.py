@@ -0,0 +1,93 @@
+"""
+Compare the "count" and "hashing" features of SimpleClassifier: accuracy, fit time, predict
+latency and size of the pickled model
+
+    python -m benchmarks.bench_vectorizers --items=20000
+    python -m benchmarks.bench_vectorizers --db_path=data/budget.db  # on real data
+"""
+import pickle
+import tempfile
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import fire
+
+from benchmarks import synthetic
+from src import classifiers, models
+from src.ledger_repos import sqlite
+
+
+def _get_items(db_path: str | None, items: int, seed: int) -> list[models.LedgerItem]:
+    if not db_path:
+        return list(synthetic.generate_ledger(items, synthetic.months_back(24), seed=seed))
+    with sqlite.db_context(db_path) as db:
+        return [
+            item
+            for month in sqlite.LedgerItemRepo(db).get_months()
+            for item in sqlite.LedgerItemRepo(db).get_month_data(month)
+        ]
+
+
+def main(
+    db_path: str | None = None,
+    items: int = 10000,
+    test_ratio: float = 0.2,
+    classifier: str = "CategoryFromDescriptionCounterpartyClassifier",
+    seed: int = 42,
+):
+    classifier_class = getattr(classifiers, classifier)
+    labeled = [
+        item
+        for item in _get_items(db_path, items, seed)
+        if all(getattr(item, field) for field in classifier_class.label_fields)
+    ]
+    test_size = int(len(labeled) * test_ratio)
+    train_items, test_items = labeled[test_size:], labeled[:test_size]
+    test_dicts = [models.asdict(item) for item in test_items]
+    expected = [
+        {field: getattr(item, field) for field in classifier_class.label_fields}
+        for item in test_items
+    ]
+
+    print(f"{classifier}: {len(train_items)} training items, {len(test_items)} test items")
+    print(
+        f"{'features':<10} {'accuracy':>9} {'fit time':>10} {'predict/item':>13} "
+        f"{'batch predict':>14} {'model size':>12}"
+    )
+    backend = "wordnet" if classifiers.has_nltk_resources() else "simple"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        train_db_path = Path(tmp_dir) / "train.db"
+        with sqlite.db_context(train_db_path) as db:
+            sqlite.LedgerItemRepo(db).insert(train_items)
+
+        for features in ["count", "hashing"]:
+            # a fresh cache for each run, so normalization is timed the same way
+            with patch.object(
+                classifiers, "_normalizer", classifiers.TextNormalizer(backend=backend)
+            ):
+                model = classifier_class(features=features)
+                start = time.perf_counter()
+                model.train(train_db_path)
+                fit_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                for item_dict in test_dicts[:200]:
+                    model.predict_with_meta(item_dict)
+                single_latency = (time.perf_counter() - start) / max(len(test_dicts[:200]), 1)
+
+                start = time.perf_counter()
+                predictions = model.predict_many(test_dicts)
+                batch_time = time.perf_counter() - start
+
+            correct = sum(p == e for (p, _, _), e in zip(predictions, expected))
+            accuracy = correct / len(expected) if expected else 0.0
+            size = len(pickle.dumps(model))
+            print(
+                f"{features:<10} {accuracy:>9.3f} {fit_time:>9.3f}s {single_latency * 1000:>11.3f}ms "
+                f"{batch_time:>13.3f}s {size / 1024:>10.0f}KB"
+            )
+
+
+if __name__ == "__main__":
+    fire.Fire(main)
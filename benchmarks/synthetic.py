@@ -0,0 +1,89 @@
+"""
+Deterministic synthetic ledgers used by the benchmarks
+"""
+import datetime
+import random
+from decimal import Decimal
+from typing import Generator
+
+from src import models
+
+MERCHANTS = [
+    ("Esselunga", "Groceries", "food"),
+    ("Carrefour Express", "Groceries", "food"),
+    ("Lidl Italia", "Groceries", "food"),
+    ("Bar Centrale", "Eating out", "food,coffee"),
+    ("Trattoria da Mario", "Eating out", "food"),
+    ("ATM Milano", "Transport", "commute"),
+    ("Trenitalia", "Transport", "travel"),
+    ("Italo Treno", "Transport", "travel"),
+    ("Enel Energia", "Utilities", "home"),
+    ("Fastweb", "Utilities", "home"),
+    ("Netflix", "Subscriptions", "entertainment"),
+    ("Spotify AB", "Subscriptions", "entertainment"),
+    ("Amazon EU", "Shopping", ""),
+    ("Decathlon", "Shopping", "sport"),
+    ("Farmacia Comunale", "Health", ""),
+    ("Palestra Fit", "Health", "sport"),
+    ("Booking.com", "Holidays", "travel"),
+    ("Ryanair", "Holidays", "travel"),
+    ("Acme S.p.A.", "Salary", "income"),
+    ("Condominio Via Roma", "Rent", "home"),
+]
+
+DESCRIPTION_TEMPLATES = [
+    "Pagamento POS {merchant} {city}",
+    "MULTIFUNZIONE CONTACTLESS {merchant} carta ****{card}",
+    "Addebito SDD {merchant} rif. {ref}",
+    "{merchant} {city} {ref}",
+]
+
+CITIES = ["MILANO", "ROMA", "TORINO", "BOLOGNA", "NAPOLI", "FIRENZE"]
+
+
+def months_back(count: int, last: str = "2023-12") -> list[str]:
+    day = datetime.date.fromisoformat(f"{last}-01")
+    months = []
+    while len(months) < count:
+        months.append(day.strftime("%Y-%m"))
+        day = day.replace(day=1) - datetime.timedelta(days=1)
+    return sorted(months)
+
+
+def generate_ledger(
+    items: int, months: list[str], labeled_ratio: float = 0.8, seed: int = 42
+) -> Generator[models.LedgerItem, None, None]:
+    """
+    Generate `items` ledger items spread over `months`, a `labeled_ratio` of them has
+    counterparty, category and labels set
+    """
+    rng = random.Random(seed)
+    for i in range(items):
+        month = months[i % len(months)]
+        merchant, category, labels = rng.choice(MERCHANTS)
+        tx_date = datetime.date.fromisoformat(f"{month}-{rng.randint(1, 28):02d}")
+        tx_datetime = datetime.datetime.combine(
+            tx_date, datetime.time(rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+        )
+        description = rng.choice(DESCRIPTION_TEMPLATES).format(
+            merchant=merchant.upper() if rng.random() < 0.5 else merchant,
+            city=rng.choice(CITIES),
+            card=rng.randint(1000, 9999),
+            ref=rng.randint(100000, 999999),
+        )
+        labeled = rng.random() < labeled_ratio
+        yield models.LedgerItem(
+            tx_id=models.calculate_unique_id(f"synthetic:{seed}:{i}"),
+            tx_date=tx_date,
+            tx_datetime=tx_datetime,
+            amount=Decimal(rng.randint(-20000, 2000)) / 100,
+            currency="EUR",
+            description=description,
+            account=rng.choice(["Fineco EUR", "Fineco VISA", "Revolut EUR", "Satispay"]),
+            ledger_item_type=models.LedgerItemType.INCOME
+            if category == "Salary"
+            else models.LedgerItemType.EXPENSE,
+            counterparty=merchant if labeled else None,
+            category=category if labeled else None,
+            labels=(labels or None) if labeled else None,
+        )
@@ -9,6 +9,16 @@ ROOT_FOLDER = Path(__file__).parent
 DATA_FOLDER = ROOT_FOLDER / os.getenv("DATA_FOLDER", "data")
 DB_PATH = ROOT_FOLDER / os.getenv("DB_PATH", "data/budget.db")
 MODEL_FOLDER = ROOT_FOLDER / os.getenv("MODEL_FOLDER", "models")
+PROFILE_FOLDER = ROOT_FOLDER / os.getenv("PROFILE_FOLDER", "profiles")
+METRICS_PATH = ROOT_FOLDER / os.getenv("METRICS_PATH", "metrics/runs.jsonl")
+# folder of the Prometheus node exporter textfile collector, the metrics are written only if set
+METRICS_TEXTFILE_DIR = os.getenv("METRICS_TEXTFILE_DIR")
+# raw responses of the downloader APIs, reused while younger than the TTL in seconds
+RESPONSE_CACHE_FOLDER = ROOT_FOLDER / os.getenv("RESPONSE_CACHE_FOLDER", "responses")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "0"))
+SERVER_SOCKET = ROOT_FOLDER / os.getenv("SERVER_SOCKET", "data/budget.sock")
+RULES_PATH = ROOT_FOLDER / os.getenv("RULES_PATH", "data/rules.json")
+CLASSIFIER_FEATURES = os.getenv("CLASSIFIER_FEATURES", "count")  # "count" or "hashing"
 
 GSHEET_SHEET_ID = os.getenv("GSHEET_SHEET_ID")
 GSHEET_CREDENTIALS = ROOT_FOLDER / os.getenv("GSHEET_CREDENTIALS", "credentials.json")
@@ -1,13 +1,31 @@
 #!/usr/bin/env python3
 import logging
 import os
+import sys
+from contextlib import ExitStack
+from pathlib import Path
 
 import fire
 
-from src import commands
+import config
+from src import commands, metrics
 
 LOGLEVEL = os.environ.get("LOGLEVEL", "INFO").upper()
 logging.basicConfig(level=LOGLEVEL)
 
 if __name__ == "__main__":
-    fire.Fire(commands.Commands)
+    argv = sys.argv[1:]
+    mode = folder = None
+    if any(arg.startswith("--profile") for arg in argv):
+        from src import profiling
+
+        mode, folder, argv = profiling.pop_profile_options(argv)
+    command = next((arg for arg in argv if not arg.startswith("-")), "help")
+
+    with ExitStack() as stack:
+        stack.enter_context(metrics.run(command, config.METRICS_PATH, config.METRICS_TEXTFILE_DIR))
+        if mode:
+            stack.enter_context(
+                profiling.profile(mode, Path(folder or config.PROFILE_FOLDER), command)
+            )
+        fire.Fire(commands.Commands, command=argv)
@@ -1,13 +1,18 @@
+import asyncio
 import datetime
 import logging
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from decimal import Decimal
+from functools import cache
 from pathlib import Path
-from typing import Iterable
+from typing import AsyncGenerator, Generator, Iterable
 
 import currency_converter
 
 import config
-from src import classifiers, extractors, models
+from src import classifiers, extractors, metrics, models, pipeline, rules
 from src.ledger_repos import gsheet, sqlite
 
 logger = logging.getLogger(__name__)
@@ -21,62 +26,204 @@ class ExtractorNotFoundError(ValueError):
     pass
 
 
+@dataclass
+class ImportedFile:
+    """
+    Transactions read from a file, or from a member of an archive
+    """
+
+    path: Path
+    # name of the file in the archive
+    member: str | None
+    importer: str
+    items: list[models.LedgerItem]
+
+
+@metrics.timer("stage", stage="import_files")
 def import_files(*, files: list[Path], months: list[str] | None = None):
     """
     Search for all the files contained in the data folder, for each try all the Importers until one works, then store the data in the database
     """
-    ledger_items = []
-    for file in files:
-        for importer_class in extractors.get_importers():
-            try:
-                ledger_items = _import_file(file, importer_class)
-            except extractors.FormatFileError:
-                continue
-            except TypeError:
-                continue
-            else:
-                break
-        else:
-            logger.error(f"Unable to import file {file}")
+    for imported in read_files(files=files, months=months):
+        store_imported(imported=imported)
 
-        if ledger_items:
-            if months:
-                ledger_items = [
-                    item for item in ledger_items if item.tx_date.strftime("%Y-%m") in months
-                ]
-            store(items=ledger_items, duplicate_strategy=sqlite.DuplicateStrategy.SKIP)
 
-
-def _import_file(file_path: Path, importer_class: type[extractors.Importer]):
+def read_files(
+    *, files: list[Path], months: list[str] | None = None
+) -> Generator[ImportedFile, None, None]:
+    """
+    Parse the files with the first Importer that works, yield the items of each file. The files
+    in the zip, gzip and tar.gz archives are read from the archive, without extracting them
+    """
+    for file in files:
+        for source in _get_sources(file):
+            metrics.incr("files_scanned")
+            ledger_items = []
+            for importer_class in extractors.get_importers():
+                try:
+                    ledger_items = _import_file(source, importer_class)
+                except extractors.FormatFileError:
+                    continue
+                except TypeError:
+                    continue
+                else:
+                    break
+            else:
+                metrics.incr("files_not_imported")
+                logger.error(f"Unable to import file {source}")
+
+            if ledger_items:
+                if months:
+                    ledger_items = [
+                        item for item in ledger_items if item.tx_date.strftime("%Y-%m") in months
+                    ]
+                yield ImportedFile(
+                    path=file,
+                    member=source.name if source is not file else None,
+                    importer=importer_class.__name__,
+                    items=ledger_items,
+                )
+
+
+def _get_sources(file: Path) -> Iterable[Path | extractors.archives.Member]:
+    if extractors.archives.is_archive(file):
+        return extractors.archives.iter_members(file)
+    return [file]
+
+
+def _import_file(
+    file_path: Path | extractors.archives.Member, importer_class: type[extractors.Importer]
+):
     importer = importer_class(file_path)
-    data = list(importer.get_ledger_items())
+    name = type(importer).__name__
+    metrics.incr("importer_attempts", importer=name)
+    with metrics.timer("parse_file", importer=name):
+        data = list(importer.get_ledger_items())
     if data:
         logger.debug(f"Importing {len(data)} items from {file_path}")
+        metrics.incr("rows_parsed", len(data), source=name)
     return data
 
 
-def download(*, months: list[str] | None = None):
+@metrics.timer("stage", stage="download")
+@sqlite.db
+def download(*, db: sqlite.Connection, months: list[str] | None = None, from_cache: bool = False):
     """
-    Download the transactions for a given month
+    Download the transactions for the given months, without months the incremental downloaders
+    get only what changed since the previous download.
+
+    With `from_cache` the transactions are derived again from the cached responses of the APIs,
+    see `extractors.cache`, and update the stored ones
     """
     logger.info(f"Downloading transactions for {months}")
-    for downloader_class in extractors.get_downloaders():
-        client = downloader_class()
+    if from_cache:
+        cache_policy, watermarks = extractors.cache.Policy.REPLAY, {}
+    else:
+        cache_policy = extractors.cache.Policy.USE
+        watermarks = sqlite.SyncWatermarkRepo(db).get_all()
+    for changes in download_items(months=months, watermarks=watermarks, cache_policy=cache_policy):
+        store_changes(db=db, changes=changes, update=from_cache)
+        db.commit()
 
-        if months:
-            ledger_items = []
-            for month in months:
-                ledger_items.extend(client.get_ledger_items(month))
-        else:
-            ledger_items = client.get_ledger_items()
 
-        store(items=ledger_items, duplicate_strategy=sqlite.DuplicateStrategy.SKIP)
+def download_items(
+    *,
+    months: list[str] | None = None,
+    watermarks: dict[str, str] | None = None,
+    cache_policy: extractors.cache.Policy = extractors.cache.Policy.USE,
+) -> Generator[extractors.Changes, None, None]:
+    """
+    Yield the transactions downloaded by the Downloaders, month by month as soon as they arrive,
+    all the months of all the providers are fetched at the same time.
+
+    Without months, the incremental downloaders return the changes after their `watermarks`
+    """
+    loop = asyncio.new_event_loop()
+    batches = _download(
+        list(extractors.get_downloaders()), months or [None], watermarks or {}, cache_policy
+    )
+    try:
+        while True:
+            try:
+                yield loop.run_until_complete(anext(batches))
+            except StopAsyncIteration:
+                break
+    finally:
+        loop.run_until_complete(batches.aclose())
+        loop.run_until_complete(loop.shutdown_default_executor())
+        loop.close()
+
+
+async def _download(
+    downloader_classes: list[type[extractors.Downloader]],
+    months: list[str | None],
+    watermarks: dict[str, str],
+    cache_policy: extractors.cache.Policy,
+) -> AsyncGenerator[extractors.Changes, None]:
+    async def fetch(client_task: asyncio.Task, semaphore: asyncio.Semaphore, month: str | None):
+        client = await client_task
+        name = type(client).__name__
+        async with semaphore:
+            with metrics.timer("download", downloader=name):
+                if month is None and client.incremental:
+                    changes = await client.fetch_changes(watermarks.get(name))
+                else:
+                    changes = extractors.Changes(items=await client.fetch(month))
+        changes.source = name
+        metrics.incr("rows_parsed", len(changes.items), source=name)
+        metrics.incr("rows_deleted_at_source", len(changes.deleted), source=name)
+        return changes
+
+    tasks = []
+    for downloader_class in downloader_classes:
+        # creating the client can call the API too
+        client_task = asyncio.ensure_future(
+            asyncio.to_thread(downloader_class, cache_policy=cache_policy)
+        )
+        semaphore = asyncio.Semaphore(downloader_class.max_concurrency)
+        tasks.extend(asyncio.ensure_future(fetch(client_task, semaphore, m)) for m in months)
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
 
 ################
 ### STORE DATA
 
 
+@sqlite.db
+def store_imported(*, db: sqlite.Connection, imported: ImportedFile):
+    """
+    Store the transactions read from a file, and record the file in the import manifest
+    """
+    store(db=db, items=imported.items, duplicate_strategy=sqlite.DuplicateStrategy.SKIP)
+    sqlite.ImportManifestRepo(db).add(
+        str(imported.path), imported.member, imported.importer, len(imported.items)
+    )
+
+
+@sqlite.db
+def store_changes(*, db: sqlite.Connection, changes: extractors.Changes, update: bool = False):
+    """
+    Store the downloaded transactions. The changes of an incremental download, or any with
+    `update`, update the existing items too and delete the deleted ones, then the watermark of
+    their source is moved forward
+    """
+    incremental = changes.watermark is not None
+    if not (incremental or update):
+        store(db=db, items=changes.items, duplicate_strategy=sqlite.DuplicateStrategy.SKIP)
+        return
+    store(db=db, items=changes.items, duplicate_strategy=sqlite.DuplicateStrategy.UPDATE)
+    sqlite.LedgerItemRepo(db).delete(changes.deleted)
+    if incremental:
+        sqlite.SyncWatermarkRepo(db).set(changes.source, changes.watermark)
+
+
+@metrics.timer("stage", stage="store")
 @sqlite.db
 def store(
     *,
@@ -101,20 +248,39 @@ def store(
     )
 
 
+@cache
+def _get_currency_converter() -> currency_converter.CurrencyConverter:
+    # the rates are downloaded from the ECB, so build it only when a conversion is needed
+    return currency_converter.CurrencyConverter(
+        currency_converter.ECB_URL, fallback_on_missing_rate=True, decimal=True
+    )
+
+
+# EUR rate of a currency on a day, the transactions of the same day share it
+_fx_rates: dict[tuple[str, datetime.date], Decimal] = {}
+
+
+def _get_eur_rate(currency: str, date: datetime.date) -> Decimal:
+    if (rate := _fx_rates.get((currency, date))) is not None:
+        metrics.incr("fx_lookups", result="hit")
+        return rate
+    metrics.incr("fx_lookups", result="miss")
+    # the same rate used by `convert(amount, currency, "EUR")`, which returns amount / rate
+    rate = _fx_rates[currency, date] = _get_currency_converter().convert(
+        Decimal(1), "EUR", currency, date=date
+    )
+    return rate
+
+
 def _set_amount_eur(items: Iterable[models.LedgerItem]) -> Iterable[models.LedgerItem]:
     """
     Set the amount in EUR for the transactions
     """
-    c = currency_converter.CurrencyConverter(
-        currency_converter.ECB_URL, fallback_on_missing_rate=True, decimal=True
-    )
     for item in items:
         if item.currency == "EUR":
             item.amount_eur = item.amount
         else:
-            item.amount_eur = c.convert(
-                Decimal(str(item.amount)), item.currency, "EUR", date=item.tx_date
-            )
+            item.amount_eur = Decimal(str(item.amount)) / _get_eur_rate(item.currency, item.tx_date)
         yield item
 
 
@@ -122,11 +288,15 @@ def _set_amount_eur(items: Iterable[models.LedgerItem]) -> Iterable[models.Ledge
 ### GOOGLE SHEET
 
 
+@metrics.timer("stage", stage="push")
 @gsheet.sheet
 @sqlite.db
 def push_to_gsheet(
     *, db: sqlite.Connection, sheet: gsheet.SheetConnection, months: list[str] | None = None
 ):
+    # operations left from previous runs go first, they are older than the ones queued here
+    flush_outbox(db=db, sheet=sheet)
+
     local_repo = sqlite.LedgerItemRepo(db)
     remote_repo = gsheet.LedgerItemRepo(sheet, models.LedgerItem.get_field_names())
 
@@ -137,22 +307,20 @@ def push_to_gsheet(
 
     if not months:
         logger.info("Pushing all changed data")
-        for month, data in local_repo.get_updated_data_by_month():
+        updated = dict(local_repo.get_updated_data_by_month())
+        deleted = local_repo.get_deleted_by_month()
+        for month in sorted(updated.keys() | deleted.keys()):
             logger.info(f"Pushing month {month}")
-            remote_repo.update_month_data(month, data)
+            remote_repo.update_month_data(month, updated.get(month, []), deleted.get(month, []))
             local_repo.mark_month_as_synced(month)
 
 
+@metrics.timer("stage", stage="pull")
 @gsheet.sheet
 @sqlite.db
 def pull_from_gsheet(
     *, db: sqlite.Connection, sheet: gsheet.SheetConnection, months: list[str] | None = None
 ):
-    local_repo = sqlite.LedgerItemRepo(db)
-    remote_repo = gsheet.LedgerItemRepo(
-        sheet_connection=sheet, header=models.LedgerItem.get_field_names()
-    )
-
     if not months:
         # get last three months
         day = datetime.date.today()
@@ -160,27 +328,241 @@ def pull_from_gsheet(
             months.append(day.strftime("%Y-%m"))
             day = day.replace(day=1) - datetime.timedelta(days=1)
 
-    for month in months:
-        month_data = remote_repo.get_month_data(month)
-        month_data = _set_amount_eur(month_data)
-        local_repo.replace_month_data(month, month_data)
+    _replace_months(db, _get_remote_months(sheet, months))
+
+
+def _get_remote_months(
+    sheet: gsheet.SheetConnection, months: list[str]
+) -> dict[str, list[models.LedgerItem]]:
+    remote_repo = gsheet.LedgerItemRepo(
+        sheet_connection=sheet, header=models.LedgerItem.get_field_names()
+    )
+    return {month: list(remote_repo.get_month_data(month)) for month in months}
+
+
+def _replace_months(db: sqlite.Connection, data: dict[str, list[models.LedgerItem]]):
+    local_repo = sqlite.LedgerItemRepo(db)
+    for month, month_data in data.items():
+        local_repo.replace_month_data(month, _set_amount_eur(month_data))
+
+
+@gsheet.sheet
+@sqlite.db
+def flush_outbox(*, db: sqlite.Connection, sheet: gsheet.SheetConnection, batch_size: int = 100):
+    """
+    Send the sheet operations stored in the outbox when the sheet was unreachable
+    """
+    outbox = gsheet.OutboxRepo(db)
+    if not (pending := outbox.count()):
+        return
+    logger.info(f"Sending {pending} operations from the outbox")
+    try:
+        sheet.drain(outbox, batch_size=batch_size)
+    except Exception as err:
+        if not gsheet.is_offline_error(err):
+            raise
+        logger.warning(f"Unable to reach the sheet ({err}), {outbox.count()} operations left")
 
 
 ################
 ### TRAIN AND GUESS
 
 
-def train(classifier_names: list[str] | None = None):
+def _train_classifier(
+    classifier_class: type[classifiers.ClassifierInterface],
+    data: classifiers.TrainingData,
+    incremental: bool = False,
+    refit: bool = False,
+) -> str:
+    """
+    Train or update a classifier and save it, return the version of the saved artifact
+    """
+    start = time.perf_counter()
+    classifier = None
+    if incremental and not refit:
+        classifier = classifier_class().load()
+    if classifier is not None and classifier.online:
+        logger.info(f"updating {classifier.name}")
+        classifier.update(db_path=config.DB_PATH)
+    else:
+        classifier = classifier_class(online=incremental)
+        logger.info(f"training {classifier.name}")
+        classifier.fit(data)
+    classifier.save()
+    metrics.observe("train", time.perf_counter() - start, classifier=classifier.name)
+    logger.info(f"{classifier.name} saved in {time.perf_counter() - start:.1f}s")
+    return classifier.version
+
+
+def _train_classifier_in_worker(*args) -> str:
+    version = _train_classifier(*args)
+    classifiers.save_normalizer()
+    return version
+
+
+@metrics.timer("stage", stage="train")
+def train(
+    classifier_names: list[str] | None = None,
+    incremental: bool = False,
+    refit: bool = False,
+    parallel: bool = False,
+):
+    """
+    Train the classifiers from scratch, or, if `incremental`, update the online ones with the rows
+    changed since their last training. `refit` trains the online classifiers from scratch.
+
+    The training data is loaded and normalized once and shared by the classifiers, with `parallel`
+    each one is trained in its own process
+    """
+    classifier_classes = list(classifiers.get_classifiers())
+    if classifier_names:
+        classifier_classes = [c for c in classifier_classes if c.__name__ in classifier_names]
+    data = classifiers.load_training_data(
+        config.DB_PATH,
+        text_fields=[
+            c.text_fields for c in classifier_classes if issubclass(c, classifiers.SimpleClassifier)
+        ],
+    )
+
+    if parallel and len(classifier_classes) > 1:
+        with ProcessPoolExecutor(max_workers=len(classifier_classes)) as pool:
+            futures = [
+                pool.submit(_train_classifier_in_worker, c, data, incremental, refit)
+                for c in classifier_classes
+            ]
+            for future in futures:
+                future.result()
+    else:
+        for classifier_class in classifier_classes:
+            _train_classifier(classifier_class, data, incremental, refit)
+        classifiers.save_normalizer()
+
+
+def _best_prediction(
+    item_dict: dict[str, str], predictions: list[tuple[dict[str, str], float, float]]
+) -> tuple[str, str] | None:
+    """
+    Return the empty field to fill and its value, if any prediction is confident enough
+    """
+    field_predictions = sorted(
+        [
+            (field, value, confidence, distance)
+            for prediction_data, confidence, distance in predictions
+            for field, value in prediction_data.items()
+            if not item_dict[field] and value
+        ],
+        key=lambda x: x[2],  # confidence
+        reverse=True,
+    )
+    if not field_predictions:
+        return None
+    field, value, confidence, distance = field_predictions[0]
+    if confidence < 0.5:
+        return None
+    if distance < confidence / 2:
+        return None
+    return field, value
+
+
+def _predict_cached(
+    cache_repo: sqlite.PredictionCacheRepo,
+    classifier: classifiers.ClassifierInterface,
+    item_dicts: list[dict[str, str]],
+) -> list[tuple[dict[str, str], float, float]]:
+    """
+    Predict the items, reusing the predictions of the same version of the model for the same inputs
+    """
+    if not classifier.version or not classifier.input_fields:
+        return classifiers.predict(classifier, item_dicts)
+    input_hashes = [classifier.input_hash(item_dict) for item_dict in item_dicts]
+    cached = cache_repo.get(classifier.name, classifier.version, input_hashes)
+    misses = {
+        input_hash: item_dict
+        for input_hash, item_dict in zip(input_hashes, item_dicts)
+        if input_hash not in cached
+    }
+    metrics.incr("prediction_cache", len(item_dicts) - len(misses), result="hit")
+    metrics.incr("prediction_cache", len(misses), result="miss")
+    if misses:
+        predicted = dict(zip(misses, classifiers.predict(classifier, list(misses.values()))))
+        cache_repo.add(classifier.name, classifier.version, predicted)
+        cached.update(predicted)
+    logger.debug(f"{classifier.name}: {len(item_dicts) - len(misses)} cached predictions")
+    return [cached[input_hash] for input_hash in input_hashes]
+
+
+def load_classifiers(
+    classifier_names: list[str] | None = None,
+) -> list[classifiers.ClassifierInterface]:
+    """
+    Load the saved classifiers, all of them or only the given ones
+    """
     classifier_classes = classifiers.get_classifiers()
     if classifier_names:
         classifier_classes = [c for c in classifier_classes if c.__name__ in classifier_names]
-    for classifier_class in classifier_classes:
-        classifier = classifier_class()
-        logger.info(f"training {classifier.name}")
-        classifier.train(db_path=config.DB_PATH)
-        classifier.save()
+    return [loaded for c in classifier_classes if (loaded := c().load())]
+
 
+def _reads(classifier: classifiers.ClassifierInterface, field: str) -> bool:
+    # without declared inputs the prediction can depend on any field
+    return not classifier.input_fields or field in classifier.input_fields
+
+
+def _fill_in_rounds(
+    cache_repo: sqlite.PredictionCacheRepo,
+    classifiers_: list[classifiers.ClassifierInterface],
+    item_dicts: list[dict[str, str]],
+):
+    """
+    Fill the empty fields of the items with the classifiers, at most one field per item per round.
 
+    A classifier predicts an item again only if one of its input fields was filled in the previous
+    round, its other predictions are still valid and are reused
+    """
+    # latest prediction of each classifier, by item index
+    latest: list[dict[int, tuple[dict[str, str], float, float]]] = [{} for _ in classifiers_]
+    # items to predict in the next round, by classifier: the ones with an empty label field
+    pending = [
+        {
+            index
+            for index, item_dict in enumerate(item_dicts)
+            if any(not item_dict[field] for field in classifier.label_fields)
+        }
+        for classifier in classifiers_
+    ]
+    to_check = set().union(*pending)
+    rounds = predictions = 0
+    while to_check:
+        rounds += 1
+        for classifier, indexes, classifier_latest in zip(classifiers_, pending, latest):
+            if indexes:
+                indexes = sorted(indexes)
+                items = [item_dicts[index] for index in indexes]
+                classifier_latest.update(
+                    zip(indexes, _predict_cached(cache_repo, classifier, items))
+                )
+                predictions += len(indexes)
+        pending = [set() for _ in classifiers_]
+
+        changed = set()
+        for index in sorted(to_check):
+            item_predictions = [l[index] for l in latest if index in l]
+            if not (best := _best_prediction(item_dicts[index], item_predictions)):
+                continue
+            field, value = best
+            item_dicts[index][field] = value
+            metrics.incr("fields_filled", source="classifiers")
+            changed.add(index)
+            for classifier, indexes in zip(classifiers_, pending):
+                if _reads(classifier, field) and any(
+                    not item_dicts[index][label_field] for label_field in classifier.label_fields
+                ):
+                    indexes.add(index)
+        to_check = changed
+    logger.info(f"{predictions} predictions in {rounds} rounds")
+
+
+@metrics.timer("stage", stage="guess")
 @sqlite.db
 def guess(
     *,
@@ -188,7 +570,13 @@ def guess(
     classifier_names: list[str],
     months: list[str],
     to_sync_only: bool = False,
+    use_rules: bool = True,
+    loaded_classifiers: list[classifiers.ClassifierInterface] | None = None,
 ):
+    """
+    Fill the empty fields of the items, first with the deterministic rules, see `src.rules`, then
+    with the classifiers, which are loaded unless `loaded_classifiers` are given
+    """
     local_repo = sqlite.LedgerItemRepo(db)
     data = sum((list(local_repo.get_month_data(month)) for month in months), start=[])
     if to_sync_only:
@@ -196,36 +584,28 @@ def guess(
 
     data_with_prediction = []
 
-    classifier_classes = classifiers.get_classifiers()
-    if classifier_names:
-        classifier_classes = [c for c in classifier_classes if c.__name__ in classifier_names]
-    classifiers_: list[classifiers.ClassifierInterface] = [
-        loaded for c in classifier_classes if (loaded := c().load())
-    ]
-
-    for item in data:
-        item_dict = models.asdict(item)
-        while True:
-            predictions = [classifier.predict_with_meta(item_dict) for classifier in classifiers_]
-            field_predictions = sorted(
-                [
-                    (field, value, confidence, distance)
-                    for prediction_data, confidence, distance in predictions
-                    for field, value in prediction_data.items()
-                    if not item_dict[field] and value
-                ],
-                key=lambda x: x[2],  # confidence
-                reverse=True,
-            )
-            if not field_predictions:
-                break
-            field, value, confidence, distance = field_predictions[0]
-            if confidence < 0.5:
-                break
-            if distance < confidence / 2:
-                break
-            item_dict[field] = value
-
+    if loaded_classifiers is None:
+        loaded_classifiers = load_classifiers(classifier_names)
+    classifiers_ = loaded_classifiers
+    cache_repo = sqlite.PredictionCacheRepo(db)
+    for classifier in classifiers_:
+        if classifier.version:
+            cache_repo.evict(classifier.name, classifier.version)
+
+    item_dicts = [models.asdict(item) for item in data]
+    if use_rules:
+        engine = rules.get_rule_engine(db, config.RULES_PATH)
+        filled = 0
+        for item_dict in item_dicts:
+            values = engine.apply(item_dict)
+            item_dict.update(values)
+            filled += len(values)
+        metrics.incr("fields_filled", filled, source="rules")
+        logger.info(f"{filled} fields filled by the rules")
+
+    _fill_in_rounds(cache_repo, classifiers_, item_dicts)
+
+    for item, item_dict in zip(data, item_dicts):
         update = False
         for field, value in item_dict.items():
             if getattr(item, field) != value:
@@ -233,6 +613,7 @@ def guess(
                 update = True
         if update:
             local_repo.update(item)
+    classifiers.save_normalizer()
 
     # order by confidence
     data_with_prediction.sort(key=lambda x: x[2][1], reverse=True)
@@ -247,3 +628,62 @@ def guess(
             for field, prediction in to_update.items():
                 setattr(item, field, prediction)
             local_repo.update(item)
+
+
+################
+### REVIEW
+
+
+def review(*, months: list[str], files: list[Path]) -> pipeline.Pipeline:
+    """
+    Pull, fetch, train, guess and push the months in one run, sharing the database connection and
+    the sheet. Reading the files, downloading and pulling run at the same time, the training starts
+    as soon as the pulled data is stored
+    """
+    with sqlite.db_context(check_same_thread=False) as db, gsheet.sheet_context(db=db) as sheet:
+        # the stages using the connection depend on each other, so they never run at the same time
+
+        def store_pulled(pull: dict[str, list[models.LedgerItem]]):
+            _replace_months(db, pull)
+            # committed, so the training, using its own connection, sees the pulled data
+            db.commit()
+
+        def store_fetched(read_files, download, store_pulled):
+            for imported in read_files:
+                store_imported(db=db, imported=imported)
+            for changes in download:
+                store_changes(db=db, changes=changes)
+            db.commit()
+
+        def push(guess):
+            push_to_gsheet(db=db, sheet=sheet, months=months)
+            try:
+                sheet.flush()
+            except Exception as err:
+                if not gsheet.is_offline_error(err):
+                    raise
+                # what is left is stored in the outbox when the sheet context is closed
+
+        review_pipeline = pipeline.Pipeline()
+        review_pipeline.add("read_files", lambda: list(read_files(files=files, months=months)))
+        watermarks = sqlite.SyncWatermarkRepo(db).get_all()
+        review_pipeline.add(
+            "download", lambda: list(download_items(months=months, watermarks=watermarks))
+        )
+        review_pipeline.add("pull", lambda: _get_remote_months(sheet, months))
+        review_pipeline.add("store_pulled", store_pulled, after=["pull"])
+        review_pipeline.add("train", lambda store_pulled: train(), after=["store_pulled"])
+        review_pipeline.add(
+            "store_fetched", store_fetched, after=["read_files", "download", "store_pulled"]
+        )
+        review_pipeline.add(
+            "guess",
+            lambda train, store_fetched: guess(db=db, classifier_names=None, months=months),
+            after=["train", "store_fetched"],
+        )
+        review_pipeline.add("push", push, after=["guess"])
+        try:
+            review_pipeline.run()
+        finally:
+            print(review_pipeline.summary())
+    return review_pipeline
@@ -0,0 +1,90 @@
+"""
+Versioned artifacts stored on disk, used to save the trained models.
+
+An artifact is a folder containing one sub-folder per version and a `current` file with the name
+of the version in use:
+
+    models/SomeClassifier/current
+    models/SomeClassifier/3f2a.../header.json
+    models/SomeClassifier/3f2a.../...
+
+The version is the hash of the content, and `current` is replaced atomically, so readers always
+see a complete version, even while a new one is being written.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Any, Callable
+
+FORMAT = 1
+
+
+class ArtifactFormatError(ValueError):
+    pass
+
+
+def _hash_folder(folder: Path) -> str:
+    digest = hashlib.sha1()
+    for path in sorted(folder.iterdir()):
+        digest.update(path.name.encode("utf-8"))
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:16]
+
+
+def _prune(folder: Path, keep: set[str]):
+    # the previous version is kept, a running process could still be reading it
+    for path in folder.iterdir():
+        if path.is_dir() and not path.name.startswith(".") and path.name not in keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def write(folder: Path, header: dict[str, Any], write_files: Callable[[Path], dict]) -> str:
+    """
+    Write a new version of the artifact and make it the current one, return the version.
+
+    `write_files` receives the folder where to write the files and can return more values to
+    store in the header
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    previous = current_version(folder)
+    tmp_folder = Path(tempfile.mkdtemp(dir=folder, prefix=".tmp-"))
+    try:
+        header = {"format": FORMAT, **header, **(write_files(tmp_folder) or {})}
+        (tmp_folder / "header.json").write_text(json.dumps(header, default=str))
+        version = _hash_folder(tmp_folder)
+        if (folder / version).exists():
+            shutil.rmtree(tmp_folder)
+        else:
+            tmp_folder.rename(folder / version)
+    except Exception:
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        raise
+
+    tmp_pointer = folder / f".current-{version}"
+    tmp_pointer.write_text(version)
+    os.replace(tmp_pointer, folder / "current")
+    _prune(folder, keep={version, previous} - {None})
+    return version
+
+
+def current_version(folder: Path) -> str | None:
+    try:
+        return (folder / "current").read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def read_header(folder: Path) -> tuple[Path, dict[str, Any]] | None:
+    """
+    Return the path of the current version and its header, None if there is no artifact
+    """
+    if not (version := current_version(folder)):
+        return None
+    path = folder / version
+    header = json.loads((path / "header.json").read_text())
+    if header.get("format") != FORMAT:
+        raise ArtifactFormatError(f"Unsupported artifact format in {path}: {header.get('format')}")
+    return path, header
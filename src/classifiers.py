@@ -1,22 +1,72 @@
 import abc
+import hashlib
+import json
+import logging
+import os
 import pickle
 import re
-from collections import defaultdict
+import zlib
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass, field
+from functools import cache
 from itertools import groupby
 from pathlib import Path
 
-import nltk
 import numpy as np
 import pandas as pd
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
-from sklearn.linear_model import LogisticRegression
 
 import config
-from src import utils
+from src import artifacts, metrics, rules, utils
 from src.ledger_repos import sqlite
 
+logger = logging.getLogger(__name__)
+
+_ACRONYM_RE = re.compile(r"(\w)\.(\w)\.")
+_NON_LETTER_RE = re.compile("[^a-zA-Z]")
+# nltk, scipy and sklearn take seconds to import, they are imported only where they are used
+STOPWORDS: set[str] = set()  # set(stopwords.words("english")) | set(stopwords.words("italian"))
+
+# the only NLTK data used by the classifiers, as name: path to find it in nltk.data
+NLTK_RESOURCES = {"wordnet": "corpora/wordnet"}
+
+
+@cache
+def has_nltk_resources() -> bool:
+    """
+    Check once whether the NLTK data needed by the classifiers is installed
+    """
+    import nltk
+
+    for path in NLTK_RESOURCES.values():
+        try:
+            nltk.data.find(path)
+        except LookupError:
+            return False
+    return True
+
+
+def download_nltk_resources():
+    import nltk
+
+    for name in NLTK_RESOURCES:
+        nltk.download(name, quiet=True)
+    has_nltk_resources.cache_clear()
+
+
+def simple_lemmatize(word: str) -> str:
+    """
+    Lightweight replacement of the WordNet lemmatizer, it only turns regular plurals to singular
+    """
+    if len(word) <= 3 or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("sses", "xes", "shes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
 
 def get_classifiers() -> list[type["ClassifierInterface"]]:
     """
@@ -25,34 +75,388 @@ def get_classifiers() -> list[type["ClassifierInterface"]]:
     yield from utils.get_all_subclasses(ClassifierInterface)
 
 
+def _write_atomic(path: Path, content: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}-{os.getpid()}")
+    tmp_path.write_bytes(content)
+    os.replace(tmp_path, path)
+
+
+def make_vectorizer(features: str):
+    """
+    Return the vectorizer for the given kind of features:
+
+    - "count": word counts, its vocabulary grows with the distinct words seen in training
+    - "hashing": hashed word tokens plus character n-grams, with a fixed width and no state, so
+      the model size doesn't grow with the number of merchants and transform can run in any
+      worker without fitting
+    """
+    from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+    from sklearn.pipeline import FeatureUnion
+
+    if features == "count":
+        return CountVectorizer()
+    if features == "hashing":
+        return FeatureUnion(
+            [
+                ("words", HashingVectorizer(n_features=2**12, alternate_sign=False)),
+                (
+                    "chars",
+                    HashingVectorizer(
+                        analyzer="char_wb",
+                        ngram_range=(3, 5),
+                        n_features=2**14,
+                        alternate_sign=False,
+                    ),
+                ),
+            ]
+        )
+    raise ValueError(f"Unknown features: {features}")
+
+
+class TextNormalizer:
+    """
+    Turn a text into the space separated lemmas used as corpus by the classifiers.
+
+    Descriptions and counterparties repeat a lot, so the normalized texts are kept in a bounded
+    LRU cache and the lemmas in a per-token cache, WordNet is loaded only on a cache miss.
+    The "simple" backend uses `simple_lemmatize` instead, for when WordNet is not installed.
+    """
+
+    def __init__(self, max_size: int = 100_000, backend: str = "wordnet"):
+        self.max_size = max_size
+        self.backend = backend
+        self.texts: OrderedDict[str, str] = OrderedDict()
+        self.lemmas: dict[str, str] = {}
+        self.hits = 0
+        self.misses = 0
+        self._lemmatizer = None
+
+    def __getstate__(self):
+        return {
+            "max_size": self.max_size,
+            "backend": self.backend,
+            "texts": self.texts,
+            "lemmas": self.lemmas,
+        }
+
+    def __setstate__(self, state):
+        self.__init__(state["max_size"], state.get("backend", "wordnet"))
+        self.texts = state["texts"]
+        self.lemmas = state["lemmas"]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def lemmatize(self, word: str) -> str:
+        try:
+            return self.lemmas[word]
+        except KeyError:
+            pass
+        if self.backend == "simple":
+            lemma = simple_lemmatize(word)
+        else:
+            if self._lemmatizer is None:
+                from nltk.stem import WordNetLemmatizer
+
+                self._lemmatizer = WordNetLemmatizer()
+            lemma = self._lemmatizer.lemmatize(word)
+        self.lemmas[word] = lemma
+        return lemma
+
+    def normalize(self, text: str) -> str:
+        try:
+            corpus = self.texts[text]
+        except KeyError:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.texts.move_to_end(text)
+            return corpus
+
+        words = _NON_LETTER_RE.sub(" ", _ACRONYM_RE.sub(r"\1\2", text)).lower().split()
+        corpus = " ".join(self.lemmatize(word) for word in words if word not in STOPWORDS)
+        self.texts[text] = corpus
+        if len(self.texts) > self.max_size:
+            self.texts.popitem(last=False)
+        return corpus
+
+    def save(self, path: Path):
+        # classifiers trained in parallel can save it at the same time
+        _write_atomic(path, pickle.dumps(self))
+
+    @classmethod
+    def load(cls, path: Path) -> "TextNormalizer":
+        try:
+            with open(path, "rb") as f:
+                return pickle.loads(f.read())
+        except FileNotFoundError:
+            return cls()
+
+
+_normalizer: TextNormalizer | None = None
+
+
+def get_normalizer() -> TextNormalizer:
+    """
+    Return the normalizer shared by all the classifiers, loading the cache saved by previous runs
+    """
+    global _normalizer
+    if _normalizer is None:
+        if has_nltk_resources():
+            backend = "wordnet"
+        else:
+            logger.warning(
+                f"NLTK data {list(NLTK_RESOURCES)} not found, using a simplified lemmatizer,"
+                " run `./run.py setup_nltk` to install it"
+            )
+            backend = "simple"
+        _normalizer = TextNormalizer.load(config.MODEL_FOLDER / "normalizer.cache")
+        if _normalizer.backend != backend:
+            # lemmas from a different backend would not match the ones the models were trained on
+            _normalizer = TextNormalizer(backend=backend)
+    return _normalizer
+
+
+def save_normalizer():
+    """
+    Persist the normalization cache next to the models, if it was used in this run
+    """
+    if (normalizer := _normalizer) is None:
+        return
+    logger.info(
+        f"Text normalization cache hit rate {normalizer.hit_rate:.1%} "
+        f"({normalizer.hits} hits, {normalizer.misses} misses)"
+    )
+    normalizer.save(config.MODEL_FOLDER / "normalizer.cache")
+
+
+@dataclass
+class TrainingData:
+    """
+    Snapshot of the ledger used to train the classifiers: it's loaded once and shared by all of
+    them, together with the normalized text for each combination of text fields
+    """
+
+    rows: pd.DataFrame  # tx_id, description, counterparty, category, labels
+    watermark: int  # id of the last change in the ledger_changes journal
+    # tx_id of the rows deleted after the `since` watermark, when only the changes are loaded
+    deleted: list[str] = field(default_factory=list)
+    # normalized text of the rows, by comma separated text fields
+    corpus: dict[str, pd.Series] = field(default_factory=dict)
+    # identifies the state of the database and of the normalizer the snapshot was built from
+    key: tuple | None = None
+
+    def get_corpus(self, text_fields: list[str]) -> pd.Series:
+        corpus_key = ",".join(text_fields)
+        if corpus_key not in self.corpus:
+            text = _join_fields(self.rows, text_fields)
+            normalizer = get_normalizer()
+            normalized = {value: normalizer.normalize(value) for value in text.dropna().unique()}
+            self.corpus[corpus_key] = text.map(normalized)
+        return self.corpus[corpus_key]
+
+
+def _training_snapshot_path() -> Path:
+    return config.MODEL_FOLDER / "training.snapshot"
+
+
+def load_training_data(
+    db_path: str | Path, since: int | None = None, text_fields: list[list[str]] = ()
+) -> TrainingData:
+    """
+    Load the rows used for training, only the ones changed after the `since` watermark if given,
+    and normalize their `text_fields`.
+
+    The full snapshot is cached on disk, it's rebuilt when the change journal or the rows of the
+    ledger change
+    """
+    sql = "SELECT tx_id, description, counterparty, category, labels FROM ledger_items"
+    with sqlite.db_context(db_path) as db:
+        watermark = sqlite.get_change_watermark(db)
+        if since is not None:
+            sql += " WHERE tx_id IN (SELECT tx_id FROM ledger_changes WHERE id > :since)"
+            data = TrainingData(pd.read_sql_query(sql, db, params={"since": since}), watermark)
+            cursor = db.execute(
+                """
+                SELECT DISTINCT tx_id FROM ledger_changes WHERE id > :since
+                AND tx_id NOT IN (SELECT tx_id FROM ledger_items)
+                """,
+                {"since": since},
+            )
+            data.deleted = [tx_id for (tx_id,) in cursor]
+            for fields in text_fields:
+                data.get_corpus(fields)
+            return data
+
+        row_count, max_rowid = db.execute(
+            "SELECT COUNT(*), MAX(rowid) FROM ledger_items"
+        ).fetchone()
+        key = (str(db_path), watermark, row_count, max_rowid, get_normalizer().backend)
+        try:
+            data = pickle.loads(_training_snapshot_path().read_bytes())
+            cached_corpus = set(data.corpus) if data.key == key else None
+        except FileNotFoundError:
+            cached_corpus = None
+        metrics.incr("training_snapshot", result="miss" if cached_corpus is None else "hit")
+        if cached_corpus is None:
+            data = TrainingData(pd.read_sql_query(sql, db), watermark, key=key)
+
+    metrics.incr("training_rows", len(data.rows))
+    for fields in text_fields:
+        data.get_corpus(fields)
+    if set(data.corpus) != cached_corpus:
+        _write_atomic(_training_snapshot_path(), pickle.dumps(data))
+    return data
+
+
+def _join_fields(rows: pd.DataFrame, fields: list[str]) -> pd.Series:
+    # like `a||','||b` in SQL, the result is null if any of the fields is null
+    result = rows[fields[0]]
+    for field in fields[1:]:
+        result = result + "," + rows[field]
+    return result
+
+
 class ClassifierInterface(abc.ABC):
-    def __init__(self):
+    # fields of the items the classifier predicts
+    label_fields: list[str] = []
+    # fields of the items the prediction depends on
+    input_fields: list[str] = []
+    # the prediction depends on the backend of the text normalizer too
+    normalizes_text: bool = False
+    # online classifiers can be updated with only the rows changed since the last training
+    online: bool = False
+    # id of the last change in the ledger_changes journal seen by the training
+    watermark: int | None = None
+    # version of the artifact the classifier was saved to or loaded from
+    version: str | None = None
+
+    def __init__(self, online: bool = False):
         raise NotImplementedError
 
     @property
     def name(self) -> str:
         return self.__class__.__name__
 
-    def train(self, db_path: str | Path):
+    def fit(self, data: TrainingData):
         raise NotImplementedError
 
+    def train(self, db_path: str | Path):
+        self.fit(load_training_data(db_path))
+
+    def update(self, db_path: str | Path):
+        """
+        Update the model with the rows changed since the last training, by default retrain it
+        """
+        self.train(db_path)
+
     def predict_with_meta(self, item: dict[str, str]) -> tuple[dict[str, str], float, float]:
         raise NotImplementedError
 
+    def predict_many(
+        self, items: list[dict[str, str]]
+    ) -> list[tuple[dict[str, str], float, float]]:
+        """
+        Same as `predict_with_meta`, for a list of items
+        """
+        return [self.predict_with_meta(item) for item in items]
+
+    def input_hash(self, item: dict[str, str]) -> str:
+        """
+        Hash of the input fields of the item, items with the same hash get the same prediction
+        """
+        values = [item.get(field) or "" for field in self.input_fields]
+        if self.normalizes_text:
+            # the same text gives other lemmas with another backend
+            values.append(get_normalizer().backend)
+        return hashlib.sha1(json.dumps(values).encode("utf-8")).hexdigest()
+
+    def _write_files(self, folder: Path) -> dict:
+        """
+        Write the files of the artifact, return the values to add to its header
+        """
+        (folder / "model.pickle").write_bytes(pickle.dumps(self))
+        return {}
+
+    @classmethod
+    def _read_files(cls, folder: Path, header: dict) -> "ClassifierInterface":
+        return pickle.loads((folder / "model.pickle").read_bytes())
+
     def save(self):
-        config.MODEL_FOLDER.mkdir(parents=True, exist_ok=True)
-        with open(config.MODEL_FOLDER / f"{self.name}.classifier", "wb") as f:
-            f.write(pickle.dumps(self))
+        """
+        Save the classifier as a new version of its artifact, see `src.artifacts`
+        """
+        header = {"class": self.name, "online": self.online, "watermark": self.watermark}
+        self.version = artifacts.write(config.MODEL_FOLDER / self.name, header, self._write_files)
 
     def load(self):
+        if artifact := artifacts.read_header(config.MODEL_FOLDER / self.name):
+            folder, header = artifact
+            classifier = self._read_files(folder, header)
+            classifier.version = folder.name
+            return classifier
+
+        # models saved before the artifacts were introduced
         try:
             with open(config.MODEL_FOLDER / f"{self.name}.classifier", "rb") as f:
-                return pickle.loads(f.read())
+                classifier = pickle.loads(f.read())
         except FileNotFoundError:
             return None
+        except (AttributeError, ImportError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning(
+                f"{self.name}: the saved model can't be read ({e}), it will be retrained"
+            )
+            return None
+        # an older version of the class, without the attributes used now
+        if not isinstance(classifier, type(self)) or set(vars(self)) - set(vars(classifier)):
+            logger.warning(f"{self.name}: the saved model is outdated, it will be retrained")
+            return None
+        return classifier
+
+
+def predict(
+    classifier: ClassifierInterface, items: list[dict[str, str]]
+) -> list[tuple[dict[str, str], float, float]]:
+    """
+    `classifier.predict_many(items)`, counting the predictions and the time spent
+    """
+    with metrics.timer("predict", classifier=classifier.name):
+        predictions = classifier.predict_many(items)
+    metrics.incr("predictions", len(items), classifier=classifier.name)
+    return predictions
+
+
+class LinearModel:
+    """
+    Prediction only replacement of the sklearn linear models, backed by the arrays of an
+    artifact. The coefficients are memory-mapped, so only the pages used are read
+    """
+
+    def __init__(self, folder: Path, classes: list[str], multi_class: str):
+        self.classes_ = np.array(classes, dtype=object)
+        self.multi_class = multi_class
+        self.coef = np.load(folder / "coef.npy", mmap_mode="r")
+        self.intercept = np.load(folder / "intercept.npy")
+
+    def predict_proba(self, X) -> np.ndarray:
+        from scipy.special import expit, softmax
+
+        scores = np.asarray(X @ self.coef.T) + self.intercept
+        if scores.shape[1] == 1:
+            probability = expit(scores[:, 0])
+            return np.column_stack([1 - probability, probability])
+        if self.multi_class == "multinomial":
+            return softmax(scores, axis=1)
+        probabilities = expit(scores)
+        return probabilities / probabilities.sum(axis=1, keepdims=True)
 
 
 class SimpleClassifier(ClassifierInterface, abc.ABC):
+    normalizes_text = True
+
     @property
     @abc.abstractmethod
     def label_fields(self) -> list[str]:
@@ -63,61 +467,164 @@ class SimpleClassifier(ClassifierInterface, abc.ABC):
     def text_fields(self) -> list[str]:
         raise NotImplementedError
 
-    def __init__(self):
-        self.model = LogisticRegression(max_iter=1000)
-        self.vectorizer = CountVectorizer()
+    @property
+    def input_fields(self) -> list[str]:
+        return self.text_fields
+
+    features = "count"
+    rows: int | None = None
+    # folder of the artifact the classifier was loaded from, the model is read only when needed
+    _artifact: Path | None = None
+    _predictor: tuple[LinearModel, object] | None = None
+
+    def __init__(self, online: bool = False, features: str | None = None):
+        from sklearn.linear_model import LogisticRegression, SGDClassifier
+
+        self.online = online
+        if online:
+            # a model supporting partial_fit, it needs a fixed feature space
+            self.model = SGDClassifier(loss="log_loss")
+            self.features = "hashing"
+        else:
+            self.model = LogisticRegression(max_iter=1000)
+            self.features = features or config.CLASSIFIER_FEATURES
+        self.vectorizer = make_vectorizer(self.features)
         # self.vectorizer = TfidfTransformer()
-        self.lemmatizer = WordNetLemmatizer()
 
     def _transform_item(self, item: dict[str, str]) -> str:
         text = ",".join(item.get(field) or "" for field in self.text_fields)
-        return [self._text_to_corpus(text)]
-
-    def predict_with_meta(self, item: dict[str, str]) -> tuple[list[str], float, float]:
-        probability = self.model.predict_proba(
-            self.vectorizer.transform(self._transform_item(item))
-        )[0]
-        probs = np.argsort(probability)
-        highest = probs[-1]
-        second = probs[-2]
-        prediction = self.model.classes_[highest]
-        confidence = probability[highest]
-        distance = probability[highest] - probability[second]
-        return dict(zip(self.label_fields, prediction.split(","))), confidence, distance
+        return self._text_to_corpus(text)
 
-    def _text_to_corpus(self, text: str) -> str:
-        my_stopwords = set()  # set(stopwords.words("english")) | set(stopwords.words("italian"))
-        text = re.sub(r"(\w)\.(\w)\.", r"\1\2", text)
-        text = re.sub("[^a-zA-Z]", " ", text)
-        text = text.lower()
-        r = text.split()
-        r = [word for word in r if word not in my_stopwords]
-        r = [self.lemmatizer.lemmatize(word) for word in r]
-        return " ".join(r)
-
-    def train(self, db_path):
-        nltk.download("all", quiet=True)
-
-        with sqlite.db_context(db_path) as db:
-            label = "||','||".join(self.label_fields)
-            text_fields = "||','||".join(self.text_fields)
-            data = pd.read_sql_query(
-                f"SELECT {text_fields} as text, {label} as label"
-                " FROM ledger_items"
-                " where text is not null"
-                " and text != ''"
-                f" and label is not null"
-                f" and label != ''"
-                "",
-                db,
+    def predict_with_meta(self, item: dict[str, str]) -> tuple[dict[str, str], float, float]:
+        return self.predict_many([item])[0]
+
+    def predict_many(
+        self, items: list[dict[str, str]]
+    ) -> list[tuple[dict[str, str], float, float]]:
+        if not items:
+            return []
+        model, vectorizer = self._get_predictor()
+        probabilities = model.predict_proba(
+            vectorizer.transform([self._transform_item(item) for item in items])
+        )
+        # the two most probable classes for each item
+        order = np.argsort(probabilities, axis=1)
+        rows = np.arange(len(items))
+        highest = order[:, -1]
+        confidences = probabilities[rows, highest]
+        distances = confidences - probabilities[rows, order[:, -2]]
+        predictions = model.classes_[highest]
+        return [
+            (
+                dict(zip(self.label_fields, prediction.split(","))),
+                float(confidence),
+                float(distance),
             )
+            for prediction, confidence, distance in zip(predictions, confidences, distances)
+        ]
+
+    def _text_to_corpus(self, text: str) -> str:
+        return get_normalizer().normalize(text)
 
-            # assign corpus to data['text']
-            data["corpus"] = data["text"].apply(self._text_to_corpus)
-            X = data["corpus"]
-            y = data["label"]
+    def _get_predictor(self):
+        if self.model is not None:
+            return self.model, self.vectorizer
+        if self._predictor is None:
+            if self.features == "count":
+                vocabulary = (self._artifact / "vocabulary.txt").read_text().split("\n")
+                from sklearn.feature_extraction.text import CountVectorizer
 
-            self.model.fit(self.vectorizer.fit_transform(X), y)
+                vectorizer = CountVectorizer(vocabulary=vocabulary)
+            else:
+                vectorizer = make_vectorizer(self.features)
+            model = LinearModel(self._artifact, self.classes, self.multi_class)
+            self._predictor = model, vectorizer
+        return self._predictor
+
+    def _load_training_state(self):
+        if self.model is None:
+            training_state = (self._artifact / "training.pickle").read_bytes()
+            self.model, self.vectorizer = pickle.loads(training_state)
+
+    def _write_files(self, folder: Path) -> dict:
+        np.save(folder / "coef.npy", self.model.coef_)
+        np.save(folder / "intercept.npy", self.model.intercept_)
+        if self.features == "count":
+            vocabulary = self.vectorizer.get_feature_names_out()
+            (folder / "vocabulary.txt").write_text("\n".join(vocabulary))
+        if self.online:
+            # the full sklearn objects are needed only to update the model
+            (folder / "training.pickle").write_bytes(pickle.dumps((self.model, self.vectorizer)))
+        return {
+            "features": self.features,
+            "rows": self.rows,
+            "classes": list(self.model.classes_),
+            # SGDClassifier is one-vs-rest, LogisticRegression multinomial
+            "multi_class": "ovr" if self.online else "multinomial",
+        }
+
+    @classmethod
+    def _read_files(cls, folder: Path, header: dict) -> "SimpleClassifier":
+        classifier = cls.__new__(cls)
+        classifier.online = header["online"]
+        classifier.watermark = header["watermark"]
+        classifier.features = header["features"]
+        classifier.rows = header["rows"]
+        classifier.classes = header["classes"]
+        classifier.multi_class = header["multi_class"]
+        classifier.model = classifier.vectorizer = None
+        classifier._artifact = folder
+        return classifier
+
+    def _get_text_and_labels(self, data: TrainingData) -> pd.DataFrame:
+        """
+        Get text, corpus and label of the labeled rows
+        """
+        result = pd.DataFrame(
+            {
+                "text": _join_fields(data.rows, self.text_fields),
+                "label": _join_fields(data.rows, self.label_fields),
+                "corpus": data.get_corpus(self.text_fields),
+            }
+        )
+        result = result[result["text"].notna() & (result["text"] != "")]
+        return result[result["label"].notna() & (result["label"] != "")]
+
+    def fit(self, data: TrainingData):
+        self.watermark = data.watermark
+        data = self._get_text_and_labels(data)
+
+        X = data["corpus"]
+        y = data["label"]
+
+        self.model.fit(self.vectorizer.fit_transform(X), y)
+        self.rows = len(data)
+
+    def update(self, db_path):
+        """
+        Fit the online model with the rows labeled or relabeled since the last training, a full
+        training is done if the model is not online or if there are new labels
+        """
+        if not self.online or self.watermark is None:
+            return self.train(db_path)
+        self._load_training_state()
+
+        changes = load_training_data(db_path, since=self.watermark)
+        data = self._get_text_and_labels(changes)
+
+        # the rows already fitted can't be removed from the model
+        if changes.deleted:
+            logger.info(f"{self.name}: {len(changes.deleted)} deleted rows, training from scratch")
+            return self.train(db_path)
+        if new_labels := set(data["label"]) - set(self.model.classes_):
+            logger.info(f"{self.name}: new labels {new_labels}, training from scratch")
+            return self.train(db_path)
+
+        logger.info(f"{self.name}: updating with {len(data)} changed rows")
+        if not data.empty:
+            self.model.partial_fit(self.vectorizer.transform(data["corpus"]), data["label"])
+            self.rows = (self.rows or 0) + len(data)
+        self.watermark = changes.watermark
 
 
 class CategoryLabelFromDescriptionCounterpartyClassifier(SimpleClassifier):
@@ -145,51 +652,270 @@ class CategoryFromDescriptionCounterpartyClassifier(SimpleClassifier):
 #     ]
 
 
-def _submap():
-    return defaultdict(int)
+def normalize_counterparty(counterparty: str | None) -> str:
+    if not isinstance(counterparty, str):
+        return ""
+    return " ".join(counterparty.lower().split())
 
 
 class CounterpartyFromDescriptionClassifier(ClassifierInterface):
-    def __init__(self):
-        self.map = defaultdict(dict)
-
-    def train(self, db_path: str | Path):
-        with sqlite.db_context(db_path) as db:
-            sql = """
-                SELECT counterparty, category
-                FROM ledger_items
-                where counterparty is not null
-                and counterparty != ''
-                """
+    """
+    Most frequent category of the counterparty. The training freezes category, confidence and
+    distance of each counterparty in a table, so a prediction is a single lookup
+    """
 
-            self.map = defaultdict(_submap)
-            data = sqlite.query(sql, db)
-            for item in data:
-                counterparty = item["counterparty"]
-                category = item["category"] or None
-                self.map[counterparty][category] += 1
+    label_fields = ["category"]
+    input_fields = ["counterparty"]
+    # folder of the artifact the classifier was loaded from, the counts are read only to update it
+    _artifact: Path | None = None
+
+    def __init__(self, online: bool = False):
+        self.online = online
+        self.table: dict[str, tuple[str | None, float, float]] = {}
+        # category counts by counterparty, and counterparty and category of each transaction
+        self.counts: dict[str, dict[str | None, int]] | None = {}
+        self.transactions: dict[str, tuple[str, str | None]] | None = {}
+
+    def _remove(self, tx_id: str) -> str | None:
+        """
+        Remove the category of the transaction from the counts, return its counterparty
+        """
+        if previous := self.transactions.pop(tx_id, None):
+            key, category = previous
+            self.counts[key][category] -= 1
+            if not self.counts[key][category]:
+                del self.counts[key][category]
+            return key
+        return None
+
+    def _add_rows(self, rows: pd.DataFrame) -> set[str]:
+        """
+        Count the categories of the rows, replacing the previous ones of the same transactions,
+        return the counterparties whose counts changed
+        """
+        changed = set()
+        for tx_id, counterparty, category in zip(
+            rows["tx_id"], rows["counterparty"], rows["category"]
+        ):
+            if key := self._remove(tx_id):
+                changed.add(key)
+            if not (key := normalize_counterparty(counterparty)):
+                continue
+            category = category if isinstance(category, str) and category else None
+            counts = self.counts.setdefault(key, {})
+            counts[category] = counts.get(category, 0) + 1
+            self.transactions[tx_id] = (key, category)
+            changed.add(key)
+        return changed
+
+    def _freeze(self, keys: set[str]):
+        for key in keys:
+            if not (counts := self.counts.get(key)):
+                self.counts.pop(key, None)
+                self.table.pop(key, None)
+                continue
+            total = sum(counts.values())
+            ordered = sorted(counts.items(), key=lambda x: x[1], reverse=True)
+            category, count = ordered[0]
+            distance = 0.0 if len(ordered) == 1 else (count - ordered[1][1]) / total
+            self.table[key] = (category, count / total, distance)
+
+    def fit(self, data: TrainingData):
+        self.watermark = data.watermark
+        self.table, self.counts, self.transactions = {}, {}, {}
+        self._freeze(self._add_rows(data.rows))
+
+    def update(self, db_path: str | Path):
+        """
+        Count only the rows changed since the last training and update their counterparties
+        """
+        if not self.online or self.watermark is None:
+            return self.train(db_path)
+        self._load_training_state()
+        changes = load_training_data(db_path, since=self.watermark)
+        changed = self._add_rows(changes.rows)
+        changed.update(filter(None, map(self._remove, changes.deleted)))
+        logger.info(f"{self.name}: updating {len(changed)} counterparties")
+        self._freeze(changed)
+        self.watermark = changes.watermark
 
     def predict_with_meta(self, item: dict[str, str]) -> tuple[dict[str, str], float, float]:
-        if data := self.map.get(item["counterparty"]):
-            total = sum(data.values())
-            ordered = sorted(data.items(), key=lambda x: x[1], reverse=True)
-            category = ordered[0][0]
-            confidence = ordered[0][1] / total
-            if len(ordered) == 1:
-                distance = 0.0
-            else:
-                distance = (ordered[0][1] - ordered[1][1]) / total
+        if entry := self.table.get(normalize_counterparty(item["counterparty"])):
+            category, confidence, distance = entry
             return {"category": category}, confidence, distance
         return {"category": ""}, 0.0, 0.0
 
-    def save(self):
-        config.MODEL_FOLDER.mkdir(parents=True, exist_ok=True)
-        with open(config.MODEL_FOLDER / f"{self.name}.classifier", "wb") as f:
-            f.write(pickle.dumps(self))
+    def _load_training_state(self):
+        if self.counts is None:
+            training_state = (self._artifact / "training.pickle").read_bytes()
+            self.counts, self.transactions = pickle.loads(training_state)
 
-    def load(self):
-        try:
-            with open(config.MODEL_FOLDER / f"{self.name}.classifier", "rb") as f:
-                return pickle.loads(f.read())
-        except FileNotFoundError:
-            return None
+    def _write_files(self, folder: Path) -> dict:
+        (folder / "table.pickle").write_bytes(pickle.dumps(self.table))
+        if self.online:
+            # the counts are needed only to update the table
+            training_state = pickle.dumps((self.counts, self.transactions))
+            (folder / "training.pickle").write_bytes(training_state)
+        return {"counterparties": len(self.table)}
+
+    @classmethod
+    def _read_files(cls, folder: Path, header: dict) -> "CounterpartyFromDescriptionClassifier":
+        classifier = cls.__new__(cls)
+        classifier.online = header["online"]
+        classifier.watermark = header["watermark"]
+        classifier.table = pickle.loads((folder / "table.pickle").read_bytes())
+        classifier.counts = classifier.transactions = None
+        classifier._artifact = folder
+        return classifier
+
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+
+
+class NearestTransactionClassifier(ClassifierInterface):
+    """
+    Vote of the most similar past transactions, which works for merchants whose names vary a bit.
+
+    The neighbors are found with a MinHash LSH index over the character shingles of description
+    and counterparty: the signatures are split in bands and two texts are candidates if they share
+    a band, so a lookup only compares the few texts in the same buckets. Identical texts are
+    indexed once, with the count of their labels, and new rows are added without rebuilding it
+    """
+
+    label_fields = ["category"]
+    text_fields = ["description", "counterparty"]
+    input_fields = text_fields
+    shingle_size = 3
+    # 16 bands of 4 rows: texts with similarity 0.5 are candidates in ~2/3 of the cases
+    bands = 16
+    band_rows = 4
+    neighbors = 5
+    min_similarity = 0.5
+    # buckets shared by more texts than this come from common prefixes, not from similar texts
+    max_bucket_size = 500
+
+    def __init__(self, online: bool = False):
+        # the index is updated in place, so it can always be updated incrementally
+        self.online = True
+        self._reset()
+
+    def _reset(self):
+        permutations = self.bands * self.band_rows
+        rng = np.random.default_rng(0)
+        self._a = rng.integers(1, _MERSENNE_PRIME, permutations, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, permutations, dtype=np.uint64)
+        self.texts: dict[str, int] = {}
+        self.signatures = np.empty((1024, permutations), dtype=np.uint32)
+        self.votes: list[defaultdict[str, int]] = []
+        self.buckets: list[dict[bytes, list[int]]] = [{} for _ in range(self.bands)]
+        # index of the text and label of each transaction, to update them when they change
+        self.transactions: dict[str, tuple[int, str]] = {}
+
+    def _get_text(self, values: list[str | None]) -> str:
+        return " ".join(
+            filter(None, (rules.normalize_description(v) for v in values if isinstance(v, str)))
+        )
+
+    def _signature(self, text: str) -> np.ndarray:
+        size = self.shingle_size
+        shingles = {text[i : i + size] for i in range(max(len(text) - size + 1, 1))}
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+            dtype=np.uint64,
+            count=len(shingles),
+        )
+        # the multiplication can overflow, it's still a good enough universal hash
+        permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME
+        return (permuted & np.uint64(0xFFFFFFFF)).min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> list[bytes]:
+        rows = self.band_rows
+        return [signature[band * rows : (band + 1) * rows].tobytes() for band in range(self.bands)]
+
+    def _add_text(self, text: str) -> int:
+        if (index := self.texts.get(text)) is not None:
+            return index
+        index = len(self.votes)
+        if index == len(self.signatures):
+            self.signatures = np.concatenate([self.signatures, np.empty_like(self.signatures)])
+        signature = self._signature(text)
+        self.signatures[index] = signature
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            bucket.setdefault(key, []).append(index)
+        self.texts[text] = index
+        self.votes.append(defaultdict(int))
+        return index
+
+    def _remove(self, tx_id: str):
+        # the text stays in the index, without the vote of the transaction
+        if previous := self.transactions.pop(tx_id, None):
+            index, label = previous
+            self.votes[index][label] -= 1
+            if not self.votes[index][label]:
+                del self.votes[index][label]
+
+    def _add_rows(self, rows: pd.DataFrame):
+        for tx_id, label, *values in zip(
+            rows["tx_id"], rows["category"], *(rows[field] for field in self.text_fields)
+        ):
+            self._remove(tx_id)
+            text = self._get_text(values)
+            if not text or not isinstance(label, str) or not label:
+                continue
+            index = self._add_text(text)
+            self.votes[index][label] += 1
+            self.transactions[tx_id] = (index, label)
+
+    def fit(self, data: TrainingData):
+        self._reset()
+        self._add_rows(data.rows)
+        self.watermark = data.watermark
+
+    def update(self, db_path: str | Path):
+        if self.watermark is None:
+            return self.train(db_path)
+        changes = load_training_data(db_path, since=self.watermark)
+        self._add_rows(changes.rows)
+        for tx_id in changes.deleted:
+            self._remove(tx_id)
+        self.watermark = changes.watermark
+
+    def get_neighbors(self, text: str) -> list[tuple[int, float]]:
+        """
+        Return index and estimated Jaccard similarity of the most similar texts
+        """
+        signature = self._signature(text)
+        candidates = set()
+        for bucket, key in zip(self.buckets, self._band_keys(signature)):
+            if len(indexes := bucket.get(key, ())) <= self.max_bucket_size:
+                candidates.update(indexes)
+        if not candidates:
+            return []
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        similarities = (self.signatures[candidates] == signature).mean(axis=1)
+        order = np.argsort(-similarities, kind="stable")[: self.neighbors]
+        return [
+            (int(candidates[i]), float(similarities[i]))
+            for i in order
+            if similarities[i] >= self.min_similarity
+        ]
+
+    def predict_with_meta(self, item: dict[str, str]) -> tuple[dict[str, str], float, float]:
+        text = self._get_text([item.get(field) for field in self.text_fields])
+        scores = defaultdict(float)
+        neighbors = [
+            (index, similarity)
+            for index, similarity in (self.get_neighbors(text) if text else [])
+            if self.votes[index]
+        ]
+        for index, similarity in neighbors:
+            total = sum(self.votes[index].values())
+            for label, count in self.votes[index].items():
+                scores[label] += similarity * count / total
+        if not scores:
+            return {"category": ""}, 0.0, 0.0
+
+        ordered = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+        category, score = ordered[0]
+        second = ordered[1][1] if len(ordered) > 1 else 0.0
+        return {"category": category}, score / len(neighbors), (score - second) / len(neighbors)
@@ -0,0 +1,53 @@
+"""
+Client of the prediction server, see `src.server`. It has no heavy dependencies, so commands can
+use the server without importing the classifiers
+"""
+import json
+import socket
+from pathlib import Path
+from typing import Any
+
+
+class ServerError(RuntimeError):
+    pass
+
+
+class Client:
+    def __init__(self, path: Path, timeout: float | None = None):
+        self.path = path
+        self.timeout = timeout
+
+    def request(self, command: str, **kwargs) -> dict[str, Any]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(str(self.path))
+            sock.sendall(json.dumps({"command": command, **kwargs}).encode("utf-8") + b"\n")
+            with sock.makefile("rb") as response_file:
+                response = json.loads(response_file.readline())
+        if "error" in response:
+            raise ServerError(response["error"])
+        return response
+
+    def predict(self, items: list[dict[str, str]], classifier_names: list[str] | None = None):
+        return self.request("predict", items=items, classifier_names=classifier_names)[
+            "predictions"
+        ]
+
+    def guess(self, **kwargs):
+        self.request("guess", **kwargs)
+
+
+def get_client(path: Path) -> Client | None:
+    """
+    Return a client if a server is listening on the socket
+    """
+    if not path.exists():
+        return None
+    client = Client(path, timeout=1)
+    try:
+        client.request("ping")
+    except (OSError, ValueError):
+        # a socket left by a server that was killed
+        return None
+    client.timeout = None
+    return client
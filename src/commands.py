@@ -4,8 +4,11 @@ from pathlib import Path
 from typing import Optional
 
 import config
-from src import application, migrations
-from src.ledger_repos import gsheet, sqlite
+
+# the subsystems (application, classifiers, gsheet, server) import pandas, sklearn, nltk and the
+# Google client, so each command imports only what it uses, to keep the startup fast
+from src import client, migrations
+from src.ledger_repos import sqlite
 
 logger = logging.getLogger(__name__)
 
@@ -14,26 +17,28 @@ class Commands:
     def import_files(self, folder: Optional[str] = None, **kwargs):
         """
         Search for all the files contained in the data folder, for each try all the Importers until one works, then store the data in the database
+        The files in zip, gzip and tar.gz archives are read from the archives
         """
+        from src import application
+
         logger.info("Importing files")
-        folder_path = Path(folder) if folder else config.DATA_FOLDER
-        # get all the files in the data folder
-        files = [
-            file for file in folder_path.iterdir() if file.is_file() and file != config.DB_PATH
-        ]
         application.import_files(
-            files=files,
+            files=list_files(folder),
             months=calculate_months(**kwargs),
         )
 
-    def download(self, **kwargs):
+    def download(self, from_cache: bool = False, **kwargs):
         """
-        Download the transactions for a given month
+        Download the transactions for a given month, with --from_cache they are derived again from
+        the API responses downloaded before, without calling the APIs
         """
+        from src import application
+
         months = calculate_months(**kwargs)
         logger.info(f"Downloading transactions for {months}")
         application.download(
             months=months,
+            from_cache=from_cache,
         )
 
     def fetch(self, month: str):
@@ -52,12 +57,24 @@ class Commands:
         """
         Setup the google sheet
         """
+        from src.ledger_repos import gsheet
+
         gsheet.main(force=force)
 
+    def setup_nltk(self):
+        """
+        Download the NLTK data used by the classifiers
+        """
+        from src import classifiers
+
+        classifiers.download_nltk_resources()
+
     def push(self, **kwargs):
         """
         Pushes data to Google Sheet
         """
+        from src import application
+
         logger.info("Pushing data to google sheet")
         application.push_to_gsheet(
             months=calculate_months(**kwargs),
@@ -67,11 +84,21 @@ class Commands:
         """
         Pulls data from Google Sheet
         """
+        from src import application
+
         logger.info("Pulling data from google sheet")
         application.pull_from_gsheet(
             months=calculate_months(**kwargs),
         )
 
+    def flush_outbox(self):
+        """
+        Send to Google Sheet the operations queued while it was unreachable
+        """
+        from src import application
+
+        application.flush_outbox()
+
     def chain(self, *commands: list[str]):
         """
         Run a chain of commands
@@ -80,34 +107,67 @@ class Commands:
             fun = getattr(self, command)
             fun()
 
-    def train(self, classifiers: list[str] | None = None):
+    def train(
+        self,
+        classifiers: list[str] | None = None,
+        incremental: bool = False,
+        refit: bool = False,
+        parallel: bool = False,
+    ):
         """
-        Train the classifier
+        Train the classifier, with --incremental only the rows changed since the last training
+        are used, add --refit to periodically train the incremental models from scratch.
+        With --parallel each classifier is trained in its own process
         """
+        from src import application
+
         logger.info(f"Training classifiers: {classifiers}")
-        application.train(classifier_names=classifiers)
+        application.train(
+            classifier_names=classifiers, incremental=incremental, refit=refit, parallel=parallel
+        )
 
-    def guess(self, classifiers: list[str] | None = None, to_sync_only=False, **kwargs):
+    def guess(self, classifiers: list[str] | None = None, to_sync_only=False, rules=True, **kwargs):
         """
-        Backup the database
+        Fill the empty fields with the rules and the classifiers, --norules to use only the
+        classifiers
         """
-
-        application.guess(
+        arguments = dict(
             classifier_names=classifiers,
             months=calculate_months(**kwargs),
             to_sync_only=to_sync_only,
+            use_rules=rules,
         )
+        if server_client := client.get_client(config.SERVER_SOCKET):
+            logger.info("Guessing with the running server")
+            server_client.guess(**arguments)
+        else:
+            from src import application
+
+            application.guess(**arguments)
+
+    def serve(self):
+        """
+        Keep the classifiers loaded and answer predict and guess requests on a local socket,
+        `guess` uses it when it's running
+        """
+        from src import server
+
+        server.serve(config.SERVER_SOCKET)
 
     def review(self, month: str):
         """
         Review the transactions for a given month
         """
+        from src import application
+
         logger.info(f"Reviewing transactions for month {month}")
-        self.pull(month=month)
-        self.fetch(month=month)
-        self.train()
-        self.guess(month=month)
-        self.push(month=month)
+        application.review(months=[month], files=list_files())
+
+
+def list_files(folder: Optional[str] = None) -> list[Path]:
+    folder_path = Path(folder) if folder else config.DATA_FOLDER
+    # get all the files in the data folder
+    return [file for file in folder_path.iterdir() if file.is_file() and file != config.DB_PATH]
 
 
 def calculate_months(**kwargs):
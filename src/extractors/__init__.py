@@ -1,6 +1,50 @@
-from .base import ExcelImporter, FormatFileError, Importer, get_downloaders, get_importers
-from .fineco import FinecoImporter
-from .paypal import PaypalImporter
-from .revolut import RevolutImporter
-from .satispay import SatispayImporter
-from .splitwise import SplitWiseDownloader
+"""
+The importers and downloaders are registered by name, their modules and dependencies (openpyxl,
+splitwise) are imported only when they are used
+"""
+from importlib import import_module
+
+from . import archives, base, cache
+from .base import (
+    Changes,
+    Downloader,
+    ExcelImporter,
+    FormatFileError,
+    Importer,
+    SyncDownloader,
+    XmlImporter,
+)
+
+# name of the extractor: module defining it
+EXTRACTORS = {
+    "Camt053Importer": "camt",
+    "FinecoImporter": "fineco",
+    "OfxImporter": "ofx",
+    "PaypalImporter": "paypal",
+    "RevolutImporter": "revolut",
+    "SatispayImporter": "satispay",
+    "SplitWiseDownloader": "splitwise",
+}
+
+
+def load_extractors():
+    for module in EXTRACTORS.values():
+        import_module(f"{__name__}.{module}")
+
+
+def get_importers():
+    load_extractors()
+    return base.get_importers()
+
+
+def get_downloaders():
+    load_extractors()
+    return base.get_downloaders()
+
+
+def __getattr__(name: str):
+    if module := EXTRACTORS.get(name):
+        return getattr(import_module(f"{__name__}.{module}"), name)
+    if name in EXTRACTORS.values():
+        return import_module(f"{__name__}.{name}")
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,142 @@
+"""
+The statements in zip, gzip and tar.gz archives are imported without extracting them: each member
+is passed to the importers as a `Member`, opened like a `Path`, that streams its content from the
+archive.
+
+The importers are tried one after the other on each member, so it must be read again from the
+start after an importer gives up. The members of a zip or of a gzip file are just opened again,
+while a tar.gz is read once, sequentially, and the beginning of the current member is kept in
+memory: the importers that fail stop within the first lines.
+"""
+import gzip
+import io
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import BinaryIO, Callable, Generator
+
+from src import metrics
+
+SUFFIXES = (".zip", ".tar.gz", ".tgz", ".gz")
+
+
+def is_archive(path: Path) -> bool:
+    return path.name.lower().endswith(SUFFIXES)
+
+
+class Member:
+    """
+    A file in an archive, with the part of the `Path` interface used by the importers
+    """
+
+    def __init__(self, archive: Path, name: str, opener: Callable[[], BinaryIO]):
+        self.archive = archive
+        self.name = name
+        self._opener = opener
+
+    def open(self, mode: str = "r", encoding: str | None = None, newline: str | None = None):
+        stream = self._opener()
+        if "b" in mode:
+            return stream
+        return io.TextIOWrapper(stream, encoding=encoding, newline=newline)
+
+    def __str__(self) -> str:
+        return f"{self.archive}:{self.name}"
+
+    def __repr__(self) -> str:
+        return f"Member({str(self)!r})"
+
+
+class _ReplayableStream:
+    """
+    A stream read once, that can be opened again from the start as long as no more than `limit`
+    bytes were read from it, after that `reopen` is used
+    """
+
+    def __init__(self, stream: BinaryIO, reopen: Callable[[], BinaryIO], limit: int):
+        self.stream = stream
+        self.reopen = reopen
+        self.limit = limit
+        self.prefix = bytearray()
+        self.consumed = 0
+
+    def open(self) -> BinaryIO:
+        if self.consumed > self.limit:
+            metrics.incr("archive_members_reopened")
+            return self.reopen()
+        return io.BufferedReader(_ReplayReader(self))
+
+
+class _ReplayReader(io.RawIOBase):
+    def __init__(self, source: _ReplayableStream):
+        self.source = source
+        self.position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        source = self.source
+        if self.position < len(source.prefix):
+            data = source.prefix[self.position : self.position + len(buffer)]
+        else:
+            data = source.stream.read(len(buffer))
+            source.consumed += len(data)
+            if source.consumed <= source.limit:
+                source.prefix += data
+        buffer[: len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class _TarMemberReader(io.BufferedReader):
+    """
+    A member opened from its own instance of the tar, which is closed with the member
+    """
+
+    def __init__(self, path: Path, name: str):
+        # random access, it decompresses the archive up to the member
+        self.tar = tarfile.open(path, "r:*")
+        try:
+            # the stream of tarfile closes its raw file when garbage collected, it's kept
+            self.member = self.tar.extractfile(name)
+            super().__init__(self.member.raw)
+        except BaseException:
+            self.tar.close()
+            raise
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.tar.close()
+
+
+def iter_members(path: Path, replay_limit: int = 1024 * 1024) -> Generator[Member, None, None]:
+    """
+    The files in the archive, each must be read before getting the next one
+    """
+    name = path.name.lower()
+    if name.endswith(".zip"):
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield Member(path, info.filename, lambda info=info: archive.open(info))
+
+    elif name.endswith((".tar.gz", ".tgz")):
+        with tarfile.open(path, "r|gz") as archive:
+            for info in archive:
+                if not info.isfile():
+                    continue
+                stream = _ReplayableStream(
+                    archive.extractfile(info),
+                    lambda info=info: _TarMemberReader(path, info.name),
+                    replay_limit,
+                )
+                yield Member(path, info.name, stream.open)
+
+    elif name.endswith(".gz"):
+        yield Member(path, path.name[: -len(".gz")], lambda: gzip.open(path, "rb"))
+
+    else:
+        raise ValueError(f"{path} is not an archive")
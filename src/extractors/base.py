@@ -1,14 +1,19 @@
 import abc
+import asyncio
+import io
+import re
+import xml.etree.ElementTree as ElementTree
+import zipfile
 from csv import DictReader
+from dataclasses import dataclass, field
 from datetime import datetime
 from decimal import Decimal
 from pathlib import Path
-from typing import Generator, Optional, Union
+from typing import Any, Generator, Iterable, Optional, Union
 
-import openpyxl
-from pyparsing import Any
+from src import metrics, models, utils
 
-from src import models, utils
+from . import archives, cache
 
 
 def get_importers() -> Generator[type["Importer"], None, None]:
@@ -30,17 +35,72 @@ class FormatFileError(ValueError):
 
 
 class Importer(abc.ABC):
-    def __init__(self, file_path: Union[str, Path]):
-        self.source_file = Path(file_path)
+    def __init__(self, file_path: Union[str, Path, archives.Member]):
+        # the members of the archives are opened like the paths
+        self.source_file = file_path if isinstance(file_path, archives.Member) else Path(file_path)
 
     @abc.abstractmethod
     def get_ledger_items(self) -> Generator[models.LedgerItem, None, None]:
         raise NotImplementedError()
 
 
+@dataclass
+class Changes:
+    """
+    Transactions downloaded from a source, with the ones deleted from it when the download is
+    incremental
+    """
+
+    items: list[models.LedgerItem]
+    # tx_id of the deleted transactions
+    deleted: list[str] = field(default_factory=list)
+    # where the next incremental download starts, None for the downloads of a month
+    watermark: str | None = None
+    # name of the downloader
+    source: str | None = None
+
+
 class Downloader(abc.ABC):
-    def __init__(self, file_path: Union[str, Path]):
-        self.source_file = Path(file_path)
+    """
+    Download the transactions from a provider API, the months are fetched concurrently, at most
+    `max_concurrency` at a time for each provider
+    """
+
+    max_concurrency = 4
+    # the provider can return only what changed since the previous download, see `fetch_changes`
+    incremental = False
+
+    def __init__(self, cache_policy: cache.Policy = cache.Policy.USE):
+        """
+        `cache_policy` is used by the downloaders keeping the responses in a `cache.ResponseCache`
+        """
+        self.cache_policy = cache_policy
+
+    @abc.abstractmethod
+    async def fetch(self, month: str | None = None) -> list[models.LedgerItem]:
+        """
+        Download the transactions of the month, or the latest ones if no month is given
+        """
+        raise NotImplementedError()
+
+    async def fetch_changes(self, updated_after: str | None) -> Changes:
+        """
+        Download the transactions created, updated or deleted after the `updated_after` watermark
+        of the previous download, all of them if None
+        """
+        raise NotImplementedError()
+
+    def get_ledger_items(
+        self, month: str | None = None
+    ) -> Generator[models.LedgerItem, None, None]:
+        yield from asyncio.run(self.fetch(month))
+
+
+class SyncDownloader(Downloader):
+    """
+    Adapter for the providers with a blocking client: `get_ledger_items` is run in a thread, so
+    it doesn't block the other downloads
+    """
 
     @abc.abstractmethod
     def get_ledger_items(
@@ -48,6 +108,15 @@ class Downloader(abc.ABC):
     ) -> Generator[models.LedgerItem, None, None]:
         raise NotImplementedError()
 
+    def get_changes(self, updated_after: str | None) -> Changes:
+        raise NotImplementedError()
+
+    async def fetch(self, month: str | None = None) -> list[models.LedgerItem]:
+        return await asyncio.to_thread(lambda: list(self.get_ledger_items(month)))
+
+    async def fetch_changes(self, updated_after: str | None) -> Changes:
+        return await asyncio.to_thread(self.get_changes, updated_after)
+
 
 class CsvImporter(Importer):
     columns = [
@@ -66,7 +135,7 @@ class CsvImporter(Importer):
         """
         Open the csv file and return a generator of tuples containing the data
         """
-        with open(self.source_file, "r", encoding="utf-8-sig") as f:
+        with self.source_file.open("r", encoding="utf-8-sig") as f:
             reader = DictReader(f)
 
             # if the columns are not the expected ones, raise an error
@@ -77,8 +146,13 @@ class CsvImporter(Importer):
             if not set(self.columns).issubset(file_columns):
                 raise FormatFileError(f"Unable to open file {self.source_file}")
 
-            for row in reader:
-                yield row
+            read = 0
+            try:
+                for row in reader:
+                    read += 1
+                    yield row
+            finally:
+                metrics.incr("records_read", read, format="csv")
 
     def get_ledger_items(self) -> Generator[models.LedgerItem, None, None]:
         # fields to import: Extra,Amount EUR
@@ -108,15 +182,29 @@ class ExcelImporter(Importer):
     fields = []
 
     def get_file_content(self):
+        import openpyxl
+
+        if isinstance(self.source_file, archives.Member):
+            source = self._read_member()
+        else:
+            source = str(self.source_file)
         try:
-            workbook = openpyxl.load_workbook(str(self.source_file))
-        except openpyxl.utils.exceptions.InvalidFileException:
+            workbook = openpyxl.load_workbook(source)
+        except (openpyxl.utils.exceptions.InvalidFileException, zipfile.BadZipFile):
             raise FormatFileError(f"Unable to open file {self.source_file}")
 
         sheet = workbook.active
 
         return [[cell.value for cell in row] for row in sheet.rows]
 
+    def _read_member(self) -> io.BytesIO:
+        # openpyxl seeks in the file, which is a zip: check the signature before reading it all
+        with self.source_file.open("rb") as f:
+            signature = f.read(4)
+            if signature != b"PK\x03\x04":
+                raise FormatFileError(f"Unable to open file {self.source_file}")
+            return io.BytesIO(signature + f.read())
+
     def get_records_from_file(self) -> Generator[dict[str, Any], None, None]:
         """
         Open the excel file and return a generator of tuples containing the data
@@ -126,5 +214,64 @@ class ExcelImporter(Importer):
         if self.fields != header:
             raise FormatFileError(f"{self.source_file} does not contain expected fields")
 
+        metrics.incr("records_read", len(records) - self.skip_lines, format="excel")
         for row in records[self.skip_lines :]:
             yield dict(zip(header, row))
+
+
+def find_text(element: ElementTree.Element, path: str) -> str | None:
+    """
+    The stripped text of the element at `path`, like `"BookgDt/Dt"`
+    """
+    text = element.findtext(path)
+    return text.strip() if text is not None else None
+
+
+class XmlImporter(Importer):
+    """
+    Importer of the XML statements, parsed incrementally: the elements named in `tags` are
+    yielded as soon as they are complete, then dropped from the tree, so the memory used doesn't
+    grow with the size of the file. The namespaces are removed from the tags, matching them in the
+    paths is much slower
+    """
+
+    # regular expression matching the tag of the root element, with the namespace
+    root_tag = ""
+    # names, without namespace, of the elements to yield
+    tags: set[str] = set()
+    chunk_size = 64 * 1024
+
+    def read_chunks(self) -> Iterable[bytes]:
+        with self.source_file.open("rb") as f:
+            while chunk := f.read(self.chunk_size):
+                yield chunk
+
+    def get_elements_from_file(self) -> Generator[ElementTree.Element, None, None]:
+        parser = ElementTree.XMLPullParser(events=("start", "end"))
+        # the open elements, from the root
+        stack = []
+        read = 0
+        try:
+            for chunk in self.read_chunks():
+                parser.feed(chunk)
+                for event, element in parser.read_events():
+                    if event == "start":
+                        if not stack and not re.fullmatch(self.root_tag, element.tag):
+                            raise FormatFileError(
+                                f"{self.source_file} is not a {type(self).__name__} statement"
+                            )
+                        element.tag = element.tag.rpartition("}")[2]
+                        stack.append(element)
+                        continue
+                    stack.pop()
+                    if element.tag in self.tags:
+                        read += 1
+                        yield element
+                        element.clear()
+                        if stack:
+                            stack[-1].remove(element)
+            parser.close()
+        except (ElementTree.ParseError, UnicodeDecodeError):
+            raise FormatFileError(f"Unable to open file {self.source_file}")
+        finally:
+            metrics.incr("records_read", read, format="xml")
@@ -0,0 +1,106 @@
+"""
+Cache of the raw responses of the downloader APIs, so the items can be derived from them again
+without calling the APIs, e.g. after fixing the mapping of a downloader:
+
+    ./run.py download --month=2023-02 --from-cache
+
+Each response is stored as gzipped JSON, in a folder for each provider, named after the hash of
+the request. A cached response is used while it's younger than the TTL, then it's requested
+again; if the API is unreachable the stale response is used anyway.
+"""
+import datetime
+import enum
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Generator
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Policy(enum.Enum):
+    # the responses younger than the TTL are read from the cache, the others are requested
+    USE = "use"
+    # only the cache is used, the API is never called
+    REPLAY = "replay"
+
+
+class CacheMissError(LookupError):
+    pass
+
+
+class ResponseCache:
+    def __init__(self, folder: Path, ttl: float = 0, policy: Policy = Policy.USE):
+        """
+        `ttl` is in seconds, with 0 the responses are stored but always requested again
+        """
+        self.folder = folder
+        self.ttl = ttl
+        self.policy = policy
+
+    def _path(self, request: str) -> Path:
+        key = hashlib.sha256(request.encode("utf-8")).hexdigest()
+        return self.folder / key[:2] / f"{key}.json.gz"
+
+    def read(self, request: str) -> dict[str, Any] | None:
+        """
+        Return the cached entry of the request, with the `request`, the `response` and the time
+        it was `fetched` at
+        """
+        try:
+            return json.loads(gzip.decompress(self._path(request).read_bytes()))
+        except FileNotFoundError:
+            return None
+
+    def write(self, request: str, response: Any):
+        path = self._path(request)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {"request": request, "fetched": time.time(), "response": response}
+        tmp_path = path.with_name(f".{path.name}-{os.getpid()}")
+        tmp_path.write_bytes(gzip.compress(json.dumps(entry).encode("utf-8")))
+        os.replace(tmp_path, path)
+
+    def get(self, request: str, fetch: Callable[[], Any]) -> Any:
+        """
+        Return the response to the request, from the cache or calling `fetch`, according to the
+        policy
+        """
+        entry = self.read(request)
+        provider = self.folder.name
+        if self.policy == Policy.REPLAY:
+            if entry is None:
+                raise CacheMissError(f"{request} is not in the {provider} cache")
+            metrics.incr("response_cache", result="hit", provider=provider)
+            return entry["response"]
+        if entry is not None and time.time() - entry["fetched"] < self.ttl:
+            metrics.incr("response_cache", result="hit", provider=provider)
+            return entry["response"]
+
+        try:
+            response = fetch()
+        except OSError as err:
+            if entry is None:
+                raise
+            fetched = datetime.datetime.fromtimestamp(entry["fetched"])
+            logger.warning(f"Unable to reach {provider} ({err}), using the response of {fetched}")
+            metrics.incr("response_cache", result="stale", provider=provider)
+            return entry["response"]
+        metrics.incr("response_cache", result="miss", provider=provider)
+        self.write(request, response)
+        return response
+
+    def entries(self) -> Generator[dict[str, Any], None, None]:
+        """
+        All the cached entries, oldest first
+        """
+        entries = [
+            json.loads(gzip.decompress(path.read_bytes()))
+            for path in self.folder.glob("*/*.json.gz")
+        ]
+        yield from sorted(entries, key=lambda entry: entry["fetched"])
@@ -0,0 +1,78 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Generator
+
+from src import models
+
+from . import base
+
+
+class Camt053Importer(base.XmlImporter):
+    """
+    Importer of the ISO 20022 CAMT.053 bank to customer statements, any version of the schema
+    """
+
+    root_tag = r"\{urn:iso:std:iso:20022:tech:xsd:camt\.053\.[0-9.]+\}Document"
+    tags = {"Acct", "Ntry", "Stmt"}
+
+    def get_ledger_items(self) -> Generator[models.LedgerItem, None, None]:
+        account = None
+        for element in self.get_elements_from_file():
+            tag = element.tag
+            if tag == "Acct":
+                bank = base.find_text(element, "Svcr/FinInstnId/Nm") or base.find_text(
+                    element, "Svcr/FinInstnId/BICFI"
+                )
+                number = base.find_text(element, "Id/IBAN") or base.find_text(element, "Id/Othr/Id")
+                account = f"{bank} {number}" if bank else number
+            elif tag == "Stmt":
+                account = None
+            # the pending entries can still change, they are imported once booked
+            elif (base.find_text(element, "Sts/Cd") or base.find_text(element, "Sts")) in (
+                "BOOK",
+                None,
+            ):
+                yield self._get_ledger_item(element, account)
+
+    def _get_ledger_item(self, element, account: str | None) -> models.LedgerItem:
+        if account is None:
+            raise base.FormatFileError(f"{self.source_file} has an entry outside a statement")
+        booked = base.find_text(element, "BookgDt/DtTm") or base.find_text(element, "BookgDt/Dt")
+        tx_datetime = datetime.fromisoformat(booked[:19])
+        amount = Decimal(base.find_text(element, "Amt"))
+        if base.find_text(element, "CdtDbtInd") == "DBIT":
+            amount = -amount
+            # the other party is the creditor, in the schemas before and after 2019
+            counterparty = base.find_text(
+                element, "NtryDtls/TxDtls/RltdPties/Cdtr/Nm"
+            ) or base.find_text(element, "NtryDtls/TxDtls/RltdPties/Cdtr/Pty/Nm")
+            ledger_item_type = models.LedgerItemType.EXPENSE
+        else:
+            counterparty = base.find_text(
+                element, "NtryDtls/TxDtls/RltdPties/Dbtr/Nm"
+            ) or base.find_text(element, "NtryDtls/TxDtls/RltdPties/Dbtr/Pty/Nm")
+            ledger_item_type = models.LedgerItemType.INCOME
+
+        description = base.find_text(element, "AddtlNtryInf") or " ".join(
+            line.text.strip() for line in element.iterfind("NtryDtls/TxDtls/RmtInf/Ustrd")
+        )
+        # the reference given by the bank is unique within the account
+        reference = (
+            base.find_text(element, "AcctSvcrRef")
+            or base.find_text(element, "NtryRef")
+            or base.find_text(element, "NtryDtls/TxDtls/Refs/AcctSvcrRef")
+        )
+        if reference is None:
+            raise base.FormatFileError(f"{self.source_file} has an entry without a reference")
+
+        return models.LedgerItem(
+            tx_id=models.calculate_unique_id(f"{account}:{reference}"),
+            tx_date=tx_datetime.date(),
+            tx_datetime=tx_datetime,
+            amount=amount,
+            currency=element.find("Amt").get("Ccy"),
+            description=description,
+            account=account,
+            ledger_item_type=ledger_item_type,
+            counterparty=counterparty,
+        )
@@ -6,8 +6,6 @@ from itertools import count
 from pathlib import Path
 from typing import Generator
 
-import openpyxl
-
 from src import models
 
 from . import base
@@ -26,7 +24,7 @@ class FinecoImporter(base.ExcelImporter):
         "Moneymap",
     ]
 
-    def __init__(self, file_path: str | Path):
+    def __init__(self, file_path: str | Path | base.archives.Member):
         super().__init__(file_path)
         self.dates_counter = defaultdict(count)
 
@@ -0,0 +1,96 @@
+import re
+from datetime import datetime
+from decimal import Decimal
+from typing import Generator, Iterable
+
+from src import models
+
+from . import base
+
+# a value not followed by the closing tag, as in the SGML of OFX 1.x: <TRNAMT>-12.50
+SGML_VALUE = re.compile(r"<([A-Za-z0-9.]+)>([^<]+)(?=<|$)(?!</\1>)")
+SGML_AMPERSAND = re.compile(r"&(?!(?:amp|lt|gt|quot|apos|#\d+);)")
+
+
+def _parse_datetime(value: str) -> datetime:
+    # like 20230215, 20230215120000 or 20230215120000.000[-5:EST], the local time is kept
+    digits = re.match(r"\d+", value).group()
+    return datetime.strptime(digits[:14].ljust(14, "0"), "%Y%m%d%H%M%S")
+
+
+class OfxImporter(base.XmlImporter):
+    """
+    Importer of the OFX statements, bank and credit card ones, both the XML of OFX 2 and the SGML
+    of OFX 1, which is converted to XML line by line while it's read
+    """
+
+    root_tag = "OFX"
+    tags = {"ORG", "CURDEF", "BANKACCTFROM", "CCACCTFROM", "STMTTRN", "STMTRS", "CCSTMTRS"}
+
+    def read_chunks(self) -> Iterable[bytes]:
+        with self.source_file.open("rb") as f:
+            first_line = f.readline()
+            if not first_line.strip().startswith(b"OFXHEADER:"):
+                yield first_line
+                while chunk := f.read(self.chunk_size):
+                    yield chunk
+                return
+
+            # the SGML header is a list of KEY:VALUE lines, followed by the body
+            header = {}
+            for line in f:
+                if line.lstrip().startswith(b"<"):
+                    break
+                key, _, value = line.decode("ascii").strip().partition(":")
+                header[key] = value
+            encoding = "utf-8" if header.get("ENCODING") == "UTF-8" else "cp1252"
+            while line:
+                text = SGML_AMPERSAND.sub("&amp;", line.decode(encoding).strip())
+                yield (SGML_VALUE.sub(r"<\1>\2</\1>", text) + "\n").encode("utf-8")
+                line = f.readline()
+
+    def get_ledger_items(self) -> Generator[models.LedgerItem, None, None]:
+        bank = "OFX"
+        currency = account = None
+        for element in self.get_elements_from_file():
+            tag = element.tag
+            if tag == "ORG":
+                bank = element.text.strip()
+            elif tag == "CURDEF":
+                currency = element.text.strip()
+            elif tag in ("BANKACCTFROM", "CCACCTFROM"):
+                account = f"{bank} {base.find_text(element, 'ACCTID')}"
+            elif tag in ("STMTRS", "CCSTMTRS"):
+                currency = account = None
+            elif tag == "STMTTRN":
+                yield self._get_ledger_item(element, account, currency)
+
+    def _get_ledger_item(self, element, account: str | None, currency: str | None):
+        if account is None or currency is None:
+            raise base.FormatFileError(f"{self.source_file} has a transaction outside a statement")
+        tx_datetime = _parse_datetime(
+            base.find_text(element, "DTUSER") or base.find_text(element, "DTPOSTED")
+        )
+        amount = Decimal(base.find_text(element, "TRNAMT").replace(",", "."))
+        name = base.find_text(element, "NAME") or base.find_text(element, "PAYEE/NAME")
+        memo = base.find_text(element, "MEMO")
+
+        if base.find_text(element, "TRNTYPE") == "XFER":
+            ledger_item_type = models.LedgerItemType.TRANSFER
+        elif amount < 0:
+            ledger_item_type = models.LedgerItemType.EXPENSE
+        else:
+            ledger_item_type = models.LedgerItemType.INCOME
+
+        return models.LedgerItem(
+            # FITID is unique only within the account
+            tx_id=models.calculate_unique_id(f"{account}:{base.find_text(element, 'FITID')}"),
+            tx_date=tx_datetime.date(),
+            tx_datetime=tx_datetime,
+            amount=amount,
+            currency=base.find_text(element, "CURRENCY/CURSYM") or currency,
+            description=" ".join(filter(None, [name, memo])),
+            account=account,
+            ledger_item_type=ledger_item_type,
+            counterparty=name,
+        )
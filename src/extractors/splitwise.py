@@ -1,46 +1,151 @@
 import hashlib
+import json
 from datetime import date, datetime, timedelta
 from decimal import Decimal
+from functools import cached_property
 from typing import Generator
 
 import splitwise
 from dateutil import parser
 
 import config
-from src import models
+from src import metrics, models
 
-from . import base
+from . import base, cache
 
 
-class SplitWiseDownloader(base.Downloader):
+class CachingSplitwise(splitwise.Splitwise):
+    """
+    Splitwise client keeping the raw responses of the GET requests in a `ResponseCache`
+    """
+
+    def __init__(self, *args, response_cache: cache.ResponseCache, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.response_cache = response_cache
+
+    # all the requests of the SDK go through this method, it returns the body of the response
+    def _Splitwise__makeRequest(self, url, method="GET", data=None, auth=None, files=None):
+        make_request = super()._Splitwise__makeRequest
+        if method != "GET":
+            return make_request(url, method, data, auth, files)
+
+        def fetch():
+            metrics.incr("api_calls", provider="splitwise")
+            return json.loads(make_request(url, method, data, auth, files))
+
+        return json.dumps(self.response_cache.get(url, fetch))
+
+
+class SplitWiseDownloader(base.SyncDownloader):
+    account = "Splitwise"
+    incremental = True
+    # expenses requested in each call
+    page_size = 200
+
     def __init__(
         self,
         client: splitwise.Splitwise | None = None,
+        cache_policy: cache.Policy = cache.Policy.USE,
     ):
-        self.client = client or splitwise.Splitwise(
+        super().__init__(cache_policy)
+        self.response_cache = cache.ResponseCache(
+            config.RESPONSE_CACHE_FOLDER / "splitwise", config.RESPONSE_CACHE_TTL, cache_policy
+        )
+        self.client = client or CachingSplitwise(
             config.SPLITWISE_CONSUMER_KEY,
             config.SPLITWISE_CONSUMER_SECRET,
             api_key=config.SPLITWISE_API_KEY,
+            response_cache=self.response_cache,
         )
         self.user_id = self.client.getCurrentUser().id
 
-    def get_ledger_items(self, month: str | None) -> Generator[models.LedgerItem, None, None]:
+    def get_ledger_items(
+        self, month: str | None = None
+    ) -> Generator[models.LedgerItem, None, None]:
+        filters = {}
         if month:
             dated_after_str = f"{month}-01"
             dated_before = date.fromisoformat(dated_after_str) + timedelta(days=31)
             dated_before_str = dated_before.isoformat()[:8] + "01"
-            items = self.client.getExpenses(
-                limit=999, dated_after=dated_after_str, dated_before=dated_before_str
-            )
-        else:
-            items = self.client.getExpenses(limit=999)
-        for item in items:
+            filters = dict(dated_after=dated_after_str, dated_before=dated_before_str)
+        for item in self._get_expenses(**filters):
+            if item.deleted_at:
+                continue
             ledger_item = self._ledger_item_from_expense(item)
             if ledger_item:
                 yield ledger_item
 
+    def get_changes(self, updated_after: str | None) -> base.Changes:
+        """
+        The expenses created, edited or deleted after `updated_after`, an ISO timestamp like
+        2021-02-18T10:00:00Z, the watermark is the last update seen
+        """
+        filters = {"updated_after": updated_after} if updated_after else {}
+        changes = base.Changes(items=[], watermark=updated_after)
+        for item in self._get_expenses(**filters):
+            # the timestamps have the same format, so they sort as strings
+            changes.watermark = max(
+                filter(None, [changes.watermark, item.updated_at, item.deleted_at])
+            )
+            ledger_item = None if item.deleted_at else self._ledger_item_from_expense(item)
+            if ledger_item:
+                changes.items.append(ledger_item)
+            else:
+                # deleted, or the user is no longer part of it
+                changes.deleted.append(self._tx_id(item))
+        return changes
+
+    def _get_expenses(self, **filters) -> Generator[splitwise.Expense, None, None]:
+        if self.cache_policy == cache.Policy.REPLAY:
+            yield from self._get_cached_expenses(**filters)
+            return
+        offset = 0
+        while True:
+            page = self.client.getExpenses(offset=offset, limit=self.page_size, **filters)
+            yield from page
+            if len(page) < self.page_size:
+                break
+            offset += len(page)
+
+    @cached_property
+    def _cached_expenses(self) -> dict[int, splitwise.Expense]:
+        """
+        The last version of each expense in the cached responses, read once for all the months
+        """
+        expenses = {}
+        for entry in self.response_cache.entries():
+            if not entry["request"].startswith(splitwise.Splitwise.GET_EXPENSES_URL):
+                continue
+            for data in entry["response"].get("expenses", []):
+                expense = splitwise.Expense(data)
+                previous = expenses.get(expense.id)
+                if previous is None or expense.updated_at >= previous.updated_at:
+                    expenses[expense.id] = expense
+        return expenses
+
+    def _get_cached_expenses(
+        self,
+        dated_after: str | None = None,
+        dated_before: str | None = None,
+        updated_after: str | None = None,
+    ) -> Generator[splitwise.Expense, None, None]:
+        """
+        The expenses in the cached responses, filtered like the API does
+        """
+        for expense in self._cached_expenses.values():
+            if dated_after and expense.date < dated_after:
+                continue
+            if dated_before and expense.date >= dated_before:
+                continue
+            if updated_after and expense.updated_at <= updated_after:
+                continue
+            yield expense
+
+    def _tx_id(self, expense: splitwise.Expense) -> str:
+        return hashlib.sha1(f"{self.account}-{expense.id}".encode("utf-8")).hexdigest()
+
     def _ledger_item_from_expense(self, expense: splitwise.Expense) -> models.LedgerItem:
-        account = "Splitwise"
+        account = self.account
 
         try:
             [my_part] = [u for u in expense.users if u.id == self.user_id]
@@ -56,7 +161,7 @@ class SplitWiseDownloader(base.Downloader):
         tx_datetime = parser.parse(expense.date)
 
         return models.LedgerItem(
-            tx_id=hashlib.sha1(f"{account}-{expense.id}".encode("utf-8")).hexdigest(),
+            tx_id=self._tx_id(expense),
             tx_date=tx_datetime.date(),
             tx_datetime=tx_datetime,
             amount=amount,
@@ -1,13 +1,18 @@
 from __future__ import print_function
 
 import datetime
+import json
+import logging
 import os.path
+import socket
 import time
 from contextlib import contextmanager
 from dataclasses import dataclass
 from functools import cache
+from itertools import takewhile
 from typing import Callable, Generator, Iterable
 
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
@@ -15,8 +20,10 @@ from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
 import config
-from src import models
-from src.ledger_repos import gsheet
+from src import metrics, models
+from src.ledger_repos import gsheet, sqlite
+
+logger = logging.getLogger(__name__)
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
@@ -88,29 +95,77 @@ def _range(month: str, range: str | None = None) -> str:
 
 @dataclass
 class Operation:
-    type: str  # one of "update", "clear"
+    type: str  # one of "update", "clear", "append"
     range: str
     values: list[list[str]] | None = None
 
+    def supersedes(self, other: "Operation") -> bool:
+        """
+        True if running `other` before this operation makes no difference on the sheet
+        """
+        if self.range != other.range or other.type == "append":
+            return False
+        return self.type == "clear" or (self.type == "update" and other.type == "update")
+
+
+def coalesce(operations: Iterable[Operation]) -> list[Operation]:
+    """
+    Drop the operations that are overwritten by a later one on the same range
+    """
+    result = []
+    for operation in operations:
+        result = [other for other in result if not operation.supersedes(other)]
+        result.append(operation)
+    return result
+
+
+def is_offline_error(err: Exception) -> bool:
+    """
+    True if the error is caused by the network or by Sheets being unavailable, so the same
+    request could succeed later
+    """
+    if isinstance(err, HttpError):
+        return err.resp.status == 429 or err.resp.status >= 500
+    return isinstance(err, (ConnectionError, TimeoutError, socket.gaierror, httplib2.HttpLib2Error))
+
 
 class SheetConnection:
-    def __init__(self, sheet_id: str):
+    # minimum time between two flushes, to avoid hitting the rate limit
+    min_flush_interval = datetime.timedelta(seconds=1)
+
+    def __init__(self, sheet_id: str, service=None):
+        """
+        `service` can be any object exposing the Sheets v4 `spreadsheets()` resource, when not
+        given the real Google API client is built on first use
+        """
         self.sheet_id = sheet_id
+        self.service = service
         self.operations_to_commit: list[Operation] = []
         self.last_flushed = datetime.datetime.now()
 
     @property
     def sheet(self):
-        self.credentials = config.GSHEET_CREDENTIALS or "credentials.json"
-        creds = get_creds()
-        service = build("sheets", "v4", credentials=creds)
-        return service.spreadsheets()
+        if self.service is None:
+            self.credentials = config.GSHEET_CREDENTIALS or "credentials.json"
+            creds = get_creds()
+            self.service = build("sheets", "v4", credentials=creds)
+        return self.service.spreadsheets()
+
+    def execute(self, method: str, request, body: dict | None = None):
+        """
+        Execute a request of the Sheets API, counting the calls, the bytes sent and the time spent
+        """
+        metrics.incr("sheets_calls", method=method)
+        if body is not None:
+            metrics.incr("sheets_bytes_sent", len(json.dumps(body, default=str)))
+        with metrics.timer("sheets_call", method=method):
+            return request.execute()
 
     @cache
     def _get_meta(self):
-        return self.sheet.get(
-            spreadsheetId=self.sheet_id, ranges=[], includeGridData=False
-        ).execute()
+        return self.execute(
+            "get", self.sheet.get(spreadsheetId=self.sheet_id, ranges=[], includeGridData=False)
+        )
 
     def get_sheet_titles(self):
         meta = self._get_meta()
@@ -128,21 +183,22 @@ class SheetConnection:
         request = self.sheet.values().batchUpdate(
             spreadsheetId=self.sheet_id, body=batch_update_values_request_body
         )
-        return request.execute()
+        return self.execute("values.batchUpdate", request, batch_update_values_request_body)
 
     def append(self, range: str, values: Iterable[Iterable[str]]):
         self.operations_to_commit.append(Operation(type="append", range=range, values=values))
 
     def _append(self, queue):
         for op in queue:
+            body = {"values": op.values}
             request = self.sheet.values().append(
                 spreadsheetId=self.sheet_id,
                 range=op.range,
                 valueInputOption="USER_ENTERED",
                 insertDataOption="INSERT_ROWS",
-                body={"values": op.values},
+                body=body,
             )
-            request.execute()
+            self.execute("values.append", request, body)
 
     def clear(self, range: str):
         self.operations_to_commit.append(Operation(type="clear", range=range))
@@ -152,74 +208,163 @@ class SheetConnection:
         request = self.sheet.values().batchClear(
             spreadsheetId=self.sheet_id, body=batch_clear_request_body
         )
-        return request.execute()
+        return self.execute("values.batchClear", request, batch_clear_request_body)
 
     def _flush(self, op_type: str, queue):
-        # wait until the last operation is at least 1 second old to avoid hitting the rate limit
-        while (datetime.datetime.now() - self.last_flushed) < datetime.timedelta(seconds=1):
-            time.sleep(0.1)
+        # wait until the last operation is old enough to avoid hitting the rate limit
+        with metrics.timer("sheets_throttle_wait"):
+            while (datetime.datetime.now() - self.last_flushed) < self.min_flush_interval:
+                time.sleep(0.1)
         self.last_flushed = datetime.datetime.now()
         if queue:
             if op_type == "update":
                 self._update(queue)
             elif op_type == "clear":
                 self._clear(queue)
+            elif op_type == "append":
+                self._append(queue)
             else:
                 raise Exception(f"Unknown operation type: {op_type}")
 
     def flush(self):
-        queue = []
-        op_type = ""
-        for op in self.operations_to_commit[:]:
-            if op.type != op_type:
-                self._flush(op_type, queue)
-                queue = []
-                op_type = ""
-                for committed_op in queue:
-                    self.operations_to_commit.remove(committed_op)
-            queue.append(op)
-            op_type = op.type
-        self._flush(op_type, queue)
+        """
+        Send the queued operations, grouping the consecutive ones of the same type in a single
+        request. Sent operations are removed from the queue, so on error it contains only the
+        ones still to send
+        """
+        self.operations_to_commit = coalesce(self.operations_to_commit)
+        self._send()
+
+    def _send(self):
+        while self.operations_to_commit:
+            op_type = self.operations_to_commit[0].type
+            queue = list(takewhile(lambda op: op.type == op_type, self.operations_to_commit))
+            self._flush(op_type, queue)
+            del self.operations_to_commit[: len(queue)]
 
     def rollback(self):
-        self.update_to_commit = []
+        self.operations_to_commit = []
+
+    def drain(self, outbox: "OutboxRepo", batch_size: int = 100) -> int:
+        """
+        Send the operations stored in the outbox in batches, return how many were sent
+        """
+        sent = 0
+        while pending := outbox.get_pending(limit=batch_size):
+            ids = [id for id, _ in pending]
+            queued, self.operations_to_commit = self.operations_to_commit, [op for _, op in pending]
+            # the outbox is coalesced when stored, the operations are sent one to one with its rows
+            try:
+                self._send()
+            except Exception:
+                sent_now = len(ids) - len(self.operations_to_commit)
+                outbox.delete(ids[:sent_now])
+                raise
+            finally:
+                self.operations_to_commit = queued
+            outbox.delete(ids)
+            sent += len(pending)
+        return sent
 
     def get(self, range: str):
         try:
-            result = self.sheet.values().get(spreadsheetId=self.sheet_id, range=range).execute()
+            result = self.execute(
+                "values.get", self.sheet.values().get(spreadsheetId=self.sheet_id, range=range)
+            )
         except HttpError as err:
+            # a missing range is empty, but a failed read must not look like an empty month: the
+            # operations queued from it would wipe the month when sent from the outbox
+            if is_offline_error(err):
+                raise
             return []
         else:
             return result.get("values", [])
 
 
 @contextmanager
-def sheet_context(db_path: str | None = None) -> Generator[SheetConnection, None, None]:
+def sheet_context(
+    db_path: str | None = None, db: sqlite.Connection | None = None
+) -> Generator[SheetConnection, None, None]:
     """
-    Get the default database
+    Get the default sheet, operations that cannot be sent because the sheet is unreachable are
+    stored in the outbox of the local database. Pass the `db` connection used with the sheet, if
+    any: a second connection would wait for its pending writes, and fail
     """
     sheet_id = config.GSHEET_SHEET_ID
     conn = SheetConnection(sheet_id)
     try:
         yield conn
-        conn.flush()
     except Exception:
         conn.rollback()
         raise
 
+    try:
+        conn.flush()
+    except Exception as err:
+        if not is_offline_error(err):
+            conn.rollback()
+            raise
+        logger.warning(
+            f"Unable to reach the sheet ({err}), "
+            f"{len(conn.operations_to_commit)} operations stored in the outbox"
+        )
+        if db is not None:
+            OutboxRepo(db).add(conn.operations_to_commit)
+        else:
+            with sqlite.db_context(db_path) as outbox_db:
+                OutboxRepo(outbox_db).add(conn.operations_to_commit)
+        conn.rollback()
+
 
 def sheet(fun: Callable) -> Callable:
     """
-    Decorator to use the default database
+    Decorator to use the default sheet, unless a `sheet` connection is passed explicitly
     """
 
     def wrapper(*args, **kwargs):
+        if "sheet" in kwargs:
+            return fun(*args, **kwargs)
         with sheet_context() as sheet:
             return fun(sheet=sheet, *args, **kwargs)
 
     return wrapper
 
 
+class OutboxRepo:
+    """
+    Sheet operations waiting to be sent, stored in the local database
+    """
+
+    def __init__(self, db: sqlite.Connection):
+        self.db = db
+
+    def _get_all(self) -> list[Operation]:
+        return [op for _, op in self.get_pending()]
+
+    def add(self, operations: Iterable[Operation]):
+        operations = coalesce(self._get_all() + list(operations))
+        self.db.execute("DELETE FROM sheet_outbox")
+        self.db.executemany(
+            "INSERT INTO sheet_outbox (type, range, values_json) VALUES (?, ?, ?)",
+            [(op.type, op.range, json.dumps(op.values, default=str)) for op in operations],
+        )
+
+    def get_pending(self, limit: int = -1) -> list[tuple[int, Operation]]:
+        cursor = self.db.execute(
+            "SELECT id, type, range, values_json FROM sheet_outbox ORDER BY id LIMIT ?", (limit,)
+        )
+        return [
+            (id, Operation(type=type, range=range, values=json.loads(values_json)))
+            for id, type, range, values_json in cursor
+        ]
+
+    def delete(self, ids: Iterable[int]):
+        self.db.executemany("DELETE FROM sheet_outbox WHERE id = ?", [(id,) for id in ids])
+
+    def count(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM sheet_outbox").fetchone()[0]
+
+
 class LedgerItemRepo:
     def __init__(self, sheet_connection: SheetConnection, header: list[str]):
         self.sheet_connection = sheet_connection
@@ -245,9 +390,13 @@ class LedgerItemRepo:
 
     def _create_month_sheet(self, month: str):
         body = {"requests": {"addSheet": {"properties": {"title": _range(month)}}}}
-        self.sheet_connection.sheet.batchUpdate(
-            spreadsheetId=self.sheet_connection.sheet_id, body=body
-        ).execute()
+        self.sheet_connection.execute(
+            "batchUpdate",
+            self.sheet_connection.sheet.batchUpdate(
+                spreadsheetId=self.sheet_connection.sheet_id, body=body
+            ),
+            body,
+        )
 
     def replace_month_data(self, month: str, ledger_items: Iterable[models.LedgerItem]):
         self._clear_month(month)
@@ -257,11 +406,18 @@ class LedgerItemRepo:
 
         self.sheet_connection.update(_range(month, f"2:{1+len(values)}"), values)
 
-    def update_month_data(self, month: str, ledger_items: Iterable[models.LedgerItem]):
+    def update_month_data(
+        self, month: str, ledger_items: Iterable[models.LedgerItem], deleted: Iterable[str] = ()
+    ):
         existing_data = {item.tx_id: item for item in self.get_month_data(month)}
 
+        updated = set()
         for item in ledger_items:
             existing_data[item.tx_id] = item
+            updated.add(item.tx_id)
+        # an item deleted from the month and then put back in it is kept
+        for tx_id in set(deleted) - updated:
+            existing_data.pop(tx_id, None)
 
         self.replace_month_data(month, existing_data.values())
 
@@ -1,25 +1,45 @@
+import datetime
 import enum
+import json
 import logging
 import sqlite3
 from contextlib import contextmanager
 from typing import Any, Callable, Generator, Iterable
 
 import config
-from src import migrations, models
+from src import metrics, migrations, models
 
 logger = logging.getLogger(__name__)
 
 
-Connection = sqlite3.Connection
+def _statement_kind(sql: str) -> str:
+    return (sql.split(None, 1) or [""])[0].upper()
+
+
+class Connection(sqlite3.Connection):
+    """
+    Connection counting the statements it executes, by kind (SELECT, INSERT...)
+    """
+
+    def execute(self, sql: str, *args, **kwargs) -> sqlite3.Cursor:
+        metrics.incr("sql_statements", kind=_statement_kind(sql))
+        return super().execute(sql, *args, **kwargs)
+
+    def executemany(self, sql: str, parameters, *args, **kwargs) -> sqlite3.Cursor:
+        metrics.incr("sql_statements", kind=_statement_kind(sql))
+        return super().executemany(sql, parameters, *args, **kwargs)
 
 
 @contextmanager
-def db_context(db_path: str | None = None) -> Generator[sqlite3.Connection, None, None]:
+def db_context(
+    db_path: str | None = None, check_same_thread: bool = True
+) -> Generator[sqlite3.Connection, None, None]:
     """
-    Get the default database
+    Get the default database, with `check_same_thread=False` the connection can be used by other
+    threads, one at a time
     """
     db_path = db_path or config.DB_PATH
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread, factory=Connection)
     migrations.migrate(conn)
     try:
         yield conn
@@ -33,10 +53,12 @@ def db_context(db_path: str | None = None) -> Generator[sqlite3.Connection, None
 
 def db(fun: Callable) -> Callable:
     """
-    Decorator to use the default database
+    Decorator to use the default database, unless a `db` connection is passed explicitly
     """
 
     def wrapper(*args, **kwargs):
+        if "db" in kwargs:
+            return fun(*args, **kwargs)
         with db_context() as db:
             kwargs["db"] = db
             return fun(*args, **kwargs)
@@ -54,10 +76,112 @@ def query(sql: str, db: sqlite3.Connection) -> Generator[dict[str, Any], None, N
         yield dict(zip(columns, row))
 
 
+def get_change_watermark(db: sqlite3.Connection) -> int:
+    """
+    Return the id of the last change recorded in the ledger_changes journal
+    """
+    return db.execute("SELECT COALESCE(MAX(id), 0) FROM ledger_changes").fetchone()[0]
+
+
+class PredictionCacheRepo:
+    """
+    Predictions of the classifiers, by classifier, version of its model and hash of its inputs
+    """
+
+    # SQLite limits the number of variables in a statement
+    chunk_size = 500
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def get(
+        self, classifier: str, version: str, input_hashes: list[str]
+    ) -> dict[str, tuple[dict[str, str], float, float]]:
+        result = {}
+        for start in range(0, len(input_hashes), self.chunk_size):
+            chunk = input_hashes[start : start + self.chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            cursor = self.db.execute(
+                f"""
+                SELECT input_hash, prediction_json, confidence, distance FROM prediction_cache
+                WHERE classifier = ? AND version = ? AND input_hash IN ({placeholders})
+                """,
+                (classifier, version, *chunk),
+            )
+            for input_hash, prediction_json, confidence, distance in cursor:
+                result[input_hash] = (json.loads(prediction_json), confidence, distance)
+        return result
+
+    def add(
+        self,
+        classifier: str,
+        version: str,
+        predictions: dict[str, tuple[dict[str, str], float, float]],
+    ):
+        self.db.executemany(
+            "INSERT OR REPLACE INTO prediction_cache VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (classifier, version, input_hash, json.dumps(prediction), confidence, distance)
+                for input_hash, (prediction, confidence, distance) in predictions.items()
+            ],
+        )
+
+    def evict(self, classifier: str, version: str) -> int:
+        """
+        Delete the predictions of the other versions of the classifier
+        """
+        cursor = self.db.execute(
+            "DELETE FROM prediction_cache WHERE classifier = ? AND version != ?",
+            (classifier, version),
+        )
+        return cursor.rowcount
+
+
+class SyncWatermarkRepo:
+    """
+    Where the incremental sync of each downloader stopped
+    """
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def get_all(self) -> dict[str, str]:
+        return dict(self.db.execute("SELECT source, updated_after FROM sync_watermarks"))
+
+    def set(self, source: str, updated_after: str):
+        self.db.execute(
+            "INSERT OR REPLACE INTO sync_watermarks VALUES (?, ?)", (source, updated_after)
+        )
+
+
+class ImportManifestRepo:
+    """
+    The files imported, and the members of the archives, with the importer that read them
+    """
+
+    def __init__(self, db: Connection):
+        self.db = db
+
+    def get_all(self) -> list[dict[str, Any]]:
+        return list(query("SELECT * FROM import_manifest ORDER BY path, member", self.db))
+
+    def add(self, path: str, member: str | None, importer: str, items: int):
+        self.db.execute(
+            "INSERT OR REPLACE INTO import_manifest VALUES (?, ?, ?, ?, ?)",
+            (path, member or "", importer, items, datetime.datetime.now().isoformat()),
+        )
+
+
 class DuplicateStrategy(enum.Enum):
     RAISE = "raise"
     REPLACE = "replace"
     SKIP = "skip"
+    # update the fields set by the source, keep the ones filled by the user or the classifiers
+    UPDATE = "update"
+
+
+# the fields of the items not set by the extractors
+USER_FIELDS = ["counterparty", "category", "labels", "event_name"]
 
 
 class LedgerItemRepo:
@@ -75,13 +199,30 @@ class LedgerItemRepo:
 
         duplicate_strategy_str = {
             DuplicateStrategy.RAISE: "OR FAIL",
-            DuplicateStrategy.REPLACE: "OR REPLACE",
+            DuplicateStrategy.REPLACE: "",
             DuplicateStrategy.SKIP: "OR IGNORE",
+            DuplicateStrategy.UPDATE: "",
         }[duplicate_strategy]
+        on_conflict = ""
+        if duplicate_strategy == DuplicateStrategy.REPLACE:
+            # an upsert, unlike INSERT OR REPLACE, journals only the rows really changed
+            on_conflict = f"""
+                ON CONFLICT (tx_id) DO UPDATE SET
+                {", ".join(f"{field} = excluded.{field}" for field in field_names if field != "tx_id")}
+            """
+        if duplicate_strategy == DuplicateStrategy.UPDATE:
+            source_fields = [f for f in field_names if f not in USER_FIELDS + ["tx_id", "to_sync"]]
+            on_conflict = f"""
+                ON CONFLICT (tx_id) DO UPDATE SET
+                {", ".join(f"{field} = excluded.{field}" for field in source_fields)}, to_sync = 1
+                WHERE {" OR ".join(f"{field} IS NOT excluded.{field}" for field in source_fields)}
+            """
 
         # if we are skipping duplicates, it means we are in import phase, we want to sync them
         ledger_items = list(ledger_items)
-        if duplicate_strategy == DuplicateStrategy.SKIP:
+        if duplicate_strategy == DuplicateStrategy.UPDATE:
+            self._record_moved(ledger_items)
+        if duplicate_strategy in (DuplicateStrategy.SKIP, DuplicateStrategy.UPDATE):
             for ledger_item in ledger_items:
                 ledger_item.to_sync = True
 
@@ -90,19 +231,36 @@ class LedgerItemRepo:
         result = self.db.executemany(
             f"""
             INSERT {duplicate_strategy_str} INTO ledger_items ({fields}) VALUES ({placeholders})
+            {on_conflict}
             """,
             [models.asdict(ledger_item) for ledger_item in ledger_items],
         )
         logger.debug(f"Inserted {result.rowcount} rows")
+        inserted = max(result.rowcount, 0)
+        metrics.incr("rows_inserted", inserted)
+        if duplicate_strategy == DuplicateStrategy.SKIP:
+            metrics.incr("rows_skipped_duplicate", len(ledger_items) - inserted)
+
+    def _record_moved(self, ledger_items: list[models.LedgerItem]):
+        """
+        Record the items moving to another month as deleted from their current month, so the next
+        push removes them from its sheet
+        """
+        self.db.executemany(
+            """
+            INSERT OR REPLACE INTO ledger_deletions
+            SELECT tx_id, strftime('%Y-%m', tx_date) FROM ledger_items
+            WHERE tx_id = ? AND strftime('%Y-%m', tx_date) != strftime('%Y-%m', ?)
+            """,
+            [(item.tx_id, str(item.tx_date)) for item in ledger_items],
+        )
 
     def get_months(self) -> Iterable[str]:
         query = "SELECT DISTINCT strftime('%Y-%m', tx_date) FROM ledger_items ORDER BY tx_date"
         for row in self.db.execute(query):
             yield row[0]
 
-    def get_month_data(
-        self, month: str, only_to_sync: bool = False
-    ) -> Iterable[models.LedgerItem]:
+    def get_month_data(self, month: str, only_to_sync: bool = False) -> Iterable[models.LedgerItem]:
         query = "SELECT * FROM ledger_items WHERE strftime('%Y-%m', tx_date) = :month"
         # create cursor for query
         cursor = self.db.execute(query, {"month": month})
@@ -129,14 +287,43 @@ class LedgerItemRepo:
             "UPDATE ledger_items SET to_sync = FALSE WHERE strftime('%Y-%m', tx_date) = :month",
             {"month": month},
         )
+        self.db.execute("DELETE FROM ledger_deletions WHERE month = :month", {"month": month})
+
+    def delete(self, tx_ids: Iterable[str]):
+        """
+        Delete the items, they are deleted from the sheet with the next push of changed data
+        """
+        params = [(tx_id,) for tx_id in tx_ids]
+        self.db.executemany(
+            """
+            INSERT OR REPLACE INTO ledger_deletions
+            SELECT tx_id, strftime('%Y-%m', tx_date) FROM ledger_items WHERE tx_id = ?
+            """,
+            params,
+        )
+        self.db.executemany("DELETE FROM ledger_items WHERE tx_id = ?", params)
+
+    def get_deleted_by_month(self) -> dict[str, list[str]]:
+        deleted = {}
+        for tx_id, month in self.db.execute("SELECT tx_id, month FROM ledger_deletions"):
+            deleted.setdefault(month, []).append(tx_id)
+        return deleted
 
     def replace_month_data(self, month: str, ledger_items: Iterable[models.LedgerItem]):
-        # delete all rows for the month
-        self.db.execute(
-            "DELETE FROM ledger_items WHERE strftime('%Y-%m', tx_date) = :month",
+        # the items deleted or moved away locally are still in the sheet until the next push
+        deleted = set(self.get_deleted_by_month().get(month, []))
+        ledger_items = [item for item in ledger_items if item.tx_id not in deleted]
+        # delete only the rows no longer in the month and overwrite the others, deleting and
+        # inserting them again would journal all of them as changed for the training
+        kept = {item.tx_id for item in ledger_items}
+        cursor = self.db.execute(
+            "SELECT tx_id FROM ledger_items WHERE strftime('%Y-%m', tx_date) = :month",
             {"month": month},
         )
-        # insert new rows
+        self.db.executemany(
+            "DELETE FROM ledger_items WHERE tx_id = ?",
+            [(tx_id,) for (tx_id,) in cursor.fetchall() if tx_id not in kept],
+        )
         self.insert(ledger_items, duplicate_strategy=DuplicateStrategy.REPLACE)
 
     def update(self, ledger_item: models.LedgerItem):
@@ -147,6 +334,7 @@ class LedgerItemRepo:
         # ensure to_sync is set to True
         ledger_item.to_sync = True
 
+        self._record_moved([ledger_item])
         self.db.execute(
             f"""
             UPDATE ledger_items SET {set_string} WHERE tx_id = :tx_id
@@ -0,0 +1,177 @@
+"""
+Counters and timers of a run, for the dashboards tracking the throughput of the cron jobs.
+
+    metrics.incr("rows_inserted", 10)
+    metrics.incr("importer_attempts", importer="FinecoImporter")
+    with metrics.timer("stage", stage="guess"):
+        ...
+
+    @metrics.timer("stage", stage="push")
+    def push(): ...
+
+run.py appends the summary of every command to `config.METRICS_PATH` as a JSON line and, when
+`METRICS_TEXTFILE_DIR` is set, writes it in the Prometheus text format, for the textfile collector
+of the node exporter.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Generator
+
+# prefix of the names in the Prometheus output
+NAMESPACE = "budget"
+
+Key = tuple[str, tuple[tuple[str, str], ...]]
+
+
+def _key(name: str, labels: dict[str, Any]) -> Key:
+    return name, tuple(sorted((label, str(value)) for label, value in labels.items()))
+
+
+def _format_key(key: Key) -> str:
+    name, labels = key
+    if not labels:
+        return name
+    return f"{name}{{{','.join(f'{label}={value}' for label, value in labels)}}}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _prometheus_line(name: str, labels: tuple[tuple[str, str], ...], value: float) -> str:
+    if labels:
+        label_string = ",".join(f'{label}="{_escape(value)}"' for label, value in labels)
+        name = f"{name}{{{label_string}}}"
+    return f"{name} {float(value)!r}\n"
+
+
+class Registry:
+    """
+    Counters and timers by name and labels, safe to update from the threads of a pipeline
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: dict[Key, float] = {}
+        # count, total and max seconds
+        self.timers: dict[Key, list[float]] = {}
+
+    def incr(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            timer = self.timers.setdefault(key, [0, 0.0, 0.0])
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextmanager
+    def timer(self, name: str, **labels) -> Generator[None, None, None]:
+        """
+        Time the code in the context, or the decorated function
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.timers.clear()
+
+    def summary(self) -> dict[str, dict]:
+        with self._lock:
+            return {
+                "counters": {
+                    _format_key(key): value for key, value in sorted(self.counters.items())
+                },
+                "timers": {
+                    _format_key(key): {"count": count, "total_seconds": total, "max_seconds": max_}
+                    for key, (count, total, max_) in sorted(self.timers.items())
+                },
+            }
+
+    def to_prometheus(self, **run_labels) -> str:
+        """
+        The counters and the timers in the Prometheus text format, with `run_labels` added to each
+        """
+        run = tuple(sorted((label, str(value)) for label, value in run_labels.items()))
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+            timers = sorted(self.timers.items())
+        for name in sorted({name for (name, _), _ in counters}):
+            lines.append(f"# TYPE {NAMESPACE}_{name}_total counter\n")
+            for (_, labels), value in (item for item in counters if item[0][0] == name):
+                lines.append(_prometheus_line(f"{NAMESPACE}_{name}_total", run + labels, value))
+        for name in sorted({name for (name, _), _ in timers}):
+            lines.append(f"# TYPE {NAMESPACE}_{name}_seconds summary\n")
+            for (_, labels), (count, total, _) in (item for item in timers if item[0][0] == name):
+                lines.append(
+                    _prometheus_line(f"{NAMESPACE}_{name}_seconds_sum", run + labels, total)
+                )
+                lines.append(
+                    _prometheus_line(f"{NAMESPACE}_{name}_seconds_count", run + labels, count)
+                )
+        return "".join(lines)
+
+
+REGISTRY = Registry()
+incr = REGISTRY.incr
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+summary = REGISTRY.summary
+reset = REGISTRY.reset
+
+
+@contextmanager
+def run(
+    command: str, path: Path, textfile_dir: Path | None = None
+) -> Generator[Registry, None, None]:
+    """
+    Collect the metrics of a command, then append its summary to the JSON lines file at `path` and,
+    if `textfile_dir` is given, write them to `<textfile_dir>/budget_<command>.prom`
+    """
+    REGISTRY.reset()
+    started = time.time()
+    success = False
+    try:
+        yield REGISTRY
+        success = True
+    finally:
+        duration = time.time() - started
+        record = {
+            "command": command,
+            "started": started,
+            "duration_seconds": duration,
+            "success": success,
+            **REGISTRY.summary(),
+        }
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+        if textfile_dir:
+            labels = (("command", command),)
+            text = (
+                REGISTRY.to_prometheus(command=command)
+                + _prometheus_line(f"{NAMESPACE}_run_duration_seconds", labels, duration)
+                + _prometheus_line(f"{NAMESPACE}_run_success", labels, int(success))
+                + _prometheus_line(f"{NAMESPACE}_run_timestamp_seconds", labels, started)
+            )
+            textfile = Path(textfile_dir) / f"{NAMESPACE}_{command}.prom"
+            textfile.parent.mkdir(parents=True, exist_ok=True)
+            # the collector must never read a half written file
+            tmp_path = textfile.with_suffix(f".prom.{os.getpid()}.tmp")
+            tmp_path.write_text(text)
+            os.replace(tmp_path, textfile)
@@ -18,6 +18,84 @@ migrations = {
     2: """alter table ledger_items add column event_name TEXT""",
     3: """alter table ledger_items add column to_sync INTEGER""",
     4: """alter table ledger_items add column amount_eur TEXT""",
+    5: """
+        CREATE TABLE sheet_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            type TEXT,
+            range TEXT,
+            values_json TEXT
+        )""",
+    # journal of the changes relevant for the classifiers, used for incremental training
+    6: """
+        CREATE TABLE ledger_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tx_id TEXT
+        )""",
+    7: """
+        CREATE TRIGGER ledger_items_insert_journal AFTER INSERT ON ledger_items
+        BEGIN
+            INSERT INTO ledger_changes (tx_id) VALUES (NEW.tx_id);
+        END""",
+    8: """
+        CREATE TRIGGER ledger_items_update_journal AFTER UPDATE ON ledger_items
+        WHEN OLD.description IS NOT NEW.description
+            OR OLD.counterparty IS NOT NEW.counterparty
+            OR OLD.category IS NOT NEW.category
+            OR OLD.labels IS NOT NEW.labels
+        BEGIN
+            INSERT INTO ledger_changes (tx_id) VALUES (NEW.tx_id);
+        END""",
+    9: """
+        CREATE TABLE prediction_cache (
+            classifier TEXT,
+            version TEXT,
+            input_hash TEXT,
+            prediction_json TEXT,
+            confidence REAL,
+            distance REAL,
+            PRIMARY KEY (classifier, version, input_hash)
+        )""",
+    # position of the incremental sync of each downloader, in the format of its API
+    10: """
+        CREATE TABLE sync_watermarks (
+            source TEXT PRIMARY KEY,
+            updated_after TEXT
+        )""",
+    # items deleted by their source, to delete from the sheet with the next push
+    11: """
+        CREATE TABLE ledger_deletions (
+            tx_id TEXT PRIMARY KEY,
+            month TEXT
+        )""",
+    # files imported, member is the name of the file in the archive, or empty
+    12: """
+        CREATE TABLE import_manifest (
+            path TEXT,
+            member TEXT,
+            importer TEXT,
+            items INTEGER,
+            imported_at TEXT,
+            PRIMARY KEY (path, member)
+        )""",
+    # an item back in the month it was deleted from, restored or moved back, is no longer deleted
+    13: """
+        CREATE TRIGGER ledger_items_insert_undelete AFTER INSERT ON ledger_items
+        BEGIN
+            DELETE FROM ledger_deletions
+            WHERE tx_id = NEW.tx_id AND month = strftime('%Y-%m', NEW.tx_date);
+        END""",
+    14: """
+        CREATE TRIGGER ledger_items_update_undelete AFTER UPDATE OF tx_date ON ledger_items
+        BEGIN
+            DELETE FROM ledger_deletions
+            WHERE tx_id = NEW.tx_id AND month = strftime('%Y-%m', NEW.tx_date);
+        END""",
+    # the deleted items are journaled too, to remove them from the classifiers
+    15: """
+        CREATE TRIGGER ledger_items_delete_journal AFTER DELETE ON ledger_items
+        BEGIN
+            INSERT INTO ledger_changes (tx_id) VALUES (OLD.tx_id);
+        END""",
 }
 
 
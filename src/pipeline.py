@@ -0,0 +1,89 @@
+"""
+Run stages in threads, each one as soon as the stages it depends on are done.
+
+    pipeline = Pipeline()
+    pipeline.add("pull", pull)
+    pipeline.add("train", train, after=["pull"])  # called as train(pull=<result of pull>)
+    results = pipeline.run()
+    print(pipeline.summary())
+"""
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from src import metrics
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Stage:
+    name: str
+    fun: Callable[..., Any]
+    after: list[str] = field(default_factory=list)
+    # seconds since the start of the pipeline
+    started: float | None = None
+    finished: float | None = None
+
+    @property
+    def duration(self) -> float:
+        return self.finished - self.started
+
+
+class Pipeline:
+    def __init__(self, max_workers: int = 4):
+        self.max_workers = max_workers
+        self.stages: dict[str, Stage] = {}
+        self.elapsed: float | None = None
+
+    def add(self, name: str, fun: Callable[..., Any], after: list[str] = ()):
+        """
+        Add a stage, `fun` is called with the results of the `after` stages as keyword arguments
+        """
+        if unknown := set(after) - set(self.stages):
+            raise ValueError(f"Stage {name} depends on unknown stages {unknown}")
+        self.stages[name] = Stage(name, fun, list(after))
+
+    def _run_stage(self, stage: Stage, start: float, results: dict[str, Any]) -> Any:
+        stage.started = time.perf_counter() - start
+        logger.info(f"{stage.name} started")
+        try:
+            return stage.fun(**{name: results[name] for name in stage.after})
+        finally:
+            stage.finished = time.perf_counter() - start
+            metrics.observe("pipeline_stage", stage.duration, stage=stage.name)
+            logger.info(f"{stage.name} done in {stage.duration:.1f}s")
+
+    def run(self) -> dict[str, Any]:
+        """
+        Run all the stages and return their results, the first error stops the pipeline
+        """
+        start = time.perf_counter()
+        results: dict[str, Any] = {}
+        running: dict[Future, str] = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                while len(results) < len(self.stages):
+                    for stage in self.stages.values():
+                        ready = all(name in results for name in stage.after)
+                        started = stage.name in results or stage.name in running.values()
+                        if ready and not started:
+                            future = pool.submit(self._run_stage, stage, start, results)
+                            running[future] = stage.name
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[running.pop(future)] = future.result()
+        finally:
+            self.elapsed = time.perf_counter() - start
+        return results
+
+    def summary(self) -> str:
+        lines = [f"{'stage':<16} {'start':>8} {'duration':>9}"]
+        for stage in sorted(self.stages.values(), key=lambda stage: stage.started or 0):
+            if stage.started is not None and stage.finished is not None:
+                lines.append(f"{stage.name:<16} {stage.started:>7.1f}s {stage.duration:>8.1f}s")
+        total = sum(s.duration for s in self.stages.values() if s.finished is not None)
+        lines.append(f"total {self.elapsed:.1f}s, {total:.1f}s if run in sequence")
+        return "\n".join(lines)
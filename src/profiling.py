@@ -0,0 +1,144 @@
+"""
+Profiling of a whole command, enabled with the global `--profile` option of run.py:
+
+    ./run.py --profile guess --month=2023-02             # cProfile stats, read them with pstats
+    ./run.py --profile=stacks push --month=2023-02       # collapsed stacks, for flamegraph.pl
+    ./run.py --profile=memory import_files               # tracemalloc peak and top allocations
+    ./run.py --profile=cprofile --profile_dir=/tmp/profiles train
+
+The output is written to `config.PROFILE_FOLDER` (or `--profile_dir`), named after the command and
+the time it started. Nothing of this is imported when the option is not given.
+"""
+import cProfile
+import datetime
+import logging
+import sys
+import threading
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Generator
+
+logger = logging.getLogger(__name__)
+
+MODES = ["cprofile", "stacks", "memory"]
+
+
+def pop_profile_options(argv: list[str]) -> tuple[str | None, str | None, list[str]]:
+    """
+    Remove `--profile[=mode]`, `--profile mode`, `--profile_dir=folder` and `--profile_dir folder`
+    from the arguments, return the mode, the folder and the remaining arguments
+    """
+    mode = folder = None
+    remaining = []
+    args = list(argv)
+    while args:
+        arg = args.pop(0)
+        option, _, value = arg.partition("=")
+        if option == "--profile":
+            # the mode can be the next argument, otherwise that's the command
+            if not value and args and args[0] in MODES:
+                value = args.pop(0)
+            mode = value or "cprofile"
+        elif option == "--profile_dir":
+            if not value and not args:
+                raise ValueError("--profile_dir needs a folder")
+            folder = value or args.pop(0)
+        else:
+            remaining.append(arg)
+    if mode is not None and mode not in MODES:
+        raise ValueError(f"Unknown profile mode {mode}, use one of {MODES}")
+    return mode, folder, remaining
+
+
+def _frame_stack(frame) -> list[str]:
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return stack[::-1]
+
+
+class StackSampler:
+    """
+    Sample the stacks of all the threads at a fixed wall-clock interval, so the time spent waiting
+    (network, disk, locks) is counted too
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def _run(self):
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self._thread.ident:
+                    continue
+                thread_name = names.get(thread_id, str(thread_id))
+                self.stacks[";".join([thread_name, *_frame_stack(frame)])] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def write(self, path: Path):
+        path.write_text("".join(f"{stack} {count}\n" for stack, count in self.stacks.items()))
+
+
+@contextmanager
+def profile(mode: str, folder: Path, name: str) -> Generator[Path, None, None]:
+    """
+    Profile the code run in the context, yield the path of the output without extension
+    """
+    folder.mkdir(parents=True, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    path = folder / f"{name}-{timestamp}"
+
+    if mode == "cprofile":
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield path
+        finally:
+            profiler.disable()
+            profiler.dump_stats(path.with_suffix(".pstats"))
+            logger.info(f"profile written to {path.with_suffix('.pstats')}")
+
+    elif mode == "stacks":
+        sampler = StackSampler()
+        sampler.start()
+        try:
+            yield path
+        finally:
+            sampler.stop()
+            sampler.write(path.with_suffix(".collapsed"))
+            logger.info(f"collapsed stacks written to {path.with_suffix('.collapsed')}")
+
+    elif mode == "memory":
+        tracemalloc.start(25)
+        try:
+            yield path
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            snapshot.dump(str(path.with_suffix(".tracemalloc")))
+            top = snapshot.statistics("lineno")[:30]
+            path.with_suffix(".txt").write_text(
+                f"peak {peak / 1024 / 1024:.1f} MiB\n"
+                + "".join(f"{statistic}\n" for statistic in top)
+            )
+            logger.info(f"memory peak {peak / 1024 / 1024:.1f} MiB, written to {path}.txt")
+
+    else:
+        raise ValueError(f"Unknown profile mode {mode}, use one of {MODES}")
@@ -0,0 +1,245 @@
+"""
+Deterministic rules applied by `guess` before the classifiers.
+
+The rules come from the labeled history, where a counterparty or a description always got the
+same values, and from the user defined rules in `config.RULES_PATH`:
+
+    {
+        "counterparty": {"Trenitalia": {"category": "Transport"}},
+        "description": {"NETFLIX.COM AMSTERDAM": {"counterparty": "Netflix"}},
+        "keywords": {"uber": {"category": "Transport"}}
+    }
+
+Every lookup is a dictionary access or a single pass of an Aho-Corasick automaton, so the cost is
+linear in the length of the text, whatever the number of rules. The keywords match whole words
+only: "bar" matches "Bar Vintage", not "Barber shop".
+"""
+import json
+import logging
+import re
+from collections import defaultdict, deque
+from pathlib import Path
+
+from src.ledger_repos import sqlite
+
+logger = logging.getLogger(__name__)
+
+RULE_FIELDS = ["counterparty", "category"]
+# a value is learned from the history only if it was seen at least this many times, always the same
+MIN_SUPPORT = 2
+
+_NOISE_RE = re.compile(r"[^a-z]+")
+
+
+def normalize_description(text: str) -> str:
+    """
+    Lowercase the text and drop digits and punctuation, which usually are dates, card numbers or
+    references that change at every transaction of the same merchant
+    """
+    return " ".join(_NOISE_RE.sub(" ", text.lower()).split())
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _is_boundary(text: str, position: int) -> bool:
+    """
+    True if the position, between two characters, is not inside a word
+    """
+    if position == 0 or position == len(text):
+        return True
+    return not (_is_word_char(text[position - 1]) and _is_word_char(text[position]))
+
+
+class AhoCorasick:
+    """
+    Match many keywords at once, in a single pass over the text
+    """
+
+    def __init__(self):
+        self.goto: list[dict[str, int]] = [{}]
+        self.fail: list[int] = [0]
+        # keywords ending in each state
+        self.output: list[list[str]] = [[]]
+        self.built = True
+
+    def add(self, keyword: str):
+        state = 0
+        for char in keyword:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(keyword)
+        self.built = False
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.output[next_state] = (
+                    self.output[next_state] + self.output[self.fail[next_state]]
+                )
+        self.built = True
+
+    def search(self, text: str, whole_words: bool = False) -> list[str]:
+        """
+        Return the keywords found in the text, in order of their end position, with `whole_words`
+        only the ones not starting or ending inside a word
+        """
+        if not self.built:
+            self.build()
+        found = []
+        state = 0
+        for end, char in enumerate(text, 1):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            for keyword in self.output[state]:
+                if whole_words and not (
+                    _is_boundary(text, end - len(keyword)) and _is_boundary(text, end)
+                ):
+                    continue
+                found.append(keyword)
+        return found
+
+
+class RuleEngine:
+    def __init__(self):
+        # learned from the history
+        self.counterparties: dict[str, dict[str, str]] = {}
+        self.descriptions: dict[str, dict[str, str]] = {}
+        # user defined, they have precedence over the learned ones
+        self.user_counterparties: dict[str, dict[str, str]] = {}
+        self.user_descriptions: dict[str, dict[str, str]] = {}
+        self.keywords: dict[str, dict[str, str]] = {}
+        self.matcher = AhoCorasick()
+
+    def learn(self, rows: list[dict[str, str]]):
+        """
+        Learn the values that are always the same for a counterparty or a normalized description
+        """
+        counterparties = defaultdict(lambda: defaultdict(set))
+        descriptions = defaultdict(lambda: defaultdict(set))
+        counts = defaultdict(int)
+        for row in rows:
+            if counterparty := row.get("counterparty"):
+                counts["counterparty", counterparty] += 1
+                counterparties[counterparty]["category"].add(row.get("category") or "")
+            if description := normalize_description(row.get("description") or ""):
+                counts["description", description] += 1
+                for field in RULE_FIELDS:
+                    descriptions[description][field].add(row.get(field) or "")
+
+        for kind, learned, target in [
+            ("counterparty", counterparties, self.counterparties),
+            ("description", descriptions, self.descriptions),
+        ]:
+            for key, values in learned.items():
+                if counts[kind, key] < MIN_SUPPORT:
+                    continue
+                fields = {
+                    field: value
+                    for field, (value, *others) in values.items()
+                    if not others and value
+                }
+                if fields:
+                    target[key] = fields
+
+    def add_rules(self, rules: dict[str, dict[str, dict[str, str]]]):
+        for counterparty, fields in rules.get("counterparty", {}).items():
+            self.user_counterparties[counterparty] = {
+                **self.user_counterparties.get(counterparty, {}),
+                **_valid_fields(fields, f"counterparty rule {counterparty!r}"),
+            }
+        for description, fields in rules.get("description", {}).items():
+            fields = _valid_fields(fields, f"description rule {description!r}")
+            description = normalize_description(description)
+            self.user_descriptions[description] = {
+                **self.user_descriptions.get(description, {}),
+                **fields,
+            }
+        for keyword, fields in rules.get("keywords", {}).items():
+            fields = _valid_fields(fields, f"keyword rule {keyword!r}")
+            keyword = keyword.lower()
+            self.keywords[keyword] = fields
+            self.matcher.add(keyword)
+
+    def apply(self, item: dict[str, str]) -> dict[str, str]:
+        """
+        Return the values for the empty fields of the item, the counterparty found by a rule is used
+        to look up the category
+        """
+        item = dict(item)
+        filled = {}
+
+        def fill(fields: dict[str, str] | None):
+            for field, value in (fields or {}).items():
+                if not item.get(field) and value:
+                    item[field] = filled[field] = value
+
+        description = item.get("description") or ""
+        normalized = normalize_description(description)
+        fill(self.user_descriptions.get(normalized))
+        fill(self.user_counterparties.get(item.get("counterparty")))
+        if self.keywords:
+            text = f"{description} {item.get('counterparty') or ''}".lower()
+            # the longest keyword is the most specific
+            matches = self.matcher.search(text, whole_words=True)
+            for keyword in sorted(matches, key=len, reverse=True):
+                fill(self.keywords[keyword])
+        # the learned rules fill only what the user defined ones left empty, the counterparty
+        # found by a learned rule can still have a user defined rule
+        learned = self.descriptions.get(normalized, {})
+        fill({"counterparty": learned.get("counterparty")})
+        fill(self.user_counterparties.get(item.get("counterparty")))
+        fill(learned)
+        fill(self.counterparties.get(item.get("counterparty")))
+        return filled
+
+
+def _valid_fields(fields: dict[str, str], rule: str) -> dict[str, str]:
+    """
+    Only the fields the user can set are filled by the rules, the others are dropped
+    """
+    if invalid := [field for field in fields if field not in sqlite.USER_FIELDS]:
+        logger.warning(f"Ignoring the fields {invalid} of the {rule}, use {sqlite.USER_FIELDS}")
+    return {field: value for field, value in fields.items() if field in sqlite.USER_FIELDS}
+
+
+def load_rules(path: Path) -> dict:
+    try:
+        return json.loads(path.read_text())
+    except FileNotFoundError:
+        return {}
+
+
+def get_rule_engine(db: sqlite.Connection, rules_path: Path | None = None) -> RuleEngine:
+    """
+    Build the rules from the labeled items in the database and the user defined rules
+    """
+    engine = RuleEngine()
+    if rules_path:
+        engine.add_rules(load_rules(rules_path))
+    engine.learn(
+        sqlite.query(
+            "SELECT description, counterparty, category FROM ledger_items "
+            "WHERE category IS NOT NULL AND category != ''",
+            db,
+        )
+    )
+    logger.debug(
+        f"{len(engine.user_counterparties) + len(engine.counterparties)} counterparty, "
+        f"{len(engine.user_descriptions) + len(engine.descriptions)} description and "
+        f"{len(engine.keywords)} keyword rules"
+    )
+    return engine
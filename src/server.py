@@ -0,0 +1,137 @@
+"""
+Resident process keeping the classifiers loaded, answering requests on a Unix domain socket.
+
+Requests and responses are JSON objects, one per line:
+
+    {"command": "predict", "items": [{"description": "...", "counterparty": "..."}]}
+    {"command": "guess", "months": ["2023-02"], "to_sync_only": false, "use_rules": true}
+    {"command": "ping"}
+
+The classifiers are reloaded when a new version of their artifact is saved, so `./run.py train`
+can run while the server is up.
+"""
+import json
+import logging
+import os
+import socketserver
+import time
+from pathlib import Path
+from typing import Any
+
+import config
+from src import application, artifacts, classifiers
+from src.client import ServerError, get_client
+from src.ledger_repos import sqlite
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStore:
+    """
+    Loaded classifiers, reloaded when the current version of their artifact changes
+    """
+
+    def __init__(self):
+        self.loaded: dict[str, classifiers.ClassifierInterface] = {}
+
+    def get(
+        self, classifier_names: list[str] | None = None
+    ) -> list[classifiers.ClassifierInterface]:
+        result = []
+        for classifier_class in classifiers.get_classifiers():
+            name = classifier_class.__name__
+            if classifier_names and name not in classifier_names:
+                continue
+            loaded = self.loaded.get(name)
+            version = artifacts.current_version(config.MODEL_FOLDER / name)
+            if loaded is None or (version and version != loaded.version):
+                if loaded := classifier_class().load():
+                    logger.info(f"loaded {name} version {loaded.version}")
+                    self.loaded[name] = loaded
+            if loaded:
+                result.append(loaded)
+        return result
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    server: "PredictionServer"
+
+    def handle(self):
+        for line in self.rfile:
+            start = time.perf_counter()
+            try:
+                request = json.loads(line)
+                response = self.server.dispatch(**request)
+            except Exception as err:
+                logger.exception("error handling a request")
+                response = {"error": f"{type(err).__name__}: {err}"}
+            self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+            logger.debug(f"request handled in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+
+class PredictionServer(socketserver.UnixStreamServer):
+    """
+    Serve the requests one at a time, with a single SQLite connection kept open
+    """
+
+    def __init__(self, path: Path, db: sqlite.Connection):
+        self.db = db
+        self.models = ModelStore()
+        super().__init__(str(path), RequestHandler)
+
+    def dispatch(self, command: str, **kwargs) -> dict[str, Any]:
+        if command == "ping":
+            return {"pid": os.getpid()}
+        if command == "predict":
+            return {"predictions": self.predict(**kwargs)}
+        if command == "guess":
+            self.guess(**kwargs)
+            return {}
+        raise ValueError(f"Unknown command {command}")
+
+    def predict(
+        self, items: list[dict[str, str]], classifier_names: list[str] | None = None
+    ) -> dict[str, list]:
+        return {
+            classifier.name: classifiers.predict(classifier, items)
+            for classifier in self.models.get(classifier_names)
+        }
+
+    def guess(
+        self,
+        months: list[str],
+        classifier_names: list[str] | None = None,
+        to_sync_only: bool = False,
+        use_rules: bool = True,
+    ):
+        try:
+            application.guess(
+                db=self.db,
+                classifier_names=classifier_names,
+                months=months,
+                to_sync_only=to_sync_only,
+                use_rules=use_rules,
+                loaded_classifiers=self.models.get(classifier_names),
+            )
+            self.db.commit()
+        except Exception:
+            self.db.rollback()
+            raise
+
+
+def serve(path: Path, db_path: str | Path | None = None):
+    """
+    Serve on the socket at `path` until interrupted
+    """
+    if client := get_client(path):
+        raise ServerError(f"A server is already running, pid {client.request('ping')['pid']}")
+    path.unlink(missing_ok=True)
+    with sqlite.db_context(db_path) as db, PredictionServer(path, db) as server:
+        server.models.get()
+        logger.info(f"serving on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
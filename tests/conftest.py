@@ -1,8 +1,18 @@
+from unittest.mock import patch
+
 import pytest
 
+import config
 from src.ledger_repos import sqlite
 
 
+@pytest.fixture(autouse=True)
+def model_folder(tmp_path):
+    # models, caches and training snapshots must never end up in the real models folder
+    with patch.object(config, "MODEL_FOLDER", tmp_path / "models"):
+        yield config.MODEL_FOLDER
+
+
 @pytest.fixture
 def db(tmp_path):
     db_path = f"{tmp_path}/test.db"
@@ -0,0 +1,89 @@
+import gzip
+import io
+import tarfile
+import zipfile
+from pathlib import Path
+
+import pytest
+
+from src import extractors, metrics
+from src.extractors import archives
+from tests.extractors.test_camt import camt_test_data
+from tests.extractors.test_ofx import ofx_sgml_data
+from tests.extractors.test_satispay import satispay_test_data
+
+
+def _write_tar(path: Path, members: dict[str, bytes]):
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in members.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_zip_members_are_read_by_the_importers(tmp_path: Path):
+    zip_path = tmp_path / "statements.zip"
+    with zipfile.ZipFile(zip_path, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr("2023-02/satispay.csv", satispay_test_data)
+        archive.writestr("2023-02/bank.ofx", ofx_sgml_data)
+
+    members = archives.iter_members(zip_path)
+    satispay = next(members)
+    assert str(satispay) == f"{zip_path}:2023-02/satispay.csv"
+    assert len(list(extractors.SatispayImporter(satispay).get_ledger_items())) == 3
+    ofx = next(members)
+    assert ofx.name == "2023-02/bank.ofx"
+    assert len(list(extractors.OfxImporter(ofx).get_ledger_items())) == 2
+
+
+def test_gzip_member(tmp_path: Path):
+    gz_path = tmp_path / "statement.xml.gz"
+    gz_path.write_bytes(gzip.compress(camt_test_data.encode("utf-8")))
+
+    (member,) = archives.iter_members(gz_path)
+    assert member.name == "statement.xml"
+    assert len(list(extractors.Camt053Importer(member).get_ledger_items())) == 2
+
+
+def test_tar_members_are_read_again_from_the_start(tmp_path: Path):
+    tar_path = tmp_path / "statements.tar.gz"
+    _write_tar(tar_path, {"satispay.csv": satispay_test_data.encode(), "big.txt": b"x" * 5000})
+    metrics.reset()
+
+    members = archives.iter_members(tar_path, replay_limit=1000)
+    satispay = next(members)
+    # the failing importers read the beginning, the next ones read it again from memory
+    for importer_class in [extractors.OfxImporter, extractors.Camt053Importer]:
+        try:
+            list(importer_class(satispay).get_ledger_items())
+        except extractors.FormatFileError:
+            pass
+    assert len(list(extractors.SatispayImporter(satispay).get_ledger_items())) == 3
+    big = next(members)
+    assert big.open("rb").read() == b"x" * 5000
+    # past the limit, the member is opened again from the archive
+    assert big.open("rb").read() == b"x" * 5000
+    assert metrics.summary()["counters"]["archive_members_reopened"] == 1
+
+
+def test_tar_reopened_for_a_member_is_closed_with_it(tmp_path: Path):
+    tar_path = tmp_path / "statements.tar.gz"
+    _write_tar(tar_path, {"big.txt": b"x" * 5000})
+
+    big = next(archives.iter_members(tar_path, replay_limit=1000))
+    big.open("rb").read()
+    with big.open("rb") as f:
+        assert f.read() == b"x" * 5000
+    assert f.tar.closed
+
+
+def test_excel_importer_reads_members(tmp_path: Path):
+    xlsx = Path(__file__).parent.parent / "fixtures" / "example.xlsx"
+    tar_path = tmp_path / "statements.tar.gz"
+    _write_tar(tar_path, {"example.xlsx": xlsx.read_bytes(), "satispay.csv": b"a,b\n"})
+
+    members = archives.iter_members(tar_path)
+    importer = extractors.RevolutImporter(next(members))
+    assert importer.get_file_content()[0] == ["text cell", "another text"]
+    with pytest.raises(extractors.FormatFileError):
+        extractors.RevolutImporter(next(members)).get_file_content()
@@ -1,7 +1,9 @@
+import asyncio
 from datetime import datetime
 from pathlib import Path
 
 from src import extractors
+from tests import factories
 
 
 class FakeExcelImporter(extractors.ExcelImporter):
@@ -11,6 +13,11 @@ class FakeExcelImporter(extractors.ExcelImporter):
         pass
 
 
+class FakeSyncDownloader(extractors.SyncDownloader):
+    def get_ledger_items(self, month=None):
+        yield factories.LedgerItemFactory(description=month)
+
+
 def test_excel_importer():
     file_path = Path(__file__).parent.parent / "fixtures" / "example.xlsx"
     excel_importer = FakeExcelImporter(file_path)
@@ -23,3 +30,8 @@ def test_excel_importer():
             "another text": datetime(2001, 2, 3, 4, 5, 6, 789000),
         },
     ]
+
+
+def test_sync_downloader_adapter():
+    items = asyncio.run(FakeSyncDownloader().fetch("2023-02"))
+    assert [item.description for item in items] == ["2023-02"]
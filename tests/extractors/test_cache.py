@@ -0,0 +1,94 @@
+import json
+from unittest.mock import MagicMock, patch
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+import splitwise
+
+import config
+from src import extractors
+from src.extractors.cache import CacheMissError, Policy, ResponseCache
+from tests.extractors.splitwise import factories
+
+
+def test_fresh_responses_are_read_from_the_cache(tmp_path):
+    cache = ResponseCache(tmp_path / "provider", ttl=60)
+    fetch = MagicMock(return_value={"expenses": [1, 2]})
+
+    assert cache.get("https://api/expenses?offset=0", fetch) == {"expenses": [1, 2]}
+    assert cache.get("https://api/expenses?offset=0", fetch) == {"expenses": [1, 2]}
+    assert fetch.call_count == 1
+    assert [entry["request"] for entry in cache.entries()] == ["https://api/expenses?offset=0"]
+
+
+def test_stale_responses_are_requested_again(tmp_path):
+    cache = ResponseCache(tmp_path / "provider", ttl=0)
+    cache.get("request", lambda: "old")
+
+    assert cache.get("request", lambda: "new") == "new"
+    assert cache.read("request")["response"] == "new"
+
+
+def test_stale_response_is_used_when_the_api_is_unreachable(tmp_path):
+    cache = ResponseCache(tmp_path / "provider", ttl=0)
+    cache.get("request", lambda: "old")
+
+    assert cache.get("request", MagicMock(side_effect=ConnectionError)) == "old"
+    with pytest.raises(ConnectionError):
+        cache.get("another request", MagicMock(side_effect=ConnectionError))
+
+
+def test_replay_never_calls_the_api(tmp_path):
+    ResponseCache(tmp_path / "provider").get("request", lambda: "cached")
+    cache = ResponseCache(tmp_path / "provider", policy=Policy.REPLAY)
+    fetch = MagicMock()
+
+    assert cache.get("request", fetch) == "cached"
+    with pytest.raises(CacheMissError):
+        cache.get("another request", fetch)
+    fetch.assert_not_called()
+
+
+def _splitwise_api(user: dict, expenses: list[dict]):
+    def make_request(self, url, method="GET", data=None, auth=None, files=None):
+        if url.startswith(splitwise.Splitwise.GET_CURRENT_USER_URL):
+            return json.dumps({"user": user})
+        query = parse_qs(urlparse(url).query)
+        dated_after, dated_before = query["dated_after"][0], query["dated_before"][0]
+        page = [e for e in expenses if dated_after <= e["date"] < dated_before]
+        return json.dumps({"expenses": page}, default=str)
+
+    return make_request
+
+
+def test_splitwise_replays_the_cached_responses(tmp_path):
+    user = factories.CurrentUserDict()
+    expenses = [
+        factories.ExpenseDict(
+            id=i,
+            date=f"2023-0{month}-18T10:41:51Z",
+            created_at="2023-03-01T10:00:00Z",
+            updated_at="2023-03-01T10:00:00Z",
+            created_by=None,
+            updated_by=None,
+            users=[factories.ExpenseUserDict(user__id=user["id"], net_balance="-1.5")],
+        )
+        for i, month in enumerate([1, 2, 2])
+    ]
+
+    with patch.object(config, "RESPONSE_CACHE_FOLDER", tmp_path), patch.object(
+        splitwise.Splitwise, "_Splitwise__makeRequest", _splitwise_api(user, expenses)
+    ):
+        downloaded = list(extractors.splitwise.SplitWiseDownloader().get_ledger_items("2023-02"))
+
+    with patch.object(config, "RESPONSE_CACHE_FOLDER", tmp_path), patch.object(
+        splitwise.Splitwise, "_Splitwise__makeRequest", side_effect=ConnectionError
+    ):
+        downloader = extractors.splitwise.SplitWiseDownloader(cache_policy=Policy.REPLAY)
+        replayed = list(downloader.get_ledger_items("2023-02"))
+        # only the expenses in the cached responses, January was never downloaded
+        assert list(downloader.get_ledger_items("2023-01")) == []
+        assert len(downloader.get_changes(None).items) == 2
+
+    assert len(downloaded) == 2
+    assert replayed == downloaded
@@ -0,0 +1,119 @@
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from src import extractors, models
+
+camt_entry = """
+      <Ntry>
+        <NtryRef>{n}</NtryRef>
+        <Amt Ccy="EUR">1.00</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <Sts><Cd>BOOK</Cd></Sts>
+        <BookgDt><Dt>2023-02-01</Dt></BookgDt>
+      </Ntry>"""
+
+camt_test_data = """<?xml version="1.0" encoding="UTF-8"?>
+<Document xmlns="urn:iso:std:iso:20022:tech:xsd:camt.053.001.02">
+  <BkToCstmrStmt>
+    <GrpHdr><MsgId>1</MsgId><CreDtTm>2023-03-01T08:00:00</CreDtTm></GrpHdr>
+    <Stmt>
+      <Id>1</Id>
+      <Acct>
+        <Id><IBAN>IT60X0542811101000000123456</IBAN></Id>
+        <Ccy>EUR</Ccy>
+        <Svcr><FinInstnId><BIC>BANKITMM</BIC><Nm>MyBank</Nm></FinInstnId></Svcr>
+      </Acct>
+      <Bal><Amt Ccy="EUR">100.00</Amt></Bal>
+      <Ntry>
+        <Amt Ccy="EUR">12.50</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <Sts>BOOK</Sts>
+        <BookgDt><Dt>2023-02-15</Dt></BookgDt>
+        <AcctSvcrRef>REF-1</AcctSvcrRef>
+        <NtryDtls><TxDtls>
+          <RltdPties><Cdtr><Nm>Bar Vintage</Nm></Cdtr></RltdPties>
+          <RmtInf><Ustrd>Coffee</Ustrd><Ustrd>and cake</Ustrd></RmtInf>
+        </TxDtls></NtryDtls>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">1500.00</Amt>
+        <CdtDbtInd>CRDT</CdtDbtInd>
+        <Sts>BOOK</Sts>
+        <BookgDt><DtTm>2023-02-27T10:15:00+01:00</DtTm></BookgDt>
+        <AcctSvcrRef>REF-2</AcctSvcrRef>
+        <AddtlNtryInf>Salary February</AddtlNtryInf>
+        <NtryDtls><TxDtls>
+          <RltdPties><Dbtr><Nm>ACME</Nm></Dbtr></RltdPties>
+        </TxDtls></NtryDtls>
+      </Ntry>
+      <Ntry>
+        <Amt Ccy="EUR">3.00</Amt>
+        <CdtDbtInd>DBIT</CdtDbtInd>
+        <Sts>PDNG</Sts>
+        <BookgDt><Dt>2023-02-28</Dt></BookgDt>
+        <AcctSvcrRef>REF-3</AcctSvcrRef>
+      </Ntry>
+    </Stmt>
+  </BkToCstmrStmt>
+</Document>
+"""
+
+
+def test_camt053_importer(tmp_path: Path):
+    camt_file = tmp_path / "statement.xml"
+    camt_file.write_text(camt_test_data)
+
+    ledger_items = list(extractors.Camt053Importer(camt_file).get_ledger_items())
+    account = "MyBank IT60X0542811101000000123456"
+    assert ledger_items == [
+        models.LedgerItem(
+            tx_id=models.calculate_unique_id(f"{account}:REF-1"),
+            tx_date=date(2023, 2, 15),
+            tx_datetime=datetime(2023, 2, 15),
+            amount=Decimal("-12.50"),
+            currency="EUR",
+            description="Coffee and cake",
+            account=account,
+            ledger_item_type=models.LedgerItemType.EXPENSE,
+            counterparty="Bar Vintage",
+        ),
+        models.LedgerItem(
+            tx_id=models.calculate_unique_id(f"{account}:REF-2"),
+            tx_date=date(2023, 2, 27),
+            tx_datetime=datetime(2023, 2, 27, 10, 15),
+            amount=Decimal("1500.00"),
+            currency="EUR",
+            description="Salary February",
+            account=account,
+            ledger_item_type=models.LedgerItemType.INCOME,
+            counterparty="ACME",
+        ),
+    ]
+
+
+def test_camt053_importer_drops_the_parsed_entries(tmp_path: Path):
+    camt_file = tmp_path / "statement.xml"
+    entries = "".join(camt_entry.format(n=n) for n in range(1000))
+    camt_file.write_text(
+        camt_test_data.replace("<Bal>", f"{entries}<Bal>").replace("001.02", "001.08")
+    )
+    importer = extractors.Camt053Importer(camt_file)
+    importer.chunk_size = 1024
+
+    seen = []
+    for element in importer.get_elements_from_file():
+        seen.append(element)
+    # each element is emptied once the next one is read
+    assert all(len(element) == 0 for element in seen)
+    assert len(list(importer.get_ledger_items())) == 1002
+
+
+def test_camt053_importer_wrong_format(tmp_path: Path):
+    camt_file = tmp_path / "statement.xml"
+    camt_file.write_text(camt_test_data.replace("camt.053", "camt.054"))
+
+    with pytest.raises(extractors.FormatFileError):
+        list(extractors.Camt053Importer(camt_file).get_ledger_items())
@@ -0,0 +1,137 @@
+from datetime import date, datetime
+from decimal import Decimal
+from pathlib import Path
+
+import pytest
+
+from src import extractors, models
+
+ofx_sgml_data = """OFXHEADER:100
+DATA:OFXSGML
+VERSION:102
+SECURITY:NONE
+ENCODING:USASCII
+CHARSET:1252
+COMPRESSION:NONE
+OLDFILEUID:NONE
+NEWFILEUID:NONE
+
+<OFX>
+<SIGNONMSGSRSV1><SONRS>
+<STATUS><CODE>0<SEVERITY>INFO</STATUS>
+<DTSERVER>20230301120000
+<LANGUAGE>ENG
+<FI><ORG>MyBank<FID>1234</FI>
+</SONRS></SIGNONMSGSRSV1>
+<BANKMSGSRSV1><STMTTRNRS><TRNUID>1
+<STMTRS>
+<CURDEF>EUR
+<BANKACCTFROM><BANKID>0001<ACCTID>123456<ACCTTYPE>CHECKING</BANKACCTFROM>
+<BANKTRANLIST>
+<DTSTART>20230201<DTEND>20230228
+<STMTTRN>
+<TRNTYPE>DEBIT
+<DTPOSTED>20230215120000.000[-5:EST]
+<TRNAMT>-12.50
+<FITID>2023021501
+<NAME>Bar & Cafe
+<MEMO>Card payment
+</STMTTRN>
+<STMTTRN>
+<TRNTYPE>XFER
+<DTPOSTED>20230220
+<TRNAMT>100.00
+<FITID>2023022001
+<NAME>Savings
+</STMTTRN>
+</BANKTRANLIST>
+<LEDGERBAL><BALAMT>87.50<DTASOF>20230228</LEDGERBAL>
+</STMTRS>
+</STMTTRNRS></BANKMSGSRSV1>
+</OFX>
+"""
+
+ofx_xml_data = """<?xml version="1.0" encoding="UTF-8" standalone="no"?>
+<?OFX OFXHEADER="200" VERSION="220" SECURITY="NONE" OLDFILEUID="NONE" NEWFILEUID="NONE"?>
+<OFX>
+  <CREDITCARDMSGSRSV1>
+    <CCSTMTTRNRS>
+      <TRNUID>1</TRNUID>
+      <CCSTMTRS>
+        <CURDEF>EUR</CURDEF>
+        <CCACCTFROM><ACCTID>4111</ACCTID></CCACCTFROM>
+        <BANKTRANLIST>
+          <STMTTRN>
+            <TRNTYPE>DEBIT</TRNTYPE>
+            <DTPOSTED>20230310</DTPOSTED>
+            <DTUSER>20230308093000</DTUSER>
+            <TRNAMT>-20.00</TRNAMT>
+            <FITID>A1</FITID>
+            <NAME>Bookshop</NAME>
+            <CURRENCY><CURRATE>1.1</CURRATE><CURSYM>USD</CURSYM></CURRENCY>
+          </STMTTRN>
+        </BANKTRANLIST>
+      </CCSTMTRS>
+    </CCSTMTTRNRS>
+  </CREDITCARDMSGSRSV1>
+</OFX>
+"""
+
+
+def test_ofx_importer_sgml(tmp_path: Path):
+    ofx_file = tmp_path / "statement.ofx"
+    ofx_file.write_text(ofx_sgml_data)
+
+    ledger_items = list(extractors.OfxImporter(ofx_file).get_ledger_items())
+    assert ledger_items == [
+        models.LedgerItem(
+            tx_id=models.calculate_unique_id("MyBank 123456:2023021501"),
+            tx_date=date(2023, 2, 15),
+            tx_datetime=datetime(2023, 2, 15, 12, 0, 0),
+            amount=Decimal("-12.50"),
+            currency="EUR",
+            description="Bar & Cafe Card payment",
+            account="MyBank 123456",
+            ledger_item_type=models.LedgerItemType.EXPENSE,
+            counterparty="Bar & Cafe",
+        ),
+        models.LedgerItem(
+            tx_id=models.calculate_unique_id("MyBank 123456:2023022001"),
+            tx_date=date(2023, 2, 20),
+            tx_datetime=datetime(2023, 2, 20),
+            amount=Decimal("100.00"),
+            currency="EUR",
+            description="Savings",
+            account="MyBank 123456",
+            ledger_item_type=models.LedgerItemType.TRANSFER,
+            counterparty="Savings",
+        ),
+    ]
+
+
+def test_ofx_importer_xml(tmp_path: Path):
+    ofx_file = tmp_path / "statement.ofx"
+    ofx_file.write_text(ofx_xml_data)
+
+    ledger_items = list(extractors.OfxImporter(ofx_file).get_ledger_items())
+    assert ledger_items == [
+        models.LedgerItem(
+            tx_id=models.calculate_unique_id("OFX 4111:A1"),
+            tx_date=date(2023, 3, 8),
+            tx_datetime=datetime(2023, 3, 8, 9, 30, 0),
+            amount=Decimal("-20.00"),
+            currency="USD",
+            description="Bookshop",
+            account="OFX 4111",
+            ledger_item_type=models.LedgerItemType.EXPENSE,
+            counterparty="Bookshop",
+        ),
+    ]
+
+
+def test_ofx_importer_wrong_format(tmp_path: Path):
+    csv_file = tmp_path / "statement.csv"
+    csv_file.write_text("id,name\n1,Bar\n")
+
+    with pytest.raises(extractors.FormatFileError):
+        list(extractors.OfxImporter(csv_file).get_ledger_items())
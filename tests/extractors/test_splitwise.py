@@ -86,5 +86,50 @@ def test_splitwise_online_retriever():
     list(service.get_ledger_items(month="2023-02"))
 
     client.getExpenses.assert_called_once_with(
-        limit=999, dated_after="2023-02-01", dated_before="2023-03-01"
+        offset=0, limit=200, dated_after="2023-02-01", dated_before="2023-03-01"
     )
+
+
+def _expense(user_id: int, **kwargs):
+    users = [factories.ExpenseUserDict(user__id=user_id, net_balance="-1.5")]
+    return factories.Expense(date="2023-02-18T10:41:51Z", users=users, **kwargs)
+
+
+def test_splitwise_downloads_all_the_pages():
+    client = MagicMock()
+    current_user = factories.CurrentUser()
+    client.getCurrentUser.return_value = current_user
+    expenses = [_expense(current_user.id, id=i) for i in range(5)]
+    expenses[1] = _expense(current_user.id, id=1, deleted_at="2023-02-19T10:00:00Z")
+    client.getExpenses.side_effect = [expenses[:2], expenses[2:4], expenses[4:]]
+
+    service = extractors.splitwise.SplitWiseDownloader(client)
+    service.page_size = 2
+    ledger_items = list(service.get_ledger_items(month="2023-02"))
+
+    assert len(ledger_items) == 4
+    assert [c.kwargs["offset"] for c in client.getExpenses.call_args_list] == [0, 2, 4]
+
+
+def test_splitwise_changes_since_the_watermark():
+    client = MagicMock()
+    current_user = factories.CurrentUser()
+    client.getCurrentUser.return_value = current_user
+    updated = _expense(current_user.id, id=1, updated_at="2023-02-20T10:00:00Z")
+    deleted = _expense(
+        current_user.id,
+        id=2,
+        updated_at="2023-02-19T10:00:00Z",
+        deleted_at="2023-02-21T10:00:00Z",
+    )
+    client.getExpenses.return_value = [updated, deleted]
+
+    service = extractors.splitwise.SplitWiseDownloader(client)
+    changes = service.get_changes("2023-02-01T00:00:00Z")
+
+    client.getExpenses.assert_called_once_with(
+        offset=0, limit=200, updated_after="2023-02-01T00:00:00Z"
+    )
+    assert [item.tx_id for item in changes.items] == [service._tx_id(updated)]
+    assert changes.deleted == [service._tx_id(deleted)]
+    assert changes.watermark == "2023-02-21T10:00:00Z"
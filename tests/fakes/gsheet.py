@@ -0,0 +1,291 @@
+"""
+In-process stand-in for the subset of the Google Sheets v4 API used by `SheetConnection`.
+
+    service = FakeSheetsService(latency=0.05)
+    conn = gsheet.SheetConnection("fake_sheet_id", service=service)
+
+Every executed request is counted in `service.stats`, together with the bytes of the JSON
+payloads sent and received, so it can be used both in tests and in benchmarks.
+"""
+import json
+import random
+import re
+import time
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Iterable
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+_A1_RE = re.compile(r"^[A-Z]*\d*(:[A-Z]*\d*)?$")
+_CELL_RE = re.compile(r"^([A-Z]*)(\d*)$")
+
+
+@dataclass
+class Stats:
+    calls: Counter = field(default_factory=Counter)
+    bytes_sent: int = 0
+    bytes_received: int = 0
+    errors: int = 0
+
+    @property
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+def _column_index(letters: str) -> int:
+    index = 0
+    for letter in letters:
+        index = index * 26 + ord(letter) - ord("A") + 1
+    return index - 1
+
+
+def _http_error(status: int, message: str) -> HttpError:
+    content = json.dumps({"error": {"code": status, "message": message}}).encode("utf-8")
+    return HttpError(httplib2.Response({"status": status}), content)
+
+
+def _to_cell(value: Any) -> str:
+    if value is None:
+        return ""
+    return str(value)
+
+
+def _trim(rows: list[list[str]]) -> list[list[str]]:
+    # the API omits trailing empty cells and rows
+    rows = [list(row) for row in rows]
+    for row in rows:
+        while row and row[-1] == "":
+            row.pop()
+    while rows and not rows[-1]:
+        rows.pop()
+    return rows
+
+
+class _Request:
+    def __init__(self, service: "FakeSheetsService", method: str, payload: Any, handler: Callable):
+        self.service = service
+        self.method = method
+        self.payload = payload
+        self.handler = handler
+
+    def execute(self):
+        return self.service._execute(self.method, self.payload, self.handler)
+
+
+class _Values:
+    def __init__(self, service: "FakeSheetsService"):
+        self.service = service
+
+    def get(self, spreadsheetId: str, range: str, **kwargs):
+        return _Request(
+            self.service, "values.get", {"range": range}, lambda: self.service._get(range)
+        )
+
+    def batchGet(self, spreadsheetId: str, ranges: list[str], **kwargs):
+        def handler():
+            return {
+                "spreadsheetId": spreadsheetId,
+                "valueRanges": [self.service._get(range) for range in ranges],
+            }
+
+        return _Request(self.service, "values.batchGet", {"ranges": ranges}, handler)
+
+    def batchUpdate(self, spreadsheetId: str, body: dict):
+        def handler():
+            responses = [
+                self.service._update(data["range"], data["values"]) for data in body["data"]
+            ]
+            return {
+                "spreadsheetId": spreadsheetId,
+                "totalUpdatedCells": sum(r["updatedCells"] for r in responses),
+                "responses": responses,
+            }
+
+        return _Request(self.service, "values.batchUpdate", body, handler)
+
+    def batchClear(self, spreadsheetId: str, body: dict):
+        def handler():
+            for range in body["ranges"]:
+                self.service._clear(range)
+            return {"spreadsheetId": spreadsheetId, "clearedRanges": body["ranges"]}
+
+        return _Request(self.service, "values.batchClear", body, handler)
+
+    def append(self, spreadsheetId: str, range: str, body: dict, **kwargs):
+        return _Request(
+            self.service,
+            "values.append",
+            {"range": range, **body},
+            lambda: self.service._append(range, body["values"]),
+        )
+
+
+class _Spreadsheets:
+    def __init__(self, service: "FakeSheetsService"):
+        self.service = service
+
+    def get(self, spreadsheetId: str, **kwargs):
+        def handler():
+            return {
+                "spreadsheetId": spreadsheetId,
+                "sheets": [
+                    {"properties": {"sheetId": index, "title": title, "index": index}}
+                    for index, title in enumerate(self.service.sheets)
+                ],
+            }
+
+        return _Request(self.service, "get", kwargs, handler)
+
+    def batchUpdate(self, spreadsheetId: str, body: dict):
+        def handler():
+            requests = body["requests"]
+            if isinstance(requests, dict):
+                requests = [requests]
+            replies = []
+            for request in requests:
+                if "addSheet" not in request:
+                    raise _http_error(400, f"Unsupported request: {list(request)}")
+                title = request["addSheet"]["properties"]["title"]
+                replies.append({"addSheet": self.service._add_sheet(title)})
+            return {"spreadsheetId": spreadsheetId, "replies": replies}
+
+        return _Request(self.service, "batchUpdate", body, handler)
+
+    def values(self):
+        return _Values(self.service)
+
+
+class FakeSheetsService:
+    """
+    Fake of the object returned by `googleapiclient.discovery.build("sheets", "v4")`
+
+    - `latency`: seconds slept on every executed request
+    - `error_rate`: probability for a request to fail with a 429 (quota exceeded) error
+    - `quota_per_minute`: number of requests allowed in any 60 seconds window, then 429 errors
+    - `unavailable`: methods, like "values.batchUpdate", always failing with a 503 error
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        quota_per_minute: int | None = None,
+        seed: int | None = None,
+        unavailable: Iterable[str] = (),
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.quota_per_minute = quota_per_minute
+        self.random = random.Random(seed)
+        self.unavailable = set(unavailable)
+        self.sheets: dict[str, list[list[str]]] = {"Sheet1": []}
+        self.stats = Stats()
+        self._request_times: deque[float] = deque()
+
+    def spreadsheets(self):
+        return _Spreadsheets(self)
+
+    def reset_stats(self):
+        self.stats = Stats()
+
+    def _execute(self, method: str, payload: Any, handler: Callable):
+        if self.latency:
+            time.sleep(self.latency)
+        self.stats.calls[method] += 1
+        self.stats.bytes_sent += len(json.dumps(payload, default=str))
+
+        now = time.monotonic()
+        while self._request_times and now - self._request_times[0] > 60:
+            self._request_times.popleft()
+        self._request_times.append(now)
+        over_quota = self.quota_per_minute is not None and (
+            len(self._request_times) > self.quota_per_minute
+        )
+        if method in self.unavailable:
+            self.stats.errors += 1
+            raise _http_error(503, "Service unavailable")
+        if over_quota or (self.error_rate and self.random.random() < self.error_rate):
+            self.stats.errors += 1
+            raise _http_error(429, "Quota exceeded")
+
+        result = handler()
+        self.stats.bytes_received += len(json.dumps(result))
+        return result
+
+    def _parse_range(self, a1_range: str) -> tuple[str, int, int | None, int, int | None]:
+        """
+        Return sheet title, first row, last row, first column and last column (0 based, inclusive)
+        """
+        if "!" in a1_range:
+            title, cells = a1_range.rsplit("!", 1)
+        elif a1_range.strip("'") in self.sheets or not _A1_RE.match(a1_range):
+            title, cells = a1_range, ""
+        else:
+            title, cells = next(iter(self.sheets)), a1_range
+        title = title.strip("'")
+        if title not in self.sheets:
+            raise _http_error(400, f"Unable to parse range: {a1_range}")
+        if not cells:
+            return title, 0, None, 0, None
+
+        start, _, end = cells.partition(":")
+        start_col, start_row = _CELL_RE.match(start).groups()
+        end_col, end_row = _CELL_RE.match(end or start).groups()
+        return (
+            title,
+            int(start_row) - 1 if start_row else 0,
+            int(end_row) - 1 if end_row else None,
+            _column_index(start_col) if start_col else 0,
+            _column_index(end_col) if end_col else None,
+        )
+
+    def _get(self, a1_range: str) -> dict:
+        title, first_row, last_row, first_col, last_col = self._parse_range(a1_range)
+        rows = self.sheets[title]
+        rows = rows[first_row : None if last_row is None else last_row + 1]
+        rows = _trim([row[first_col : None if last_col is None else last_col + 1] for row in rows])
+        result = {"range": a1_range, "majorDimension": "ROWS"}
+        if rows:
+            result["values"] = rows
+        return result
+
+    def _update(self, a1_range: str, values: list[list[Any]]) -> dict:
+        title, first_row, _, first_col, _ = self._parse_range(a1_range)
+        rows = self.sheets[title]
+        updated_cells = 0
+        for row_offset, row_values in enumerate(values):
+            row_index = first_row + row_offset
+            while len(rows) <= row_index:
+                rows.append([])
+            row = rows[row_index]
+            for col_offset, value in enumerate(row_values):
+                col_index = first_col + col_offset
+                while len(row) <= col_index:
+                    row.append("")
+                row[col_index] = _to_cell(value)
+                updated_cells += 1
+        return {"updatedRange": a1_range, "updatedRows": len(values), "updatedCells": updated_cells}
+
+    def _clear(self, a1_range: str):
+        title, first_row, last_row, first_col, last_col = self._parse_range(a1_range)
+        rows = self.sheets[title]
+        for row in rows[first_row : None if last_row is None else last_row + 1]:
+            for col_index in range(first_col, len(row) if last_col is None else last_col + 1):
+                if col_index < len(row):
+                    row[col_index] = ""
+        self.sheets[title] = _trim(rows)
+
+    def _append(self, a1_range: str, values: list[list[Any]]) -> dict:
+        title, *_ = self._parse_range(a1_range)
+        first_row = len(_trim(self.sheets[title]))
+        self._update(f"'{title}'!A{first_row + 1}", values)
+        return {"updates": {"updatedRows": len(values)}}
+
+    def _add_sheet(self, title: str) -> dict:
+        if title in self.sheets:
+            raise _http_error(400, f'A sheet with the name "{title}" already exists')
+        self.sheets[title] = []
+        index = list(self.sheets).index(title)
+        return {"properties": {"sheetId": index, "title": title, "index": index}}
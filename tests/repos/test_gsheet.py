@@ -1,6 +1,24 @@
-from unittest.mock import MagicMock, call, patch
+import datetime
+import socket
+from unittest.mock import MagicMock, PropertyMock, call, patch
 
-from src.ledger_repos.gsheet import SheetConnection
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from src import metrics, models
+from src.ledger_repos.gsheet import (
+    LedgerItemRepo,
+    Operation,
+    OutboxRepo,
+    SheetConnection,
+    coalesce,
+    is_offline_error,
+    sheet_context,
+)
+from src.ledger_repos.sqlite import db_context
+from tests import factories
+from tests.fakes.gsheet import FakeSheetsService
 
 
 @patch.object(SheetConnection, "sheet")
@@ -61,3 +79,183 @@ def test_commit_updates_and_clears(sheet_mock):
         ),
         call.batchUpdate().execute(),
     ]
+
+
+def _fake_connection(**kwargs) -> tuple[SheetConnection, FakeSheetsService]:
+    service = FakeSheetsService(**kwargs)
+    conn = SheetConnection("fake_sheet_id", service=service)
+    conn.min_flush_interval = datetime.timedelta(0)
+    return conn, service
+
+
+def test_replace_and_get_month_data_with_fake_service():
+    metrics.reset()
+    conn, service = _fake_connection()
+    repo = LedgerItemRepo(conn, models.LedgerItem.get_field_names())
+    ledger_items = [
+        factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 1)) for _ in range(3)
+    ]
+
+    repo.replace_month_data("2023-02", ledger_items)
+    conn.flush()
+
+    assert "ledger 2023-02" in service.sheets
+    result = list(repo.get_month_data("2023-02"))
+    assert [item.tx_id for item in result] == [item.tx_id for item in ledger_items]
+    assert [item.amount for item in result] == [item.amount for item in ledger_items]
+    assert service.stats.calls == {
+        "get": 1,
+        "batchUpdate": 1,
+        "values.batchUpdate": 2,
+        "values.batchClear": 1,
+        "values.get": 1,
+    }
+    counters = metrics.summary()["counters"]
+    assert {
+        key.removeprefix("sheets_calls{method=").removesuffix("}"): value
+        for key, value in counters.items()
+        if key.startswith("sheets_calls")
+    } == service.stats.calls
+    assert counters["sheets_bytes_sent"] > 0
+
+
+def test_update_month_data_removes_the_deleted_items():
+    conn, service = _fake_connection()
+    repo = LedgerItemRepo(conn, models.LedgerItem.get_field_names())
+    ledger_items = [
+        factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 1)) for _ in range(3)
+    ]
+    repo.replace_month_data("2023-02", ledger_items)
+    conn.flush()
+
+    # the sheet titles are cached by the connection
+    conn = SheetConnection("fake_sheet_id", service=service)
+    conn.min_flush_interval = datetime.timedelta(0)
+    repo = LedgerItemRepo(conn, models.LedgerItem.get_field_names())
+    repo.update_month_data("2023-02", ledger_items[2:], deleted=[ledger_items[0].tx_id])
+    conn.flush()
+
+    result = list(repo.get_month_data("2023-02"))
+    assert [item.tx_id for item in result] == [item.tx_id for item in ledger_items[1:]]
+
+
+def test_update_month_data_keeps_the_items_deleted_and_updated():
+    conn, service = _fake_connection()
+    repo = LedgerItemRepo(conn, models.LedgerItem.get_field_names())
+    ledger_items = [
+        factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 1)) for _ in range(2)
+    ]
+    repo.replace_month_data("2023-02", ledger_items)
+    conn.flush()
+
+    conn = SheetConnection("fake_sheet_id", service=service)
+    conn.min_flush_interval = datetime.timedelta(0)
+    repo = LedgerItemRepo(conn, models.LedgerItem.get_field_names())
+    repo.update_month_data("2023-02", ledger_items[:1], deleted=[ledger_items[0].tx_id])
+    conn.flush()
+
+    result = list(repo.get_month_data("2023-02"))
+    assert [item.tx_id for item in result] == [item.tx_id for item in ledger_items]
+
+
+def test_fake_service_raises_quota_errors():
+    conn, service = _fake_connection(quota_per_minute=1)
+
+    conn.get_sheet_titles()
+    with pytest.raises(HttpError) as error:
+        conn.sheet.values().get(spreadsheetId="fake_sheet_id", range="A1").execute()
+
+    assert error.value.resp.status == 429
+    assert service.stats.errors == 1
+
+
+def test_coalesce_keeps_last_update_of_the_same_range():
+    operations = [
+        Operation(type="update", range="A1", values=[["a"]]),
+        Operation(type="clear", range="A2"),
+        Operation(type="update", range="A2", values=[["b"]]),
+        Operation(type="update", range="A1", values=[["c"]]),
+        Operation(type="clear", range="A2"),
+    ]
+
+    assert coalesce(operations) == [
+        Operation(type="update", range="A1", values=[["c"]]),
+        Operation(type="clear", range="A2"),
+    ]
+
+
+@patch.object(SheetConnection, "min_flush_interval", datetime.timedelta(0))
+def test_operations_are_stored_in_outbox_when_sheet_is_unreachable(tmp_path):
+    db_path = tmp_path / "test.db"
+    service = FakeSheetsService(error_rate=1.0)
+
+    with patch.object(SheetConnection, "sheet", new_callable=PropertyMock) as sheet_mock:
+        sheet_mock.return_value = service.spreadsheets()
+        with sheet_context(db_path) as conn:
+            conn.update("A1", [["a", "b"]])
+            conn.update("A1", [["c", "d"]])
+            conn.clear("A2")
+
+    with db_context(db_path) as db:
+        assert [op for _, op in OutboxRepo(db).get_pending()] == [
+            Operation(type="update", range="A1", values=[["c", "d"]]),
+            Operation(type="clear", range="A2"),
+        ]
+
+
+@patch.object(SheetConnection, "min_flush_interval", datetime.timedelta(0))
+def test_drain_outbox_in_batches(db):
+    outbox = OutboxRepo(db)
+    outbox.add([Operation(type="update", range=f"A{i}", values=[[str(i)]]) for i in range(1, 6)])
+    conn, service = _fake_connection()
+
+    assert conn.drain(outbox, batch_size=2) == 5
+
+    assert outbox.count() == 0
+    assert service.stats.calls == {"values.batchUpdate": 3}
+    assert service.sheets["Sheet1"] == [["1"], ["2"], ["3"], ["4"], ["5"]]
+
+
+def test_drain_removes_the_operations_sent_before_an_error(db):
+    outbox = OutboxRepo(db)
+    outbox.add(
+        [
+            Operation(type="update", range="A1", values=[["1"]]),
+            Operation(type="clear", range="B1"),
+            Operation(type="update", range="C1", values=[["3"]]),
+        ]
+    )
+    conn, service = _fake_connection(unavailable=["values.batchClear"])
+
+    with pytest.raises(HttpError):
+        conn.drain(outbox)
+
+    assert [op for _, op in outbox.get_pending()] == [
+        Operation(type="clear", range="B1"),
+        Operation(type="update", range="C1", values=[["3"]]),
+    ]
+    assert service.stats.calls["values.batchUpdate"] == 1
+
+
+@pytest.mark.parametrize(
+    "err, expected",
+    [
+        (ConnectionResetError(), True),
+        (TimeoutError(), True),
+        (socket.gaierror(), True),
+        (httplib2.ServerNotFoundError(), True),
+        (FileNotFoundError(), False),
+        (PermissionError(), False),
+    ],
+)
+def test_is_offline_error(err, expected):
+    assert is_offline_error(err) is expected
+
+
+def test_update_month_data_queues_nothing_when_the_read_fails():
+    conn, service = _fake_connection(unavailable=["values.get"])
+    repo = LedgerItemRepo(conn, models.LedgerItem.get_field_names())
+
+    with pytest.raises(HttpError):
+        repo.update_month_data("2023-02", [factories.LedgerItemFactory()])
+    assert conn.operations_to_commit == []
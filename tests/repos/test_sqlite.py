@@ -1,4 +1,15 @@
-from src.ledger_repos.sqlite import DuplicateStrategy, LedgerItemRepo, query
+import dataclasses
+import datetime
+from decimal import Decimal
+
+from src import metrics
+from src.ledger_repos.sqlite import (
+    DuplicateStrategy,
+    LedgerItemRepo,
+    PredictionCacheRepo,
+    get_change_watermark,
+    query,
+)
 from tests import factories
 
 
@@ -79,3 +90,119 @@ def test_get_updated_data_by_month(db):
     month, [record] = result[0]
     assert month == item_to_update.tx_date.strftime("%Y-%m")
     assert record.tx_id == item_to_update.tx_id
+
+
+def test_changes_journal(db):
+    ledger_items = [factories.LedgerItemFactory() for _ in range(2)]
+    repo = LedgerItemRepo(db)
+    repo.insert(ledger_items)
+    watermark = get_change_watermark(db)
+
+    repo.update(ledger_items[0])
+    ledger_items[1].category = "new category"
+    repo.update(ledger_items[1])
+
+    changes = list(query(f"SELECT tx_id FROM ledger_changes WHERE id > {watermark}", db=db))
+    assert watermark == 2
+    assert changes == [{"tx_id": ledger_items[1].tx_id}]
+
+
+def test_replace_month_data_journals_only_the_changed_rows(db):
+    ledger_items = [
+        factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, day)) for day in (1, 2, 3)
+    ]
+    repo = LedgerItemRepo(db)
+    repo.insert(ledger_items)
+    watermark = get_change_watermark(db)
+
+    edited = dataclasses.replace(ledger_items[0], category="new category")
+    repo.replace_month_data("2023-02", [edited, ledger_items[1]])
+
+    # the row removed from the month is journaled too
+    changes = list(query(f"SELECT tx_id FROM ledger_changes WHERE id > {watermark}", db=db))
+    assert changes == [{"tx_id": ledger_items[2].tx_id}, {"tx_id": edited.tx_id}]
+    assert [item.tx_id for item in repo.get_month_data("2023-02")] == [
+        edited.tx_id,
+        ledger_items[1].tx_id,
+    ]
+
+
+def test_prediction_cache(db):
+    repo = PredictionCacheRepo(db)
+    repo.chunk_size = 2
+    repo.add("Classifier", "v1", {"a": ({"category": "Food"}, 0.9, 0.8), "b": ({}, 0.0, 0.0)})
+    repo.add("Classifier", "v2", {"a": ({"category": "Fun"}, 0.7, 0.6)})
+    repo.add("Other", "v1", {"a": ({"category": "Home"}, 0.5, 0.5)})
+
+    assert repo.get("Classifier", "v1", ["a", "b", "c"]) == {
+        "a": ({"category": "Food"}, 0.9, 0.8),
+        "b": ({}, 0.0, 0.0),
+    }
+    assert repo.evict("Classifier", "v2") == 2
+    assert repo.get("Classifier", "v1", ["a", "b"]) == {}
+    assert repo.get("Classifier", "v2", ["a"]) == {"a": ({"category": "Fun"}, 0.7, 0.6)}
+    assert repo.get("Other", "v1", ["a"]) == {"a": ({"category": "Home"}, 0.5, 0.5)}
+
+
+def test_insert_counts_the_skipped_duplicates(db):
+    ledger_items = [factories.LedgerItemFactory() for _ in range(3)]
+    repo = LedgerItemRepo(db)
+    repo.insert(ledger_items[:2], duplicate_strategy=DuplicateStrategy.SKIP)
+    metrics.reset()
+
+    repo.insert(ledger_items, duplicate_strategy=DuplicateStrategy.SKIP)
+
+    assert metrics.summary()["counters"] == {
+        "rows_inserted": 1,
+        "rows_skipped_duplicate": 2,
+        "sql_statements{kind=INSERT}": 1,
+    }
+
+
+def test_insert_updating_keeps_the_user_fields(db):
+    ledger_item = factories.LedgerItemFactory(category="Food", amount=Decimal("10.00"))
+    repo = LedgerItemRepo(db)
+    repo.insert([ledger_item])
+    repo.mark_month_as_synced(ledger_item.tx_date.strftime("%Y-%m"))
+
+    unchanged = dataclasses.replace(ledger_item, category=None)
+    repo.insert([unchanged], duplicate_strategy=DuplicateStrategy.UPDATE)
+    assert list(query("SELECT category, to_sync FROM ledger_items", db=db)) == [
+        {"category": "Food", "to_sync": 0}
+    ]
+
+    edited = dataclasses.replace(ledger_item, category=None, amount=Decimal("12.00"))
+    repo.insert([edited], duplicate_strategy=DuplicateStrategy.UPDATE)
+    assert list(query("SELECT amount, category, to_sync FROM ledger_items", db=db)) == [
+        {"amount": "12.00", "category": "Food", "to_sync": 1}
+    ]
+
+
+def test_deleted_items_are_kept_until_the_month_is_synced(db):
+    ledger_items = [
+        factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 1)) for _ in range(2)
+    ]
+    repo = LedgerItemRepo(db)
+    repo.insert(ledger_items)
+
+    repo.delete([ledger_items[0].tx_id, "unknown"])
+
+    assert [row["tx_id"] for row in query("SELECT tx_id FROM ledger_items", db=db)] == [
+        ledger_items[1].tx_id
+    ]
+    assert repo.get_deleted_by_month() == {"2023-02": [ledger_items[0].tx_id]}
+    repo.mark_month_as_synced("2023-02")
+    assert repo.get_deleted_by_month() == {}
+
+
+def test_items_moved_back_are_no_longer_deleted_from_their_month(db):
+    ledger_item = factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 1))
+    repo = LedgerItemRepo(db)
+    repo.insert([ledger_item])
+
+    moved = dataclasses.replace(ledger_item, tx_date=datetime.date(2023, 3, 1))
+    repo.insert([moved], duplicate_strategy=DuplicateStrategy.UPDATE)
+    assert repo.get_deleted_by_month() == {"2023-02": [ledger_item.tx_id]}
+
+    repo.insert([ledger_item], duplicate_strategy=DuplicateStrategy.UPDATE)
+    assert repo.get_deleted_by_month() == {"2023-03": [ledger_item.tx_id]}
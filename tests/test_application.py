@@ -1,7 +1,19 @@
+import asyncio
+import dataclasses
+import datetime
+from contextlib import contextmanager
 from pathlib import Path
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, PropertyMock, patch
 
-from src import application, extractors
+import pytest
+
+import config
+from src import application, classifiers, extractors, models
+from src.ledger_repos import gsheet, sqlite
+from tests import factories
+from tests.extractors.test_archives import _write_tar
+from tests.extractors.test_satispay import satispay_test_data
+from tests.fakes.gsheet import FakeSheetsService
 
 
 @patch.object(extractors, "get_importers")
@@ -39,3 +51,349 @@ def test_import_files_raises_extractor_not_found_error(get_importers: MagicMock,
 
     application.import_files(files=files)
     assert "Unable to import file" in caplog.text
+
+
+def test_import_files_reads_the_archives_and_records_the_manifest(tmp_path: Path, caplog):
+    tar_path = tmp_path / "statements.tar.gz"
+    _write_tar(tar_path, {"satispay.csv": satispay_test_data.encode(), "notes.txt": b"hello"})
+
+    with patch.object(config, "DB_PATH", tmp_path / "test.db"):
+        application.import_files(files=[tar_path])
+
+    assert f"Unable to import file {tar_path}:notes.txt" in caplog.text
+    with sqlite.db_context(tmp_path / "test.db") as db:
+        assert len(list(sqlite.LedgerItemRepo(db).get_month_data("2023-02"))) == 3
+        manifest = sqlite.ImportManifestRepo(db).get_all()
+    assert [(m["path"], m["member"], m["importer"], m["items"]) for m in manifest] == [
+        (str(tar_path), "satispay.csv", "SatispayImporter", 3)
+    ]
+
+
+def _fake_downloader(name: str, max_concurrency: int, delays: dict[str, float], running: list[int]):
+    async def fetch(month):
+        running.append(running[-1] + 1)
+        await asyncio.sleep(delays[month])
+        running.append(running[-1] - 1)
+        return [factories.LedgerItemFactory(description=f"{name} {month}")]
+
+    return MagicMock(max_concurrency=max_concurrency, return_value=MagicMock(fetch=fetch))
+
+
+def test_download_items_fetches_the_months_concurrently():
+    months = ["2023-01", "2023-02", "2023-03"]
+    delays = {"2023-01": 0.2, "2023-02": 0.1, "2023-03": 0.0}
+    running = [0]
+    limited_running = [0]
+    downloaders = [
+        _fake_downloader("fast", 3, delays, running),
+        _fake_downloader("limited", 1, delays, limited_running),
+    ]
+
+    with patch.object(extractors, "get_downloaders", return_value=downloaders):
+        batches = list(application.download_items(months=months))
+
+    descriptions = [batch.items[0].description for batch in batches]
+    assert len(descriptions) == 6
+    # each batch is yielded as soon as it's ready, not in order of month
+    assert [d for d in descriptions if d.startswith("fast")] == [
+        "fast 2023-03",
+        "fast 2023-02",
+        "fast 2023-01",
+    ]
+    assert max(running) == 3
+    assert max(limited_running) == 1
+
+
+def test_download_stores_the_incremental_changes(db):
+    kept, deleted = [factories.LedgerItemFactory(category="Food") for _ in range(2)]
+    sqlite.LedgerItemRepo(db).insert([kept, deleted])
+    edited = factories.LedgerItemFactory(tx_id=kept.tx_id, category=None, description="edited")
+    client = MagicMock(
+        incremental=True,
+        fetch_changes=AsyncMock(
+            return_value=extractors.Changes(
+                items=[edited], deleted=[deleted.tx_id], watermark="2023-03-01T00:00:00Z"
+            )
+        ),
+    )
+    downloader = MagicMock(max_concurrency=1, return_value=client)
+
+    with patch.object(extractors, "get_downloaders", return_value=[downloader]):
+        application.download(db=db, months=[])
+        application.download(db=db, months=[])
+
+    rows = list(sqlite.query("SELECT tx_id, description, category FROM ledger_items", db))
+    assert rows == [{"tx_id": kept.tx_id, "description": "edited", "category": "Food"}]
+    assert sqlite.SyncWatermarkRepo(db).get_all() == {"MagicMock": "2023-03-01T00:00:00Z"}
+    assert [c.args for c in client.fetch_changes.call_args_list] == [
+        (None,),
+        ("2023-03-01T00:00:00Z",),
+    ]
+
+
+def test_an_expense_moved_to_another_month_is_removed_from_the_old_sheet(db):
+    service = FakeSheetsService()
+
+    def new_sheet():
+        # the list of the sheets is cached by each connection
+        sheet = gsheet.SheetConnection("fake_sheet_id", service=service)
+        sheet.min_flush_interval = datetime.timedelta(0)
+        return sheet
+
+    sheet = new_sheet()
+    item = factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 10), currency="EUR")
+    application.store_changes(db=db, changes=extractors.Changes(items=[item], watermark="1"))
+    application.push_to_gsheet(db=db, sheet=sheet, months=[])
+    sheet.flush()
+
+    moved = dataclasses.replace(item, tx_date=datetime.date(2023, 3, 5), to_sync=False)
+    application.store_changes(db=db, changes=extractors.Changes(items=[moved], watermark="2"))
+    # a pull before the push must not bring the old version back
+    sheet = new_sheet()
+    application.pull_from_gsheet(db=db, sheet=sheet, months=["2023-02"])
+    application.push_to_gsheet(db=db, sheet=sheet, months=[])
+    sheet.flush()
+
+    remote_repo = gsheet.LedgerItemRepo(sheet, models.LedgerItem.get_field_names())
+    assert list(remote_repo.get_month_data("2023-02")) == []
+    assert [i.tx_date for i in remote_repo.get_month_data("2023-03")] == [moved.tx_date]
+    rows = list(sqlite.query("SELECT tx_id, tx_date FROM ledger_items", db))
+    assert rows == [{"tx_id": item.tx_id, "tx_date": "2023-03-05"}]
+    assert sqlite.LedgerItemRepo(db).get_deleted_by_month() == {}
+
+
+def test_an_expense_deleted_and_restored_stays_in_the_sheet(db):
+    service = FakeSheetsService()
+
+    def new_sheet():
+        sheet = gsheet.SheetConnection("fake_sheet_id", service=service)
+        sheet.min_flush_interval = datetime.timedelta(0)
+        return sheet
+
+    sheet = new_sheet()
+    item = factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 10), currency="EUR")
+    application.store_changes(db=db, changes=extractors.Changes(items=[item], watermark="1"))
+    application.push_to_gsheet(db=db, sheet=sheet, months=[])
+    sheet.flush()
+
+    deleted = extractors.Changes(items=[], deleted=[item.tx_id], watermark="2")
+    application.store_changes(db=db, changes=deleted)
+    restored = dataclasses.replace(item, to_sync=False)
+    application.store_changes(db=db, changes=extractors.Changes(items=[restored], watermark="3"))
+    assert sqlite.LedgerItemRepo(db).get_deleted_by_month() == {}
+
+    sheet = new_sheet()
+    application.pull_from_gsheet(db=db, sheet=sheet, months=["2023-02"])
+    application.push_to_gsheet(db=db, sheet=sheet, months=[])
+    sheet.flush()
+
+    remote_repo = gsheet.LedgerItemRepo(sheet, models.LedgerItem.get_field_names())
+    assert [i.tx_id for i in remote_repo.get_month_data("2023-02")] == [item.tx_id]
+    rows = list(sqlite.query("SELECT tx_id FROM ledger_items", db))
+    assert rows == [{"tx_id": item.tx_id}]
+
+
+@patch.object(classifiers, "get_classifiers")
+def test_guess_fills_one_field_per_round(get_classifiers: MagicMock, db):
+    items = [
+        factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, i + 1), counterparty=None)
+        for i in range(2)
+    ]
+    sqlite.LedgerItemRepo(db).insert(items)
+
+    def predict_many(item_dicts):
+        return [
+            ({"counterparty": "Bar"}, 0.9, 0.9)
+            if not item_dict["counterparty"]
+            else ({"category": "Food"}, 0.8, 0.8)
+            for item_dict in item_dicts
+        ]
+
+    classifier = MagicMock(
+        label_fields=["counterparty", "category"], input_fields=["counterparty"], version=None
+    )
+    classifier.predict_many.side_effect = predict_many
+    get_classifiers.return_value = [MagicMock(return_value=MagicMock(load=lambda: classifier))]
+
+    application.guess(db=db, classifier_names=None, months=["2023-02"], use_rules=False)
+
+    # filling the category doesn't change the inputs, so there isn't a third prediction
+    assert [len(c.args[0]) for c in classifier.predict_many.call_args_list] == [2, 2]
+    result = list(sqlite.query("SELECT counterparty, category, to_sync FROM ledger_items", db))
+    assert result == [{"counterparty": "Bar", "category": "Food", "to_sync": 1}] * 2
+
+
+@patch.object(classifiers, "get_classifiers")
+def test_guess_runs_rules_before_the_classifiers(get_classifiers: MagicMock, db, tmp_path):
+    rules_path = tmp_path / "rules.json"
+    rules_path.write_text('{"keywords": {"uber": {"category": "Transport"}}}')
+    sqlite.LedgerItemRepo(db).insert(
+        factories.LedgerItemFactory(
+            tx_date=datetime.date(2023, 2, day), description=description, counterparty=None
+        )
+        for day, description in [(1, "UBER *TRIP 1234"), (2, "Unknown shop")]
+    )
+    db.execute("UPDATE ledger_items SET category = ''")
+    classifier = MagicMock(label_fields=["category"], input_fields=["description"], version=None)
+    classifier.predict_many.return_value = [({"category": "Shopping"}, 0.9, 0.9)]
+    get_classifiers.return_value = [MagicMock(return_value=MagicMock(load=lambda: classifier))]
+
+    with patch.object(config, "RULES_PATH", rules_path):
+        application.guess(db=db, classifier_names=None, months=["2023-02"])
+
+    assert [
+        item_dict["description"] for item_dict in classifier.predict_many.call_args.args[0]
+    ] == ["Unknown shop"]
+    result = list(sqlite.query("SELECT description, category FROM ledger_items", db))
+    assert result == [
+        {"description": "UBER *TRIP 1234", "category": "Transport"},
+        {"description": "Unknown shop", "category": "Shopping"},
+    ]
+
+
+def _fake_classifier(input_fields, label_fields, predict):
+    classifier = MagicMock(input_fields=input_fields, label_fields=label_fields, version=None)
+    classifier.predict_many.side_effect = lambda item_dicts: [predict(i) for i in item_dicts]
+    return classifier
+
+
+def test_fill_in_rounds_predicts_again_only_when_inputs_change(db):
+    counterparty = _fake_classifier(
+        ["description"], ["counterparty"], lambda item: ({"counterparty": "Bar"}, 0.9, 0.9)
+    )
+    category = _fake_classifier(
+        ["description"], ["category"], lambda item: ({"category": "Fun"}, 0.6, 0.6)
+    )
+    category_from_counterparty = _fake_classifier(
+        ["counterparty"],
+        ["category"],
+        lambda item: ({"category": "Food"}, 0.8 if item["counterparty"] else 0.0, 0.8),
+    )
+    item_dicts = [{"description": "bar", "counterparty": "", "category": ""}]
+
+    application._fill_in_rounds(
+        sqlite.PredictionCacheRepo(db),
+        [counterparty, category, category_from_counterparty],
+        item_dicts,
+    )
+
+    assert item_dicts == [{"description": "bar", "counterparty": "Bar", "category": "Food"}]
+    assert counterparty.predict_many.call_count == 1
+    assert category.predict_many.call_count == 1
+    assert category_from_counterparty.predict_many.call_count == 2
+
+
+def test_predict_cached_reuses_predictions_of_the_same_version(db):
+    classifier = classifiers.CounterpartyFromDescriptionClassifier()
+    classifier.table = {"bar": ("Food", 0.75, 0.5)}
+    classifier.version = "v1"
+    cache_repo = sqlite.PredictionCacheRepo(db)
+    items = [{"counterparty": "Bar", "description": str(i)} for i in range(3)]
+    expected = [({"category": "Food"}, 0.75, 0.5)] * 3
+
+    with patch.object(classifier, "predict_many", wraps=classifier.predict_many) as predict_many:
+        assert application._predict_cached(cache_repo, classifier, items) == expected
+        assert application._predict_cached(cache_repo, classifier, items) == expected
+        classifier.version = "v2"
+        assert application._predict_cached(cache_repo, classifier, items) == expected
+
+    # the description is not an input of the classifier, the three items are the same
+    assert [len(c.args[0]) for c in predict_many.call_args_list] == [1, 1]
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_train_saves_all_classifiers(tmp_path, parallel):
+    db_path = tmp_path / "test.db"
+    rows = [
+        ("coffee", "Bar Centrale", "Food", "coffee"),
+        ("lunch", "Trattoria", "Food", "work"),
+        ("train ticket", "Trenitalia", "Transport", "travel"),
+        ("bus ticket", "ATM", "Transport", "commute"),
+    ]
+    with sqlite.db_context(db_path) as db:
+        sqlite.LedgerItemRepo(db).insert(
+            factories.LedgerItemFactory(
+                description=description, counterparty=counterparty, category=category, labels=labels
+            )
+            for description, counterparty, category, labels in rows
+        )
+
+    with patch.object(config, "DB_PATH", db_path), patch.object(
+        config, "MODEL_FOLDER", tmp_path / "models"
+    ), patch.object(classifiers, "_normalizer", classifiers.TextNormalizer(backend="simple")):
+        application.train(parallel=parallel)
+
+        for classifier_class in classifiers.get_classifiers():
+            classifier = classifier_class().load()
+            assert classifier.version is not None
+            assert classifier.watermark == len(rows)
+
+
+def test_review_runs_all_the_stages_with_shared_connections(tmp_path):
+    service = FakeSheetsService()
+    setup_sheet = gsheet.SheetConnection("fake_sheet_id", service=service)
+    setup_sheet.min_flush_interval = datetime.timedelta(0)
+    remote_repo = gsheet.LedgerItemRepo(setup_sheet, models.LedgerItem.get_field_names())
+    remote_repo.replace_month_data(
+        "2023-02", [factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 1), currency="EUR")]
+    )
+    setup_sheet.flush()
+    sheet = gsheet.SheetConnection("fake_sheet_id", service=service)
+    sheet.min_flush_interval = datetime.timedelta(0)
+    downloaded = factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 2), currency="EUR")
+    downloader = MagicMock(
+        max_concurrency=1, return_value=MagicMock(fetch=AsyncMock(return_value=[downloaded]))
+    )
+
+    @contextmanager
+    def sheet_context(**kwargs):
+        yield sheet
+
+    with patch.object(config, "DB_PATH", tmp_path / "test.db"), patch.object(
+        gsheet, "sheet_context", sheet_context
+    ), patch.object(extractors, "get_downloaders", return_value=[downloader]), patch.object(
+        application, "train"
+    ) as train:
+        review = application.review(months=["2023-02"], files=[])
+
+    train.assert_called_once()
+    stages = review.stages
+    assert stages["train"].started >= stages["store_pulled"].finished
+    assert stages["push"].started >= stages["guess"].finished
+    assert len(list(remote_repo.get_month_data("2023-02"))) == 2
+    with sqlite.db_context(tmp_path / "test.db") as db:
+        assert len(list(sqlite.LedgerItemRepo(db).get_month_data("2023-02"))) == 2
+
+
+def test_review_stores_the_outbox_in_its_connection_when_the_sheet_is_offline(tmp_path):
+    service = FakeSheetsService()
+    setup_sheet = gsheet.SheetConnection("fake_sheet_id", service=service)
+    setup_sheet.min_flush_interval = datetime.timedelta(0)
+    gsheet.LedgerItemRepo(setup_sheet, models.LedgerItem.get_field_names()).replace_month_data(
+        "2023-02", [factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 1), currency="EUR")]
+    )
+    setup_sheet.flush()
+    # the sheet can be read, but the writes fail
+    service.unavailable = {"values.batchUpdate", "values.batchClear", "values.append"}
+    downloaded = factories.LedgerItemFactory(tx_date=datetime.date(2023, 2, 2), currency="EUR")
+    downloader = MagicMock(
+        max_concurrency=1, return_value=MagicMock(fetch=AsyncMock(return_value=[downloaded]))
+    )
+
+    with patch.object(config, "DB_PATH", tmp_path / "test.db"), patch.object(
+        config, "GSHEET_SHEET_ID", "fake_sheet_id"
+    ), patch.object(
+        gsheet.SheetConnection, "sheet", new_callable=PropertyMock
+    ) as sheet_mock, patch.object(
+        gsheet.SheetConnection, "min_flush_interval", datetime.timedelta(0)
+    ), patch.object(
+        extractors, "get_downloaders", return_value=[downloader]
+    ), patch.object(
+        application, "train"
+    ):
+        sheet_mock.return_value = service.spreadsheets()
+        application.review(months=["2023-02"], files=[])
+
+    with sqlite.db_context(tmp_path / "test.db") as db:
+        assert gsheet.OutboxRepo(db).count() > 0
+        assert len(list(sqlite.LedgerItemRepo(db).get_month_data("2023-02"))) == 2
@@ -0,0 +1,38 @@
+from src import artifacts
+
+
+def _write_text(text):
+    def write_files(folder):
+        (folder / "data.txt").write_text(text)
+        return {"length": len(text)}
+
+    return write_files
+
+
+def test_write_and_read_artifact(tmp_path):
+    version = artifacts.write(tmp_path, {"name": "test"}, _write_text("hello"))
+
+    folder, header = artifacts.read_header(tmp_path)
+    assert folder == tmp_path / version
+    assert header == {"format": artifacts.FORMAT, "name": "test", "length": 5}
+    assert (folder / "data.txt").read_text() == "hello"
+
+
+def test_same_content_gives_same_version(tmp_path):
+    assert artifacts.write(tmp_path, {}, _write_text("a")) == artifacts.write(
+        tmp_path, {}, _write_text("a")
+    )
+
+
+def test_previous_version_is_kept(tmp_path):
+    first = artifacts.write(tmp_path, {}, _write_text("a"))
+    second = artifacts.write(tmp_path, {}, _write_text("b"))
+    third = artifacts.write(tmp_path, {}, _write_text("c"))
+
+    assert artifacts.current_version(tmp_path) == third
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted([second, third, "current"])
+    assert first not in {second, third}
+
+
+def test_missing_artifact(tmp_path):
+    assert artifacts.read_header(tmp_path / "missing") is None
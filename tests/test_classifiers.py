@@ -0,0 +1,340 @@
+import pickle
+from collections import defaultdict
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+import config
+from src import classifiers
+from src.ledger_repos.sqlite import LedgerItemRepo, db_context
+from tests import factories
+
+
+def _normalizer(**kwargs) -> classifiers.TextNormalizer:
+    normalizer = classifiers.TextNormalizer(**kwargs)
+    normalizer._lemmatizer = MagicMock()
+    normalizer._lemmatizer.lemmatize.side_effect = lambda word: {"bars": "bar"}.get(word, word)
+    return normalizer
+
+
+def test_normalize_text():
+    normalizer = _normalizer()
+
+    assert normalizer.normalize("Pagamento P.O.S. 12/02 Bars") == "pagamento pos bar"
+
+
+def test_normalize_caches_texts_and_lemmas():
+    normalizer = _normalizer()
+
+    normalizer.normalize("coffee bars")
+    normalizer.normalize("coffee bars")
+    normalizer.normalize("bars")
+
+    assert normalizer.hits == 1
+    assert normalizer.misses == 2
+    assert normalizer.hit_rate == 1 / 3
+    assert normalizer._lemmatizer.lemmatize.call_count == 2
+
+
+def test_normalize_cache_is_bounded():
+    normalizer = _normalizer(max_size=2)
+
+    for text in ["a", "b", "a", "c"]:
+        normalizer.normalize(text)
+
+    assert list(normalizer.texts) == ["a", "c"]
+
+
+def test_normalizer_is_persisted(tmp_path):
+    normalizer = _normalizer()
+    normalizer.normalize("coffee bars")
+    normalizer.save(tmp_path / "normalizer.cache")
+
+    loaded = classifiers.TextNormalizer.load(tmp_path / "normalizer.cache")
+
+    assert loaded.normalize("coffee bars") == "coffee bar"
+    assert loaded.hits == 1
+    assert loaded._lemmatizer is None
+
+
+def test_simple_lemmatize():
+    assert [
+        classifiers.simple_lemmatize(word)
+        for word in ["bars", "groceries", "boxes", "glasses", "bus", "pos", "coffee"]
+    ] == ["bar", "grocery", "box", "glass", "bus", "pos", "coffee"]
+
+
+@patch.object(classifiers, "has_nltk_resources", return_value=False)
+@patch.object(classifiers, "_normalizer", None)
+def test_normalizer_falls_back_without_wordnet(has_nltk_resources, tmp_path):
+    classifiers.TextNormalizer(backend="wordnet").save(tmp_path / "normalizer.cache")
+
+    with patch.object(config, "MODEL_FOLDER", tmp_path):
+        normalizer = classifiers.get_normalizer()
+
+    assert normalizer.backend == "simple"
+    assert normalizer.normalize("Coffee Bars") == "coffee bar"
+
+
+def _insert(db_path, *descriptions_and_categories):
+    with db_context(db_path) as db:
+        LedgerItemRepo(db).insert(
+            [
+                factories.LedgerItemFactory(
+                    description=description, counterparty=description, category=category
+                )
+                for description, category in descriptions_and_categories
+            ]
+        )
+
+
+@pytest.fixture
+def simple_normalizer():
+    with patch.object(classifiers, "_normalizer", classifiers.TextNormalizer(backend="simple")):
+        yield
+
+
+def test_online_classifier_is_updated_with_changed_rows(tmp_path, simple_normalizer):
+    db_path = tmp_path / "test.db"
+    _insert(db_path, ("coffee at the bar", "Food"), ("train ticket", "Transport"))
+    classifier = classifiers.CategoryFromDescriptionCounterpartyClassifier(online=True)
+    classifier.train(db_path)
+    assert classifier.watermark == 2
+
+    _insert(db_path, ("bus ticket", "Transport"))
+    with patch.object(classifier, "train") as train, patch.object(
+        classifier.model, "partial_fit"
+    ) as partial_fit:
+        classifier.update(db_path)
+
+    train.assert_not_called()
+    assert list(partial_fit.call_args.args[1]) == ["Transport"]
+    assert classifier.watermark == 3
+
+
+def test_online_classifier_is_not_fed_the_pulled_rows_again(tmp_path, simple_normalizer):
+    db_path = tmp_path / "test.db"
+    _insert(db_path, ("coffee at the bar", "Food"), ("train ticket", "Transport"))
+    classifier = classifiers.CategoryFromDescriptionCounterpartyClassifier(online=True)
+    classifier.train(db_path)
+
+    # a pull overwrites the months with the same rows
+    with db_context(db_path) as db:
+        repo = LedgerItemRepo(db)
+        for month in list(repo.get_months()):
+            repo.replace_month_data(month, list(repo.get_month_data(month)))
+    with patch.object(classifier, "train") as train, patch.object(
+        classifier.model, "partial_fit"
+    ) as partial_fit:
+        classifier.update(db_path)
+
+    train.assert_not_called()
+    partial_fit.assert_not_called()
+    assert classifier.watermark == 2
+
+
+def test_online_classifier_is_retrained_on_new_labels(tmp_path, simple_normalizer):
+    db_path = tmp_path / "test.db"
+    _insert(db_path, ("coffee at the bar", "Food"), ("train ticket", "Transport"))
+    classifier = classifiers.CategoryFromDescriptionCounterpartyClassifier(online=True)
+    classifier.train(db_path)
+
+    _insert(db_path, ("cinema", "Entertainment"))
+    classifier.update(db_path)
+
+    assert set(classifier.model.classes_) == {"Food", "Transport", "Entertainment"}
+
+
+def test_training_snapshot_is_shared_and_invalidated_on_changes(tmp_path, simple_normalizer):
+    db_path = tmp_path / "test.db"
+    _insert(db_path, ("Coffee Bars", "Food"), ("Train Tickets", "Transport"))
+    fields = [["description"], ["description", "counterparty"]]
+
+    data = classifiers.load_training_data(db_path, text_fields=fields)
+    assert list(data.get_corpus(["description"])) == ["coffee bar", "train ticket"]
+
+    with patch.object(classifiers.TextNormalizer, "normalize") as normalize:
+        cached = classifiers.load_training_data(db_path, text_fields=fields)
+    normalize.assert_not_called()
+    assert cached.key == data.key
+    assert list(cached.get_corpus(["description"])) == ["coffee bar", "train ticket"]
+
+    _insert(db_path, ("bus ticket", "Transport"))
+    changed = classifiers.load_training_data(db_path, text_fields=fields)
+    assert changed.key != data.key
+    assert list(changed.get_corpus(["description"])) == ["coffee bar", "train ticket", "bus ticket"]
+
+
+def test_hashing_vectorizer_is_stateless_and_fixed_width():
+    vectorizer = classifiers.make_vectorizer("hashing")
+
+    matrix = vectorizer.transform(["coffee bar", "a merchant never seen before"])
+
+    assert matrix.shape == (2, 2**12 + 2**14)
+    assert pickle.loads(pickle.dumps(vectorizer)).transform(["coffee bar"]).nnz == matrix[0].nnz
+
+
+@pytest.mark.parametrize("online", [False, True])
+@pytest.mark.parametrize("categories", [["Food", "Transport"], ["Food", "Transport", "Fun"]])
+def test_loaded_classifier_predicts_like_the_trained_one(
+    tmp_path, simple_normalizer, online, categories
+):
+    db_path = tmp_path / "test.db"
+    texts = ["coffee at the bar", "train ticket", "cinema"]
+    _insert(db_path, *zip(texts, categories))
+    classifier = classifiers.CategoryFromDescriptionCounterpartyClassifier(online=online)
+    classifier.train(db_path)
+    items = [{"description": text, "counterparty": ""} for text in ["coffee", "bus ticket", ""]]
+
+    with patch.object(config, "MODEL_FOLDER", tmp_path / "models"):
+        classifier.save()
+        loaded = classifiers.CategoryFromDescriptionCounterpartyClassifier().load()
+
+    assert loaded.model is None
+    assert loaded.version == classifier.version
+    assert loaded.online == online
+    expected = classifier.predict_many(items)
+    for (prediction, confidence, distance), (e_prediction, e_confidence, e_distance) in zip(
+        loaded.predict_many(items), expected
+    ):
+        assert prediction == e_prediction
+        assert confidence == pytest.approx(e_confidence)
+        assert distance == pytest.approx(e_distance)
+
+
+def test_nearest_transaction_classifier_votes_similar_transactions(tmp_path):
+    db_path = tmp_path / "test.db"
+    _insert(
+        db_path,
+        ("NETFLIX.COM 01/23 AMSTERDAM", "Subscriptions"),
+        ("NETFLIX.COM 02/23 AMSTERDAM", "Subscriptions"),
+        ("Pagamento POS Bar Centrale Milano", "Eating out"),
+    )
+    classifier = classifiers.NearestTransactionClassifier()
+    classifier.train(db_path)
+
+    assert len(classifier.texts) == 2
+    prediction, confidence, distance = classifier.predict_with_meta(
+        {"description": "NETFLIX.COM 03/24 AMSTERDAM NL", "counterparty": ""}
+    )
+    assert prediction == {"category": "Subscriptions"}
+    assert 0.5 < confidence <= 1
+    assert distance == confidence
+    assert classifier.predict_with_meta({"description": "Ryanair", "counterparty": None}) == (
+        {"category": ""},
+        0.0,
+        0.0,
+    )
+
+
+def test_nearest_transaction_classifier_is_updated_incrementally(tmp_path):
+    db_path = tmp_path / "test.db"
+    _insert(db_path, ("Trenitalia Milano", "Transport"))
+    classifier = classifiers.NearestTransactionClassifier()
+    classifier.train(db_path)
+
+    _insert(db_path, ("Ryanair DUB", "Holidays"))
+    with db_context(db_path) as db:
+        db.execute(
+            "UPDATE ledger_items SET category = 'Travel' WHERE description = 'Trenitalia Milano'"
+        )
+    with patch.object(classifier, "train") as train:
+        classifier.update(db_path)
+
+    train.assert_not_called()
+    assert classifier.watermark == 3
+    item = {"description": "Trenitalia Milano", "counterparty": "Trenitalia Milano"}
+    assert classifier.predict_with_meta(item) == ({"category": "Travel"}, 1.0, 1.0)
+    assert classifier.predict_with_meta({"description": "Ryanair DUB", "counterparty": ""})[0] == {
+        "category": "Holidays"
+    }
+
+
+def test_counterparty_classifier_is_a_frozen_table_updated_incrementally(tmp_path):
+    db_path = tmp_path / "test.db"
+    _insert(db_path, ("Bar Centrale", "Food"), ("Bar Centrale", "Food"), ("bar  centrale", "Fun"))
+    classifier = classifiers.CounterpartyFromDescriptionClassifier(online=True)
+    classifier.train(db_path)
+    classifier.save()
+
+    assert classifier.table == {"bar centrale": ("Food", 2 / 3, 1 / 3)}
+    loaded = classifiers.CounterpartyFromDescriptionClassifier().load()
+    assert loaded.counts is None
+    assert loaded.predict_with_meta({"counterparty": "BAR CENTRALE"}) == (
+        {"category": "Food"},
+        2 / 3,
+        1 / 3,
+    )
+
+    _insert(db_path, ("Bar Centrale ", "Fun"), ("Trenitalia", "Transport"))
+    with patch.object(loaded, "train") as train:
+        loaded.update(db_path)
+
+    train.assert_not_called()
+    assert loaded.table == {
+        "bar centrale": ("Food", 0.5, 0.0),
+        "trenitalia": ("Transport", 1.0, 0.0),
+    }
+
+
+def _submap():
+    return defaultdict(int)
+
+
+def test_online_classifiers_forget_the_deleted_rows(tmp_path, simple_normalizer):
+    db_path = tmp_path / "test.db"
+    _insert(db_path, ("Trenitalia", "Transport"), ("Trenitalia", "Travel"), ("Bar", "Food"))
+    counterparty = classifiers.CounterpartyFromDescriptionClassifier(online=True)
+    nearest = classifiers.NearestTransactionClassifier()
+    simple = classifiers.CategoryFromDescriptionCounterpartyClassifier(online=True)
+    for classifier in (counterparty, nearest, simple):
+        classifier.train(db_path)
+
+    with db_context(db_path) as db:
+        LedgerItemRepo(db).delete(
+            [
+                tx_id
+                for (tx_id,) in db.execute(
+                    "SELECT tx_id FROM ledger_items WHERE category = 'Travel'"
+                )
+            ]
+        )
+    for classifier in (counterparty, nearest):
+        with patch.object(classifier, "train") as train:
+            classifier.update(db_path)
+        train.assert_not_called()
+    # the model fitted with the deleted row is trained again
+    with patch.object(simple, "train") as train:
+        simple.update(db_path)
+    train.assert_called_once_with(db_path)
+
+    item = {"description": "Trenitalia", "counterparty": "Trenitalia"}
+    assert counterparty.predict_with_meta(item) == ({"category": "Transport"}, 1.0, 0.0)
+    assert nearest.predict_with_meta(item) == ({"category": "Transport"}, 1.0, 1.0)
+
+
+def test_counterparty_classifier_saved_in_the_old_format_is_retrained(model_folder, monkeypatch):
+    # the classifier pickled before the artifacts, a map of counts built with a module function
+    monkeypatch.setattr(_submap, "__module__", classifiers.__name__)
+    monkeypatch.setattr(classifiers, "_submap", _submap, raising=False)
+    old = object.__new__(classifiers.CounterpartyFromDescriptionClassifier)
+    old.map = defaultdict(classifiers._submap)
+    old.map["bar centrale"]["Food"] += 1
+    model_folder.mkdir()
+    path = model_folder / "CounterpartyFromDescriptionClassifier.classifier"
+    path.write_bytes(pickle.dumps(old))
+
+    # without a table it can't be used, even when it can be unpickled
+    assert classifiers.CounterpartyFromDescriptionClassifier().load() is None
+
+    monkeypatch.undo()
+    assert classifiers.CounterpartyFromDescriptionClassifier().load() is None
+
+
+def test_input_hash_depends_on_the_normalizer_backend():
+    classifier = classifiers.CategoryFromDescriptionCounterpartyClassifier()
+    item = {"description": "train tickets", "counterparty": "Trenitalia"}
+    with patch.object(classifiers, "_normalizer", classifiers.TextNormalizer(backend="simple")):
+        simple_hash = classifier.input_hash(item)
+    with patch.object(classifiers, "_normalizer", classifiers.TextNormalizer(backend="wordnet")):
+        assert classifier.input_hash(item) != simple_hash
@@ -0,0 +1,77 @@
+import json
+
+import pytest
+
+from src import metrics
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_counters_and_timers_by_labels(registry):
+    registry.incr("rows_parsed", 10, source="FinecoImporter")
+    registry.incr("rows_parsed", 5, source="FinecoImporter")
+    registry.incr("rows_parsed", 1, source="PaypalImporter")
+    registry.incr("files_scanned")
+    registry.observe("stage", 1.5, stage="push")
+    registry.observe("stage", 0.5, stage="push")
+
+    @registry.timer("stage", stage="guess")
+    def guess():
+        pass
+
+    guess()
+    guess()
+
+    summary = registry.summary()
+    assert summary["counters"] == {
+        "files_scanned": 1,
+        "rows_parsed{source=FinecoImporter}": 15,
+        "rows_parsed{source=PaypalImporter}": 1,
+    }
+    assert summary["timers"]["stage{stage=push}"] == {
+        "count": 2,
+        "total_seconds": 2.0,
+        "max_seconds": 1.5,
+    }
+    assert summary["timers"]["stage{stage=guess}"]["count"] == 2
+
+
+def test_prometheus_format(registry):
+    registry.incr("sheets_calls", 2, method="values.get")
+    registry.observe("stage", 1.5, stage="push")
+
+    assert registry.to_prometheus(command="push").splitlines() == [
+        "# TYPE budget_sheets_calls_total counter",
+        'budget_sheets_calls_total{command="push",method="values.get"} 2.0',
+        "# TYPE budget_stage_seconds summary",
+        'budget_stage_seconds_sum{command="push",stage="push"} 1.5',
+        'budget_stage_seconds_count{command="push",stage="push"} 1.0',
+    ]
+
+
+def test_run_writes_the_summary(tmp_path):
+    path = tmp_path / "metrics.jsonl"
+    for _ in range(2):
+        with metrics.run("import_files", path, tmp_path / "textfile"):
+            metrics.incr("files_scanned", 3)
+
+    with pytest.raises(ValueError):
+        with metrics.run("push", path):
+            raise ValueError()
+
+    records = [json.loads(line) for line in path.read_text().splitlines()]
+    assert [(r["command"], r["success"]) for r in records] == [
+        ("import_files", True),
+        ("import_files", True),
+        ("push", False),
+    ]
+    # the counters start from zero at every run
+    assert records[1]["counters"] == {"files_scanned": 3}
+    assert records[2]["counters"] == {}
+    assert [p.name for p in (tmp_path / "textfile").iterdir()] == ["budget_import_files.prom"]
+    prometheus = (tmp_path / "textfile" / "budget_import_files.prom").read_text()
+    assert 'budget_files_scanned_total{command="import_files"} 3.0' in prometheus
+    assert 'budget_run_success{command="import_files"} 1.0' in prometheus
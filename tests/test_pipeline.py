@@ -0,0 +1,48 @@
+import threading
+
+import pytest
+
+from src.pipeline import Pipeline
+
+
+def test_pipeline_passes_results_and_overlaps_independent_stages():
+    both_running = threading.Barrier(2, timeout=5)
+
+    def stage(value):
+        def fun():
+            # fails with a timeout if the two stages don't run at the same time
+            both_running.wait()
+            return value
+
+        return fun
+
+    pipeline = Pipeline()
+    pipeline.add("a", stage(1))
+    pipeline.add("b", stage(2))
+    pipeline.add("sum", lambda a, b: a + b, after=["a", "b"])
+
+    assert pipeline.run() == {"a": 1, "b": 2, "sum": 3}
+    assert pipeline.stages["sum"].started >= max(
+        pipeline.stages["a"].finished, pipeline.stages["b"].finished
+    )
+    summary = pipeline.summary()
+    assert summary.splitlines()[-2].startswith("sum")
+    assert "if run in sequence" in summary
+
+
+def test_pipeline_stops_at_the_first_error():
+    def fail():
+        raise ValueError("broken")
+
+    pipeline = Pipeline()
+    pipeline.add("fail", fail)
+    pipeline.add("next", lambda fail: None, after=["fail"])
+
+    with pytest.raises(ValueError, match="broken"):
+        pipeline.run()
+    assert pipeline.stages["next"].started is None
+
+
+def test_pipeline_rejects_unknown_dependencies():
+    with pytest.raises(ValueError):
+        Pipeline().add("a", lambda b: None, after=["b"])
@@ -0,0 +1,59 @@
+import pstats
+import time
+
+import pytest
+
+from src import profiling
+
+
+def test_pop_profile_options():
+    assert profiling.pop_profile_options(["--profile", "guess", "--month=2023-02"]) == (
+        "cprofile",
+        None,
+        ["guess", "--month=2023-02"],
+    )
+    assert profiling.pop_profile_options(
+        ["--profile=memory", "--profile_dir", "/tmp/profiles", "push"]
+    ) == ("memory", "/tmp/profiles", ["push"])
+    assert profiling.pop_profile_options(["push"]) == (None, None, ["push"])
+    assert profiling.pop_profile_options(["--profile", "stacks", "push", "--month=2023-02"]) == (
+        "stacks",
+        None,
+        ["push", "--month=2023-02"],
+    )
+    assert profiling.pop_profile_options(["push", "--profile", "memory"]) == (
+        "memory",
+        None,
+        ["push"],
+    )
+    with pytest.raises(ValueError):
+        profiling.pop_profile_options(["--profile=unknown", "push"])
+    with pytest.raises(ValueError):
+        profiling.pop_profile_options(["push", "--profile_dir"])
+
+
+def _work():
+    time.sleep(0.05)
+    return [str(i) for i in range(10000)]
+
+
+@pytest.mark.parametrize(
+    "mode, suffixes",
+    [
+        ("cprofile", [".pstats"]),
+        ("stacks", [".collapsed"]),
+        ("memory", [".txt", ".tracemalloc"]),
+    ],
+)
+def test_profile_writes_the_output(tmp_path, mode, suffixes):
+    with profiling.profile(mode, tmp_path, "command") as path:
+        _work()
+
+    assert path.name.startswith("command-")
+    assert sorted(p.suffix for p in tmp_path.iterdir()) == sorted(suffixes)
+    if mode == "cprofile":
+        assert any(func[2] == "_work" for func in pstats.Stats(str(path) + ".pstats").stats)
+    if mode == "stacks":
+        assert "_work (test_profiling.py" in path.with_suffix(".collapsed").read_text()
+    if mode == "memory":
+        assert path.with_suffix(".txt").read_text().startswith("peak ")
@@ -0,0 +1,99 @@
+from src import rules
+
+
+def test_aho_corasick_finds_overlapping_keywords():
+    matcher = rules.AhoCorasick()
+    for keyword in ["he", "she", "his", "hers"]:
+        matcher.add(keyword)
+
+    assert matcher.search("ushers") == ["she", "he", "hers"]
+    assert matcher.search("nothing to see") == []
+
+
+def test_aho_corasick_finds_whole_words():
+    matcher = rules.AhoCorasick()
+    for keyword in ["uber", "bar", "netflix.com"]:
+        matcher.add(keyword)
+
+    assert matcher.search("huber bergsport", whole_words=True) == []
+    assert matcher.search("barber shop", whole_words=True) == []
+    assert matcher.search("uber *trip", whole_words=True) == ["uber"]
+    assert matcher.search("bar vintage/uber", whole_words=True) == ["bar", "uber"]
+    assert matcher.search("www.netflix.com", whole_words=True) == ["netflix.com"]
+    assert matcher.search("barber shop") == ["bar"]
+
+
+def test_keyword_rules_do_not_match_inside_words():
+    engine = rules.RuleEngine()
+    engine.add_rules({"keywords": {"uber": {"category": "Transport"}, "bar": {"category": "Food"}}})
+
+    assert engine.apply({"description": "Huber Bergsport", "category": ""}) == {}
+    assert engine.apply({"description": "Barber shop", "category": ""}) == {}
+    assert engine.apply({"description": "UBER *TRIP", "category": ""}) == {"category": "Transport"}
+
+
+def test_normalize_description():
+    assert rules.normalize_description("POS 12/03 COFFEE-BAR *4521") == "pos coffee bar"
+
+
+def test_rules_are_learned_only_when_always_the_same():
+    engine = rules.RuleEngine()
+    engine.learn(
+        [
+            {"description": "Netflix 01/23", "counterparty": "Netflix", "category": "Fun"},
+            {"description": "Netflix 02/23", "counterparty": "Netflix", "category": "Fun"},
+            {"description": "Amazon", "counterparty": "Amazon", "category": "Books"},
+            {"description": "Amazon", "counterparty": "Amazon", "category": "Home"},
+            {"description": "Once", "counterparty": "Once", "category": "Home"},
+        ]
+    )
+
+    assert engine.descriptions == {
+        "netflix": {"counterparty": "Netflix", "category": "Fun"},
+        "amazon": {"counterparty": "Amazon"},
+    }
+    assert engine.counterparties == {"Netflix": {"category": "Fun"}}
+
+
+def test_rules_fill_only_empty_fields():
+    engine = rules.RuleEngine()
+    engine.add_rules(
+        {
+            "description": {"TRENITALIA 123": {"counterparty": "Trenitalia"}},
+            "counterparty": {"Trenitalia": {"category": "Transport"}},
+            "keywords": {"bar": {"category": "Food"}, "bar centrale": {"category": "Coffee"}},
+        }
+    )
+
+    assert engine.apply({"description": "Trenitalia 456", "counterparty": "", "category": ""}) == {
+        "counterparty": "Trenitalia",
+        "category": "Transport",
+    }
+    assert engine.apply({"description": "Bar Centrale", "counterparty": "", "category": ""}) == {
+        "category": "Coffee"
+    }
+    assert engine.apply({"description": "Bar", "counterparty": "", "category": "Fun"}) == {}
+
+
+def test_user_rules_have_precedence_over_the_learned_ones():
+    engine = rules.RuleEngine()
+    engine.add_rules({"counterparty": {"Netflix": {"category": "Subscriptions"}}})
+    engine.learn(
+        [
+            {"description": "Netflix 01/23", "counterparty": "Netflix", "category": "Fun"},
+            {"description": "Netflix 02/23", "counterparty": "Netflix", "category": "Fun"},
+        ]
+    )
+
+    assert engine.apply({"description": "Netflix 03/23", "counterparty": "", "category": ""}) == {
+        "counterparty": "Netflix",
+        "category": "Subscriptions",
+    }
+
+
+def test_rules_ignore_the_fields_the_user_cannot_set(caplog):
+    engine = rules.RuleEngine()
+    engine.add_rules({"keywords": {"uber": {"category": "Transport", "amount": "0"}}})
+
+    assert engine.keywords == {"uber": {"category": "Transport"}}
+    assert "amount" in caplog.text
@@ -0,0 +1,84 @@
+import datetime
+import threading
+
+import pytest
+
+from src import classifiers, client, server
+from src.ledger_repos import sqlite
+from tests import factories
+
+
+@pytest.fixture
+def running_server(tmp_path):
+    socket_path = tmp_path / "test.sock"
+    db_path = tmp_path / "test.db"
+    started = threading.Event()
+    servers = []
+
+    def run():
+        # the SQLite connection is used in the thread it was created in
+        with sqlite.db_context(db_path) as db, server.PredictionServer(socket_path, db) as s:
+            servers.append(s)
+            started.set()
+            s.serve_forever()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    yield socket_path, db_path
+    servers[0].shutdown()
+    thread.join()
+
+
+def _save_counterparty_classifier(table):
+    classifier = classifiers.CounterpartyFromDescriptionClassifier()
+    classifier.table = table
+    classifier.save()
+
+
+def test_server_predicts_and_reloads_new_models(running_server):
+    socket_path, _ = running_server
+    _save_counterparty_classifier({"bar": ("Food", 1.0, 1.0)})
+    server_client = client.get_client(socket_path)
+    items = [{"description": "coffee", "counterparty": "Bar"}]
+    names = ["CounterpartyFromDescriptionClassifier"]
+
+    assert server_client.predict(items, classifier_names=names) == {
+        "CounterpartyFromDescriptionClassifier": [[{"category": "Food"}, 1.0, 1.0]]
+    }
+    _save_counterparty_classifier({"bar": ("Fun", 1.0, 1.0)})
+    assert server_client.predict(items, classifier_names=names) == {
+        "CounterpartyFromDescriptionClassifier": [[{"category": "Fun"}, 1.0, 1.0]]
+    }
+    with pytest.raises(client.ServerError, match="Unknown command"):
+        server_client.request("unknown")
+
+
+def test_server_guesses(running_server):
+    socket_path, db_path = running_server
+    _save_counterparty_classifier({"bar": ("Food", 1.0, 1.0)})
+    with sqlite.db_context(db_path) as db:
+        sqlite.LedgerItemRepo(db).insert(
+            [
+                factories.LedgerItemFactory(
+                    tx_date=datetime.date(2023, 2, 1), counterparty="Bar", category=""
+                )
+            ]
+        )
+
+    client.get_client(socket_path).guess(
+        months=["2023-02"],
+        classifier_names=["CounterpartyFromDescriptionClassifier"],
+        use_rules=False,
+    )
+
+    with sqlite.db_context(db_path) as db:
+        assert list(sqlite.query("SELECT category FROM ledger_items", db)) == [{"category": "Food"}]
+
+
+def test_get_client_ignores_stale_sockets(tmp_path):
+    socket_path = tmp_path / "test.sock"
+    assert client.get_client(socket_path) is None
+
+    socket_path.touch()
+    assert client.get_client(socket_path) is None
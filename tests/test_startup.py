@@ -0,0 +1,26 @@
+import subprocess
+import sys
+
+import pytest
+
+import config
+
+HEAVY_MODULES = ["pandas", "sklearn", "nltk", "scipy", "openpyxl", "googleapiclient", "splitwise"]
+
+
+def _imported_modules(module: str) -> set[str]:
+    # in a new interpreter, the tests have already imported everything in this one
+    code = f"import sys, {module}; print(' '.join(sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=config.ROOT_FOLDER,
+    )
+    return set(result.stdout.split())
+
+
+@pytest.mark.parametrize("module", ["src.commands", "src.extractors"])
+def test_startup_does_not_import_heavy_modules(module):
+    assert _imported_modules(module) & set(HEAVY_MODULES) == set()